@@ -0,0 +1,95 @@
+"""Cost per name of ОТДОВАЙ and ЗОПИШИ sent one by one against batch requests of several sizes, on loopback.
+
+Starts vragi-vezde.py and server_rksok.py with a generated phonebook in a temporary directory,
+then looks up and writes the same names with RKSOKPhoneBook: one request per name with 'process'
+and batches with 'get_phones' and 'write_phones'. The client sends one request at a time.
+
+Run from the repository root: python benchmarks/batch_bench.py --names 2000 --batch-sizes 10,100,1000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS)
+from e2e_bench import ROOT, get_free_port, stop, wait_for_port, write_config, write_phone_book
+from rksok_client import RKSOKPhoneBook, RequestVerb
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--names', type=int, default=2000, help='names looked up and written in every run')
+    parser.add_argument('--batch-sizes', default='10,100,1000', help='comma-separated')
+    parser.add_argument('--inspector-latency', type=float, default=0, help='milliseconds')
+    parser.add_argument('--keep-alive', action='store_true', help='server and client reuse connections')
+    parser.add_argument('--set', action='append', default=[], metavar='SECTION.KEY=VALUE',
+                        help='override a server setting of config.ini')
+    return parser.parse_args()
+
+
+def run_single(port: int, names: list, args: argparse.Namespace) -> tuple:
+    """Seconds per name of ОТДОВАЙ and of ЗОПИШИ, one request per name."""
+    client = RKSOKPhoneBook('127.0.0.1', port, args.keep_alive)
+    timings = []
+    for verb in (RequestVerb.GET, RequestVerb.WRITE):
+        client.set_verb(verb)
+        client.set_phone('+70000000000')
+        started = time.perf_counter()
+        for name in names:
+            client.set_name(name)
+            client.process()
+        timings.append((time.perf_counter() - started) / len(names))
+    client.close()
+    return tuple(timings)
+
+
+def run_batches(port: int, names: list, batch_size: int, args: argparse.Namespace) -> tuple:
+    """Seconds per name of ОТДОВАЙ and of ЗОПИШИ in batches of 'batch_size' names."""
+    client = RKSOKPhoneBook('127.0.0.1', port, args.keep_alive, batch_size)
+    started = time.perf_counter()
+    client.get_phones(names)
+    get = (time.perf_counter() - started) / len(names)
+    started = time.perf_counter()
+    client.write_phones({name: '+70000000000' for name in names})
+    write = (time.perf_counter() - started) / len(names)
+    client.close()
+    return get, write
+
+
+def main():
+    args = get_args()
+    names = [f'load{i}' for i in range(args.names)]
+    batch_sizes = [int(size) for size in args.batch_sizes.split(',')]
+    with tempfile.TemporaryDirectory() as workdir:
+        port, inspector_port = get_free_port(), get_free_port()
+        args.set = ['LOGGING.LEVEL=WARNING', 'LOGGING.CONSOLE=no', 'VERDICT_CACHE.GET_TTL=0', \
+            f'BATCH.MAX_ITEMS={max(batch_sizes)}'] + args.set
+        write_config(os.path.join(workdir, 'config.ini'), port, inspector_port, args)
+        write_phone_book(os.path.join(workdir, 'name_phone.json'), args.names)
+        inspector = subprocess.Popen([sys.executable, os.path.join(ROOT, 'vragi-vezde.py'), '127.0.0.1', \
+            str(inspector_port), '--approve-ratio', '1', '--latency', str(args.inspector_latency), '--quiet'], \
+            cwd=workdir, stdout=subprocess.DEVNULL)
+        server = None
+        try:
+            wait_for_port(inspector_port, inspector)
+            server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server_rksok.py')], cwd=workdir, \
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            wait_for_port(port, server)
+            print(f"{'requests':<16}{'GET us/name':>14}{'WRITE us/name':>16}")
+            single = run_single(port, names, args)
+            print(f"{'one per name':<16}{single[0] * 1e6:>14.1f}{single[1] * 1e6:>16.1f}")
+            for batch_size in batch_sizes:
+                get, write = run_batches(port, names, batch_size, args)
+                print(f"{f'batch of {batch_size}':<16}{get * 1e6:>14.1f}{write * 1e6:>16.1f}" \
+                    f"   x{single[0] / get:.0f} / x{single[1] / write:.0f}")
+        finally:
+            if server is not None:
+                stop(server)
+            stop(inspector)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Throughput of server_rksok.py against the number of cluster workers on loopback.
+
+For every number of workers, starts vragi-vezde.py and the server with [CLUSTER] WORKERS set
+in a temporary directory, then loads it from several client processes, so that the load generator
+does not become the bottleneck, and writes the results as JSON.
+
+Run from the repository root:
+python benchmarks/cluster_bench.py --workers 1,2,4,8 --clients 4 --output cluster.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS)
+from e2e_bench import ROOT, get_commit, get_free_port, stop, wait_for_port, write_config, write_phone_book
+from rksok_bulk import generate_load, make_load_report, parse_mix
+from rksok_client import AsyncRKSOKClient, RequestVerb
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', default='1,2,4', help='numbers of workers, comma-separated')
+    parser.add_argument('--clients', type=int, default=os.cpu_count(), help='load generator processes')
+    parser.add_argument('--concurrency', type=int, default=20, help='operations at once in every client')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of every run')
+    parser.add_argument('--mix', default='get=90,write=8,delete=2')
+    parser.add_argument('--book-size', type=int, default=10000)
+    parser.add_argument('--keep-alive', action='store_true', help='server and load generator reuse connections')
+    parser.add_argument('--set', action='append', default=[], metavar='SECTION.KEY=VALUE',
+                        help='override a server setting of config.ini')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='file for the JSON results, stdout by default')
+    return parser.parse_args()
+
+
+def run_client(port: int, seed: int, args: argparse.Namespace) -> dict:
+    """Load of one client process, latencies per verb name."""
+    random.seed(seed)
+
+    async def load() -> dict:
+        client = AsyncRKSOKClient('127.0.0.1', port, args.concurrency, args.keep_alive)
+        try:
+            return await generate_load(client, args.concurrency, args.duration, parse_mix(args.mix), args.book_size)
+        finally:
+            await client.close()
+
+    result = asyncio.run(load())
+    result['latencies'] = {verb.name: latencies for verb, latencies in result['latencies'].items()}
+    return result
+
+
+def merge_loads(loads: list) -> dict:
+    """Joins the loads of the client processes into one for make_load_report."""
+    latencies, statuses = {}, {}
+    for load in loads:
+        for verb, verb_latencies in load['latencies'].items():
+            latencies.setdefault(RequestVerb[verb], []).extend(verb_latencies)
+        for status, count in load['statuses'].items():
+            statuses[status] = statuses.get(status, 0) + count
+    return {'latencies': latencies, 'statuses': statuses}
+
+
+def run_workers(workers: int, args: argparse.Namespace) -> dict:
+    with tempfile.TemporaryDirectory() as workdir:
+        port, inspector_port = get_free_port(), get_free_port()
+        config_args = argparse.Namespace(**vars(args))
+        config_args.set = [f'CLUSTER.WORKERS={workers}', 'LOGGING.LEVEL=WARNING', *args.set]
+        write_config(os.path.join(workdir, 'config.ini'), port, inspector_port, config_args)
+        write_phone_book(os.path.join(workdir, 'name_phone.json'), args.book_size)
+        inspector = subprocess.Popen([sys.executable, os.path.join(ROOT, 'vragi-vezde.py'), '127.0.0.1', \
+            str(inspector_port), '--approve-ratio', '1', '--quiet'], cwd=workdir, stdout=subprocess.DEVNULL)
+        server = None
+        try:
+            wait_for_port(inspector_port, inspector)
+            server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server_rksok.py')], cwd=workdir, \
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            wait_for_port(port, server)
+            with multiprocessing.Pool(args.clients) as clients:
+                loads = clients.starmap(run_client, \
+                    [(port, args.seed + client, args) for client in range(args.clients)])
+        finally:
+            if server is not None:
+                stop(server)
+            stop(inspector)
+    report = make_load_report(merge_loads(loads), args.duration)
+    report.update(workers=workers, rps=round(sum(verb['rps'] for verb in report['verbs'].values()), 1))
+    return report
+
+
+def main():
+    args = get_args()
+    results = []
+    for workers in (int(number) for number in args.workers.split(',')):
+        results.append(run_workers(workers, args))
+        speedup = results[-1]['rps'] / results[0]['rps']
+        print(f"workers={workers:<4} {results[-1]['rps']:>9.1f} rps {speedup:>6.2f}x", file=sys.stderr)
+    report = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'clients': args.clients,
+        'concurrency': args.concurrency,
+        'duration_s': args.duration,
+        'mix': args.mix,
+        'book_size': args.book_size,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
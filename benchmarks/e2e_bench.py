@@ -0,0 +1,206 @@
+"""End-to-end benchmark of server_rksok.py on loopback.
+
+For every phonebook size, starts vragi-vezde.py with a fixed approve ratio and latency
+and server_rksok.py with a generated phonebook in a temporary directory, then runs
+the load scenarios of rksok_bulk.py at every concurrency and writes the results as JSON.
+The exit code is 1 if the server answered НИПОНЯЛ in a scenario: it measured rejections, not the load.
+
+Run from the repository root:
+python benchmarks/e2e_bench.py --book-sizes 1000,100000 --concurrency 1,10,50 --output bench.json
+"""
+import argparse
+import asyncio
+import configparser
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from rksok_bulk import generate_load, make_load_report, parse_mix
+from rksok_client import AsyncRKSOKClient
+
+
+# Verb weights and phones per WRITE of every scenario.
+SCENARIOS = {
+    'get-heavy': ('get=95,write=4,delete=1', 1),
+    'write-heavy': ('get=10,write=85,delete=5', 1),
+    'mixed': ('get=50,write=40,delete=10', 1),
+    'large-payload': ('get=50,write=50', 100),
+}
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated')
+    parser.add_argument('--book-sizes', default='1000,100000', help='names in the phonebook, comma-separated')
+    parser.add_argument('--concurrency', default='1,10,50', help='comma-separated')
+    parser.add_argument('--duration', type=float, default=5, help='seconds of every run')
+    parser.add_argument('--approve-ratio', type=float, default=1.0, help='share of requests the inspector approves')
+    parser.add_argument('--inspector-latency', type=float, default=0, help='milliseconds')
+    parser.add_argument('--keep-alive', action='store_true', help='server and load generator reuse connections')
+    parser.add_argument('--set', action='append', default=[], metavar='SECTION.KEY=VALUE',
+                        help='override a server setting of config.ini')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the load generator')
+    parser.add_argument('--output', help='file for the JSON results, stdout by default')
+    return parser.parse_args()
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{process.args} exited with code {process.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'{process.args} does not listen on {port}')
+
+
+def write_phone_book(path: str, book_size: int) -> None:
+    """Names load0 ... load{book_size-1}, the names the load generator uses."""
+    phone_book = {f'LOAD{i}': [f'+7{i:010}'] for i in range(book_size)}
+    with open(path, 'w', encoding='UTF-8') as f:
+        json.dump(phone_book, f, ensure_ascii=False)
+
+
+def payload_settings(scenarios: list) -> list:
+    """Request limits of config.ini raised, if needed, for the WRITEs of the scenarios: the request line
+    and the phones, up to 32 bytes each."""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(ROOT, 'config.ini'))
+    phones = max(SCENARIOS[scenario][1] for scenario in scenarios)
+    return [f"SETTINGS.MAX_REQUEST_LINES={max(phones + 1, int(config['SETTINGS']['MAX_REQUEST_LINES']))}",
+            f"SETTINGS.MAX_REQUEST_SIZE={max(phones * 32 + 128, int(config['SETTINGS']['MAX_REQUEST_SIZE']))}"]
+
+
+def write_config(path: str, port: int, inspector_port: int, args: argparse.Namespace) -> dict:
+    """Writes config.ini of the server run, returns the settings changed from the repository config."""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(ROOT, 'config.ini'))
+    settings = {
+        'PROXY.PORT': str(port),
+        'INSPECTOR.DOMAIN': '127.0.0.1',
+        'INSPECTOR.PORT': str(inspector_port),
+        'SETTINGS.KEEP_ALIVE': 'yes' if args.keep_alive else 'no',
+    }
+    for setting in args.set:
+        key, value = setting.split('=', 1)
+        settings[key] = value
+    for key, value in settings.items():
+        section, option = key.split('.')
+        config[section][option] = value
+    with open(path, 'w', encoding='UTF-8') as f:
+        config.write(f)
+    return settings
+
+
+def stop(process: subprocess.Popen) -> None:
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def run_scenarios(port: int, scenarios: list, concurrencies: list, book_size: int, \
+        args: argparse.Namespace) -> list:
+    results = []
+    for scenario in scenarios:
+        mix, phones = SCENARIOS[scenario]
+        for concurrency in concurrencies:
+            client = AsyncRKSOKClient('127.0.0.1', port, concurrency, args.keep_alive)
+            try:
+                load = await generate_load(client, concurrency, args.duration, parse_mix(mix), book_size, phones)
+            finally:
+                await client.close()
+            report = make_load_report(load, args.duration)
+            report.update(scenario=scenario, book_size=book_size, concurrency=concurrency)
+            results.append(report)
+            total = sum(verb['rps'] for verb in report['verbs'].values())
+            print(f'{scenario:<14} book={book_size:<8} concurrency={concurrency:<4} {total:>9.1f} rps', \
+                file=sys.stderr)
+    return results
+
+
+def run_book_size(book_size: int, scenarios: list, concurrencies: list, args: argparse.Namespace) -> tuple:
+    with tempfile.TemporaryDirectory() as workdir:
+        port, inspector_port = get_free_port(), get_free_port()
+        settings = write_config(os.path.join(workdir, 'config.ini'), port, inspector_port, args)
+        write_phone_book(os.path.join(workdir, 'name_phone.json'), book_size)
+        inspector_args = [sys.executable, os.path.join(ROOT, 'vragi-vezde.py'), '127.0.0.1', str(inspector_port),
+            '--approve-ratio', str(args.approve_ratio), '--latency', str(args.inspector_latency), '--quiet']
+        inspector = subprocess.Popen(inspector_args, cwd=workdir, stdout=subprocess.DEVNULL)
+        server = None
+        try:
+            wait_for_port(inspector_port, inspector)
+            server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server_rksok.py')], cwd=workdir, \
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            wait_for_port(port, server)
+            return asyncio.run(run_scenarios(port, scenarios, concurrencies, book_size, args)), settings
+        finally:
+            if server is not None:
+                stop(server)
+            stop(inspector)
+
+
+def get_commit() -> str or None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, \
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = get_args()
+    random.seed(args.seed)
+    scenarios = args.scenarios.split(',')
+    concurrencies = [int(concurrency) for concurrency in args.concurrency.split(',')]
+    args.set = payload_settings(scenarios) + args.set
+    results, settings = [], {}
+    for book_size in (int(size) for size in args.book_sizes.split(',')):
+        book_results, settings = run_book_size(book_size, scenarios, concurrencies, args)
+        results += book_results
+    report = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'duration_s': args.duration,
+        'approve_ratio': args.approve_ratio,
+        'inspector_latency_ms': args.inspector_latency,
+        'seed': args.seed,
+        'settings': settings,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    rejected = [result for result in results if result['statuses'].get('INCORRECT_REQUEST')]
+    for result in rejected:
+        print(f"{result['scenario']} book={result['book_size']} concurrency={result['concurrency']}: " \
+            f"{result['statuses']['INCORRECT_REQUEST']} requests answered НИПОНЯЛ", file=sys.stderr)
+    if rejected:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Per-request cost of logging in server_rksok.py: the request handling without the network,
+with logging off and with every [LOGGING] setting that matters.
+
+The inspector always approves and answers at once, the phonebook is generated in a temporary directory.
+Run from the repository root: python benchmarks/logging_bench.py --requests 20000"""
+import argparse
+import asyncio
+import dataclasses
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+# LEVEL, ENQUEUE and SAMPLE of every run, level None - no sinks at all.
+VARIANTS = {
+    'off': (None, False, 1),
+    'WARNING': ('WARNING', False, 1),
+    'INFO': ('INFO', False, 1),
+    'INFO enqueue': ('INFO', True, 1),
+    'DEBUG': ('DEBUG', False, 1),
+    'DEBUG enqueue': ('DEBUG', True, 1),
+    'DEBUG enqueue 1%': ('DEBUG', True, 0.01),
+}
+
+
+class ApprovingInspector:
+    """Stands for the pool of inspector connections."""
+
+    def __init__(self, response: bytes):
+        self._response = response
+
+    async def ask(self, message: bytes, timeout: float = None) -> bytes:
+        return self._response
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=20000, help='requests of every run')
+    parser.add_argument('--book-size', type=int, default=10000, help='names in the phonebook')
+    parser.add_argument('--variants', default=','.join(VARIANTS), help='comma-separated')
+    return parser.parse_args()
+
+
+async def run(server_rksok, variant: str, requests: list) -> float:
+    """Returns the mean time of one request in seconds."""
+    level, enqueue, sample = VARIANTS[variant]
+    server_rksok.logger.remove()
+    if level is not None:
+        server_rksok.setup_logging(level, 'bench.log', None, enqueue, False)
+    server_rksok.settings = dataclasses.replace(server_rksok.settings, log_sample=sample)
+    addr = ('127.0.0.1', 50000)
+    started = time.perf_counter()
+    for request in requests:
+        await server_rksok.serve_request(request, addr)
+    elapsed = time.perf_counter() - started
+    # The records queued for the background thread are written before the next run.
+    await server_rksok.logger.complete()
+    return elapsed / len(requests)
+
+
+async def main():
+    args = get_args()
+    workdir = tempfile.mkdtemp()
+    try:
+        shutil.copy(os.path.join(ROOT, 'config.ini'), workdir)
+        with open(os.path.join(workdir, 'name_phone.json'), 'w', encoding='UTF-8') as f:
+            json.dump({f'LOAD{i}': [f'+7{i:010}'] for i in range(args.book_size)}, f)
+        os.chdir(workdir)
+        import server_rksok
+        server_rksok.verdict_caches.clear()
+        server_rksok.inspector = ApprovingInspector(server_rksok.settings.inspector_approved)
+        await server_rksok.store.load()
+        parser = server_rksok.make_request_parser()
+        requests = [parser.feed(f'ОТДОВАЙ load{i % args.book_size} РКСОК/1.0\r\n\r\n'.encode('UTF-8')) \
+            for i in range(args.requests)]
+        baseline = None
+        print(f"{'logging':<20}{'us/request':>12}{'overhead, us':>14}")
+        for variant in args.variants.split(','):
+            per_request = await run(server_rksok, variant, requests)
+            baseline = per_request if baseline is None else baseline
+            print(f'{variant:<20}{per_request * 1e6:>12.1f}{(per_request - baseline) * 1e6:>14.1f}')
+        server_rksok.logger.remove()
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,138 @@
+"""Memory per name and load time of the phonebook for several phonebook sizes.
+
+For every size, writes a generated name_phone.json to a temporary directory, then in a fresh process
+loads it with PhoneBookStore (and, with --indexed, imports it into IndexedPhoneBook and opens that)
+and reports the bytes allocated per name and the seconds of the load. Also reports the bytes per name
+of the former representation, the phones of a name kept as a list, for comparison.
+The exit code is 1 if a size misses the targets --max-bytes-per-name or --max-load-us-per-name.
+
+Run from the repository root: python benchmarks/memory_bench.py --book-sizes 10000,100000,1000000 --phones 1,3
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS)
+from e2e_bench import ROOT, get_commit
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--book-sizes', default='10000,100000,1000000', help='names in the phonebook, comma-separated')
+    parser.add_argument('--phones', default='1,3', help='phones per name, comma-separated')
+    parser.add_argument('--indexed', action='store_true', help='also measure the indexed phonebook')
+    parser.add_argument('--max-bytes-per-name', type=float, default=220, help='target of the json backend')
+    parser.add_argument('--max-load-us-per-name', type=float, default=3, help='target of the json backend')
+    parser.add_argument('--measure', nargs=3, metavar=('BACKEND', 'DIRECTORY', 'NAMES'), help=argparse.SUPPRESS)
+    parser.add_argument('--output', help='file for the JSON results, stdout by default')
+    return parser.parse_args()
+
+
+def write_phone_book(path: str, book_size: int, phones: int) -> None:
+    """Names of 8 to 14 letters with 'phones' phones of 12 characters, like the names of a real phonebook."""
+    phone_book = {f'ИМЯ{i:0{5 + i % 7}}': [f'+7{i:07}{j:03}' for j in range(phones)] for i in range(book_size)}
+    with open(path, 'w', encoding='UTF-8') as f:
+        json.dump(phone_book, f, ensure_ascii=False)
+
+
+async def load(backend: str, directory: str):
+    if backend == 'indexed':
+        from index_rksok import IndexedPhoneBook
+        store = IndexedPhoneBook(os.path.join(directory, 'name_phone.idx'), os.path.join(directory, 'name_phone.dat'))
+    else:
+        from store_rksok import PhoneBookStore
+        store = PhoneBookStore(os.path.join(directory, 'name_phone.json'), os.path.join(directory, 'name_phone.wal'), \
+            1, 100)
+    await store.load()
+    return store
+
+
+def measure(backend: str, directory: str, names: int) -> dict:
+    """Run in a fresh process: the memory of the phonebook loaded, the peak while loading and the load time.
+    'lists' is the phonebook as json.loads gives it, the phones of a name in a list."""
+    sys.path.insert(0, ROOT)
+    from loguru import logger
+    logger.remove()
+
+    def load_store():
+        if backend == 'lists':
+            with open(os.path.join(directory, 'name_phone.json'), encoding='UTF-8') as f:
+                return json.load(f)
+        return asyncio.run(load(backend, directory))
+
+    # The time is measured without tracemalloc, which slows down every allocation.
+    started = time.perf_counter()
+    store = load_store()
+    seconds = time.perf_counter() - started
+    del store
+    tracemalloc.start()
+    store = load_store()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del store
+    return {
+        'bytes_per_name': round(current / names, 1),
+        'peak_bytes_per_name': round(peak / names, 1),
+        'load_us_per_name': round(seconds / names * 1e6, 3),
+    }
+
+
+def run_measure(backend: str, directory: str, names: int) -> dict:
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure', backend, directory, str(names)], \
+        cwd=directory, capture_output=True, text=True, check=True).stdout
+    return json.loads(output)
+
+
+def main():
+    args = get_args()
+    if args.measure:
+        backend, directory, names = args.measure
+        print(json.dumps(measure(backend, directory, int(names))))
+        return
+    backends = ['lists', 'json'] + (['indexed'] if args.indexed else [])
+    results, missed = [], []
+    print(f"{'names':>9}{'phones':>8}{'backend':>9}{'B/name':>9}{'peak B/name':>13}{'load us/name':>14}", \
+        file=sys.stderr)
+    for book_size in (int(size) for size in args.book_sizes.split(',')):
+        for phones in (int(count) for count in args.phones.split(',')):
+            with tempfile.TemporaryDirectory() as directory:
+                write_phone_book(os.path.join(directory, 'name_phone.json'), book_size, phones)
+                if args.indexed:
+                    subprocess.run([sys.executable, os.path.join(ROOT, 'index_rksok.py'), 'import', \
+                        'name_phone.json'], cwd=directory, check=True, capture_output=True)
+                for backend in backends:
+                    result = run_measure(backend, directory, book_size)
+                    result.update(names=book_size, phones=phones, backend=backend)
+                    results.append(result)
+                    print(f"{book_size:>9}{phones:>8}{backend:>9}{result['bytes_per_name']:>9}" \
+                        f"{result['peak_bytes_per_name']:>13}{result['load_us_per_name']:>14}", file=sys.stderr)
+                    if backend == 'json' and (result['bytes_per_name'] > args.max_bytes_per_name or \
+                            result['load_us_per_name'] > args.max_load_us_per_name):
+                        missed.append(result)
+    report = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'targets': {'max_bytes_per_name': args.max_bytes_per_name, 'max_load_us_per_name': args.max_load_us_per_name},
+        'missed': missed,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    if missed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Behaviour of server_rksok.py under load far above what its inspector can serve, on loopback.
+
+vragi-vezde.py answers every request after a fixed latency and the server keeps only a few connections
+to it, so that it serves a known number of requests per second. The clients send many times more.
+Every variant of the admission control settings is run with the same load; without limits
+the requests queue up for the inspector and all of them get slow, with limits the excess is
+turned away at once with the busy response (status INCORRECT_REQUEST) and the admitted requests stay fast.
+
+Run from the repository root:
+python benchmarks/overload_bench.py --concurrency 200 --inspector-latency 50 --output overload.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS)
+from e2e_bench import ROOT, get_commit, get_free_port, stop, wait_for_port, write_config, write_phone_book
+from rksok_bulk import generate_load, make_load_report, parse_mix
+from rksok_client import AsyncRKSOKClient
+
+
+# Settings of config.ini changed by every variant, on top of the common ones of the run.
+VARIANTS = {
+    'unbounded': {
+        'INSPECTOR.TIMEOUT': '3600',
+        'INSPECTOR.MAX_WAITING': '1000000',
+        'SETTINGS.REQUEST_TIMEOUT': '3600',
+        'SETTINGS.MAX_CONNECTIONS': '1000000',
+    },
+    'bounded': {
+        'INSPECTOR.TIMEOUT': '1',
+        'INSPECTOR.MAX_WAITING': '10',
+        'SETTINGS.REQUEST_TIMEOUT': '1',
+        'SETTINGS.MAX_CONNECTIONS': '100',
+    },
+}
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--variants', default=','.join(VARIANTS), help='comma-separated')
+    parser.add_argument('--concurrency', type=int, default=200, help='requests at once')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of every run')
+    parser.add_argument('--inspector-latency', type=float, default=50, help='milliseconds')
+    parser.add_argument('--pool-size', type=int, default=2, help='connections to the inspector')
+    parser.add_argument('--mix', default='get=90,write=8,delete=2')
+    parser.add_argument('--book-size', type=int, default=10000)
+    parser.add_argument('--keep-alive', action='store_true', help='server and load generator reuse connections')
+    parser.add_argument('--set', action='append', default=[], metavar='SECTION.KEY=VALUE',
+                        help='override a server setting of config.ini')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='file for the JSON results, stdout by default')
+    return parser.parse_args()
+
+
+async def run_load(port: int, args: argparse.Namespace) -> dict:
+    client = AsyncRKSOKClient('127.0.0.1', port, args.concurrency, args.keep_alive)
+    try:
+        load = await generate_load(client, args.concurrency, args.duration, parse_mix(args.mix), args.book_size)
+    finally:
+        await client.close()
+    return make_load_report(load, args.duration)
+
+
+def run_variant(variant: str, args: argparse.Namespace) -> tuple:
+    with tempfile.TemporaryDirectory() as workdir:
+        port, inspector_port = get_free_port(), get_free_port()
+        variant_args = argparse.Namespace(**vars(args))
+        # The verdict cache would answer most requests without the inspector.
+        variant_args.set = [f'{key}={value}' for key, value in VARIANTS[variant].items()] + [
+            f'INSPECTOR.POOL_SIZE={args.pool_size}', 'INSPECTOR.PIPELINE_DEPTH=1', 'VERDICT_CACHE.GET_TTL=0',
+            'LOGGING.LEVEL=WARNING', 'LOGGING.CONSOLE=no'] + args.set
+        settings = write_config(os.path.join(workdir, 'config.ini'), port, inspector_port, variant_args)
+        write_phone_book(os.path.join(workdir, 'name_phone.json'), args.book_size)
+        inspector = subprocess.Popen([sys.executable, os.path.join(ROOT, 'vragi-vezde.py'), '127.0.0.1', \
+            str(inspector_port), '--approve-ratio', '1', '--latency', str(args.inspector_latency), '--quiet'], \
+            cwd=workdir, stdout=subprocess.DEVNULL)
+        server = None
+        try:
+            wait_for_port(inspector_port, inspector)
+            server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server_rksok.py')], cwd=workdir, \
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            wait_for_port(port, server)
+            report = asyncio.run(run_load(port, args))
+        finally:
+            if server is not None:
+                stop(server)
+            stop(inspector)
+    return report, settings
+
+
+def main():
+    args = get_args()
+    random.seed(args.seed)
+    capacity = args.pool_size * 1000 / args.inspector_latency if args.inspector_latency else None
+    results = []
+    for variant in args.variants.split(','):
+        report, settings = run_variant(variant, args)
+        report.update(variant=variant, settings=settings)
+        results.append(report)
+        latencies = report['verbs'].get('GET', {})
+        print(f"{variant:<10} statuses={report['statuses']} GET p50={latencies.get('p50_ms')} ms " \
+            f"p99={latencies.get('p99_ms')} ms", file=sys.stderr)
+    report = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'concurrency': args.concurrency,
+        'duration_s': args.duration,
+        'inspector_latency_ms': args.inspector_latency,
+        'inspector_capacity_rps': capacity,
+        'seed': args.seed,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""Microbenchmark of reading and parsing client requests: the incremental RequestParser
+against the former read loop with bytes concatenation, check_request_client and parse_message_received,
+then the requests per second of RequestParser with the limits of config.ini, on correct requests
+and on adversarial ones: split into one-byte chunks through multi-byte characters, huge, without an end.
+
+A run saved with --output is the baseline of the next ones: with --baseline, the exit code is 1
+if a scenario parses more than --tolerance fewer requests per second than in the baseline.
+tests/test_parser_speed.py checks the rates against its baseline under pytest, relative to the machine.
+The correctness of the parser is checked by parser_fuzz.py.
+
+Run from the repository root: python benchmarks/parser_bench.py --output parser.json
+then, after a change of the parser: python benchmarks/parser_bench.py --baseline parser.json"""
+import argparse
+import configparser
+import json
+import os
+import re
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from parser_rksok import IncorrectRequestError, RequestParser
+
+
+ENCODING = 'UTF-8'
+PROTOCOL = 'РКСОК/1.0'
+METHODS = {'ОТДОВАЙ', 'УДОЛИ', 'ЗОПИШИ'}
+END_S = '\r\n'
+EMPTY_S_B = b'\r\n\r\n'
+CHUNK = 1024
+
+
+def former_read_and_parse(chunks: list) -> tuple:
+    """The request handling replaced by RequestParser, without the I/O and the logging."""
+    data = chunks[0]
+    for chunk in chunks[1:]:
+        if data.endswith(EMPTY_S_B):
+            break
+        data += chunk
+    raw_request = data.decode(ENCODING)
+    # check_request_client
+    if not (PROTOCOL in raw_request and raw_request.split()[0] in METHODS):
+        return None
+    len_of_name = len(re.split(r' ', raw_request.split(PROTOCOL)[0], maxsplit = 1)[-1].strip())
+    if not 0 < len_of_name <= 30:
+        return None
+    # parse_message_received and the phones slicing of write_name_phone
+    name_for_phone = re.split(r' ', raw_request.split(PROTOCOL)[0], maxsplit = 1)[-1].strip().upper()
+    method = raw_request.split()[0]
+    data_phone = re.split(rf'{END_S}', raw_request.split(PROTOCOL)[1])
+    phone = ()
+    for number in data_phone[1:(len(data_phone)-2)]:
+        if number:
+            phone += (number,)
+    return method, name_for_phone, phone
+
+
+# One parser serves all the requests of a connection.
+parser = RequestParser(METHODS, PROTOCOL, ENCODING, 30, 16 * 1024 * 1024, 1024 * 1024)
+
+
+def incremental_parse(chunks: list) -> tuple:
+    for chunk in chunks:
+        request = parser.feed(chunk)
+        if request is not None:
+            return request.method, request.name, request.phones
+
+
+def measure(function) -> float:
+    """Returns the best time of one call in seconds."""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=3, number=number)) / number
+
+
+def make_chunks(request: str) -> list:
+    data = request.encode(ENCODING)
+    return [data[i:i + CHUNK] for i in range(0, len(data), CHUNK)]
+
+
+def read_limits() -> tuple:
+    """The limits of RequestParser the server has by default."""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(ROOT, 'config.ini'))
+    return int(config['REQUEST_METHODS']['len_name']), int(config['SETTINGS']['MAX_REQUEST_SIZE']), \
+        int(config['SETTINGS']['MAX_REQUEST_LINES']), config['BATCH']['PROTOCOL'], int(config['BATCH']['MAX_ITEMS'])
+
+
+LIMITS = read_limits()
+
+
+def make_limited_parser() -> RequestParser:
+    return RequestParser(METHODS, PROTOCOL, ENCODING, *LIMITS)
+
+
+def parse_or_reject(chunks: list) -> bool:
+    """Feeds the chunks to a new parser, as a new connection would. Returns whether the request is parsed;
+    a rejected request ends its connection."""
+    parser = make_limited_parser()
+    try:
+        for chunk in chunks:
+            if parser.feed(chunk) is not None:
+                return True
+    except IncorrectRequestError:
+        return False
+    return False
+
+
+def make_throughput_scenarios() -> dict:
+    """Chunks of the request and whether it is parsed or rejected."""
+    name = 'Ёжик Туманович'
+    get = f'ОТДОВАЙ {name} РКСОК/1.0\r\n\r\n'.encode(ENCODING)
+    batch = f'ОТДОВАЙ 100 РКСОК-ПАЧКА/1.0\r\n'.encode(ENCODING) + \
+        ''.join(f'{name} {i}\r\n' for i in range(100)).encode(ENCODING) + b'\r\n'
+    write = make_chunks(f'ЗОПИШИ {name} РКСОК/1.0\r\n' + '+7 900 000-00-00\r\n' * 90 + '\r\n')
+    return {
+        'ОТДОВАЙ': ([get], True),
+        'ОТДОВАЙ 1-byte chunks': ([get[i:i + 1] for i in range(len(get))], True),
+        'ЗОПИШИ 90 phones': (write, True),
+        'batch ОТДОВАЙ 100': (make_chunks(batch.decode(ENCODING)), True),
+        'rejected: no method': ([b'GET / HTTP/1.1\r\nHost: rksok\r\n\r\n'], False),
+        'rejected: long name': ([f'ОТДОВАЙ {"ß" * 20} РКСОК/1.0\r\n\r\n'.encode(ENCODING)], False),
+        'rejected: not UTF-8': ([get[:12] + b'\xff' + get[12:]], False),
+        'rejected: 1 MiB, no end': ([get[:-4]] + [b'7' * CHUNK] * 1024, False),
+        'rejected: 10k lines': ([get[:-2]] + [b'1\r\n' * (CHUNK // 3)] * 40, False),
+    }
+
+
+def compare_parsers() -> None:
+    scenarios = {
+        'ОТДОВАЙ': 'ОТДОВАЙ Иван Иванович РКСОК/1.0\r\n\r\n',
+        'ЗОПИШИ 10 phones': 'ЗОПИШИ Иван РКСОК/1.0\r\n' + '+7 900 000-00-00\r\n' * 10 + '\r\n',
+        'ЗОПИШИ 1000 phones': 'ЗОПИШИ Иван РКСОК/1.0\r\n' + '+7 900 000-00-00\r\n' * 1000 + '\r\n',
+        'ЗОПИШИ 5000 phones': 'ЗОПИШИ Иван РКСОК/1.0\r\n' + '+7 900 000-00-00\r\n' * 5000 + '\r\n',
+    }
+    print(f"{'scenario':<22}{'former, us':>14}{'parser, us':>14}{'speedup':>10}")
+    for scenario, request in scenarios.items():
+        chunks = make_chunks(request)
+        assert former_read_and_parse(chunks) == incremental_parse(chunks)
+        former = measure(lambda: former_read_and_parse(chunks))
+        incremental = measure(lambda: incremental_parse(chunks))
+        print(f'{scenario:<22}{former * 1e6:>14.1f}{incremental * 1e6:>14.1f}{former / incremental:>9.1f}x')
+
+
+def measure_throughput() -> dict:
+    """Requests per second of every scenario."""
+    results = {}
+    print(f"\n{'scenario':<26}{'requests/s':>14}")
+    for scenario, (chunks, parsed) in make_throughput_scenarios().items():
+        assert parse_or_reject(chunks) == parsed, scenario
+        results[scenario] = round(1 / measure(lambda: parse_or_reject(chunks)))
+        print(f'{scenario:<26}{results[scenario]:>14}')
+    return results
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--output', help='file to save the requests per second to')
+    parser.add_argument('--baseline', help='file saved with --output by an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='share of the baseline a scenario may lose')
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    compare_parsers()
+    results = measure_throughput()
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='UTF-8') as f:
+            baseline = json.load(f)
+        slower = {scenario: (rps, baseline[scenario]) for scenario, rps in results.items() \
+            if scenario in baseline and rps < baseline[scenario] * (1 - args.tolerance)}
+        for scenario, (rps, baseline_rps) in slower.items():
+            print(f'SLOWER {scenario}: {rps} requests/s, baseline {baseline_rps}')
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
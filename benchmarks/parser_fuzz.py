@@ -0,0 +1,55 @@
+"""Property and fuzz checks of RequestParser, the first code that sees the bytes of the clients.
+
+Every request is parsed as well by 'reference', a plain reading of the protocol that sees the whole request
+at once. The properties checked:
+- however the bytes are split into chunks (one byte at a time, inside a multi-byte character, between
+  \\r and \\n), the parser gives what the reference gives: the same method, name, phones and items,
+  or IncorrectRequestError - and no other exception;
+- the requests pipelined on one connection are parsed one after another up to the first incorrect one;
+- bytes without the end of the request are never kept beyond the size limit.
+Requests are generated at random and mutated (bytes flipped, cut, doubled, line ends and invalid UTF-8
+inserted); the CORPUS of adversarial requests is checked with its expected verdicts on every run.
+A failure prints the seed, the bytes and the chunks that reproduce it, and the exit code is 1.
+The reference, the corpus and the generators are in tests/parser_reference.py, shared with the tests.
+
+Run from the repository root: python benchmarks/parser_fuzz.py --iterations 20000 --seed 1
+"""
+import argparse
+import random
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+from parser_reference import CORPUS, CORPUS_BYTES, ENCODING, check, random_stream
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--iterations', type=int, default=20000, help='random requests and streams')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    rng = random.Random(args.seed)
+    failures = []
+    for text, verdict in CORPUS:
+        check(text.encode(ENCODING), rng, failures, verdict)
+    for data, verdict in CORPUS_BYTES:
+        check(data, rng, failures, verdict)
+    corpus_failures = len(failures)
+    for _ in range(args.iterations):
+        check(random_stream(rng), rng, failures)
+    for data, chunks, parsed, verdicts in failures[:10]:
+        print(f'FAILED {data!r}\n  chunks: {[len(chunk) for chunk in chunks]}\n  parser: {parsed}\n  expected: {verdicts}')
+    print(f'corpus: {len(CORPUS) + len(CORPUS_BYTES)} requests, {corpus_failures} failed; ' \
+        f'random: {args.iterations} streams, {len(failures) - corpus_failures} failed (seed {args.seed})')
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""Replication of server_rksok.py on loopback: a primary and read-only followers.
+
+Starts vragi-vezde.py, a primary and several followers with a generated phonebook in temporary directories, then
+- writes names to the primary one by one and measures how long every write takes to be seen on every follower
+  (the followers have their response cache on, the names are looked up before they are changed);
+- writes names through a follower (WRITES = forward) and checks them on the primary and the followers;
+- restarts the primary, writes again and measures how long the followers take to catch up;
+- checks that every follower has the same phones as the primary for all names written.
+The lag gauge of the first follower is read from its metrics at the end.
+
+Run from the repository root: python benchmarks/replication_bench.py --followers 2 --writes 500 --output repl.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS)
+from e2e_bench import ROOT, get_commit, get_free_port, stop, wait_for_port, write_config, write_phone_book
+from rksok_client import AsyncRKSOKClient, ResponseStatus
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--followers', type=int, default=2)
+    parser.add_argument('--writes', type=int, default=500, help='names written to the primary one by one')
+    parser.add_argument('--forwarded', type=int, default=50, help='names written through a follower')
+    parser.add_argument('--book-size', type=int, default=10000)
+    parser.add_argument('--catch-up-timeout', type=float, default=30, help='seconds a follower has to see a write')
+    parser.add_argument('--keep-alive', action='store_true', help='servers and clients reuse connections')
+    parser.add_argument('--set', action='append', default=[], metavar='SECTION.KEY=VALUE',
+                        help='override a setting of config.ini of all servers')
+    parser.add_argument('--output', help='file for the JSON results, stdout by default')
+    return parser.parse_args()
+
+
+class Cluster:
+    """The processes of the run, each server in its own directory."""
+
+    def __init__(self, workdir: str, args: argparse.Namespace):
+        self.workdir = workdir
+        self.args = args
+        self.inspector_port = get_free_port()
+        self.primary_port, self.replication_port = get_free_port(), get_free_port()
+        self.follower_ports = [get_free_port() for _ in range(args.followers)]
+        self.metrics_port = get_free_port()
+        self.inspector = None
+        self.primary = None
+        self.followers = []
+
+    def start(self) -> None:
+        self.inspector = subprocess.Popen([sys.executable, os.path.join(ROOT, 'vragi-vezde.py'), '127.0.0.1', \
+            str(self.inspector_port), '--approve-ratio', '1', '--quiet'], cwd=self.workdir, stdout=subprocess.DEVNULL)
+        wait_for_port(self.inspector_port, self.inspector)
+        primary_dir = os.path.join(self.workdir, 'primary')
+        os.mkdir(primary_dir)
+        self.write_config(primary_dir, self.primary_port, ['REPLICATION.ROLE=primary', \
+            f'REPLICATION.PORT={self.replication_port}'])
+        write_phone_book(os.path.join(primary_dir, 'name_phone.json'), self.args.book_size)
+        self.start_primary()
+        for number, port in enumerate(self.follower_ports):
+            follower_dir = os.path.join(self.workdir, f'follower{number}')
+            os.mkdir(follower_dir)
+            metrics = [f'METRICS.ENABLED=yes', f'METRICS.PORT={self.metrics_port}'] if number == 0 else []
+            self.write_config(follower_dir, port, ['REPLICATION.ROLE=follower', \
+                f'REPLICATION.PRIMARY_PORT={self.replication_port}', \
+                f'REPLICATION.PRIMARY_RKSOK_PORT={self.primary_port}', 'REPLICATION.RECONNECT_INTERVAL=0.2', \
+                f"REPLICATION.FORWARD_KEEP_ALIVE={'yes' if self.args.keep_alive else 'no'}"] + metrics)
+            follower = self.start_server(follower_dir)
+            self.followers.append(follower)
+            wait_for_port(port, follower)
+
+    def write_config(self, directory: str, port: int, settings: list) -> None:
+        args = argparse.Namespace(**vars(self.args))
+        args.set = ['LOGGING.LEVEL=WARNING', 'LOGGING.CONSOLE=no', 'METRICS.ENABLED=no', \
+            'REPLICATION.HEARTBEAT_INTERVAL=0.2'] + settings + self.args.set
+        write_config(os.path.join(directory, 'config.ini'), port, self.inspector_port, args)
+
+    def start_server(self, directory: str) -> subprocess.Popen:
+        return subprocess.Popen([sys.executable, os.path.join(ROOT, 'server_rksok.py')], cwd=directory, \
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def start_primary(self) -> None:
+        self.primary = self.start_server(os.path.join(self.workdir, 'primary'))
+        wait_for_port(self.primary_port, self.primary)
+        wait_for_port(self.replication_port, self.primary)
+
+    def stop(self) -> None:
+        for process in self.followers + [self.primary, self.inspector]:
+            if process is not None:
+                stop(process)
+
+
+def percentiles(values: list) -> dict:
+    values = sorted(values)
+    if not values:
+        return {}
+    return {f'p{p}_ms': round(values[min(len(values) - 1, len(values) * p // 100)] * 1000, 3) for p in (50, 90, 99)} \
+        | {'max_ms': round(values[-1] * 1000, 3)}
+
+
+async def wait_visible(client: AsyncRKSOKClient, name: str, phone: str or None, timeout: float) -> float:
+    """Looks the name up until the follower has 'phone' for it (None - until it has no phones), returns the time."""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        response = await client.get(name)
+        if phone is None and response.status == ResponseStatus.NOTFOUND or \
+                phone is not None and response.status == ResponseStatus.OK and response.payload == [phone]:
+            return time.perf_counter() - started
+    raise RuntimeError(f'{name} is not {phone!r} on a follower after {timeout} seconds')
+
+
+async def measure_lag(primary: AsyncRKSOKClient, followers: list, names: list, phone: str, timeout: float) -> list:
+    """Writes the names to the primary one by one, returns the seconds until every write is seen by every follower."""
+    lags = [[] for _ in followers]
+    for name in names:
+        # The old response is in the response caches of the followers.
+        await asyncio.gather(*(follower.get(name) for follower in followers))
+        response = await primary.write(name, phone)
+        if response.status != ResponseStatus.OK:
+            raise RuntimeError(f'The primary answered {response.raw!r}')
+        for follower_lags, lag in zip(lags, await asyncio.gather( \
+                *(wait_visible(follower, name, phone, timeout) for follower in followers))):
+            follower_lags.append(lag)
+    return lags
+
+
+async def check_consistency(primary: AsyncRKSOKClient, followers: list, names: list) -> int:
+    """Returns the number of names for which a follower answers other than the primary."""
+    mismatches = 0
+    for name in names:
+        responses = await asyncio.gather(primary.get(name), *(follower.get(name) for follower in followers))
+        mismatches += any(response.raw != responses[0].raw for response in responses[1:])
+    return mismatches
+
+
+def read_lag_gauge(port: int) -> dict:
+    with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=5) as response:
+        lines = response.read().decode().splitlines()
+    return {line.split()[0]: float(line.split()[1]) for line in lines if line.startswith('rksok_replication_')}
+
+
+async def run(cluster: Cluster, args: argparse.Namespace) -> dict:
+    primary = AsyncRKSOKClient('127.0.0.1', cluster.primary_port, 10, args.keep_alive)
+    followers = [AsyncRKSOKClient('127.0.0.1', port, 10, args.keep_alive) for port in cluster.follower_ports]
+    try:
+        names = [f'load{i}' for i in range(args.writes)]
+        lags = await measure_lag(primary, followers, names, '+79990000001', args.catch_up_timeout)
+        report = {'write_visibility': [percentiles(follower_lags) for follower_lags in lags]}
+
+        forwarded = [f'forwarded{i}' for i in range(args.forwarded)]
+        started = time.perf_counter()
+        statuses = [(await followers[0].write(name, '+79990000002')).status for name in forwarded]
+        forwarding = (time.perf_counter() - started) / max(len(forwarded), 1)
+        for name in forwarded:
+            await asyncio.gather(*(wait_visible(client, name, '+79990000002', args.catch_up_timeout) \
+                for client in [primary] + followers))
+        report['forwarded_writes'] = {'ok': statuses.count(ResponseStatus.OK), 'sent': len(forwarded), \
+            'ms_per_write': round(forwarding * 1000, 3)}
+
+        # The followers keep serving their copy while the primary is down and copy the phonebook again after.
+        stop(cluster.primary)
+        await primary.close()
+        served = [(await follower.get(names[0])).status == ResponseStatus.OK for follower in followers]
+        cluster.start_primary()
+        started = time.perf_counter()
+        await primary.delete(names[0])
+        await asyncio.gather(*(wait_visible(follower, names[0], None, args.catch_up_timeout) \
+            for follower in followers))
+        report['primary_restart'] = {'served_while_down': all(served), \
+            'catch_up_ms': round((time.perf_counter() - started) * 1000, 3)}
+
+        report['mismatched_names'] = await check_consistency(primary, followers, names + forwarded)
+        report['follower0_gauges'] = read_lag_gauge(cluster.metrics_port)
+        return report
+    finally:
+        await primary.close()
+        for follower in followers:
+            await follower.close()
+
+
+def main():
+    args = get_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        cluster = Cluster(workdir, args)
+        try:
+            cluster.start()
+            results = asyncio.run(run(cluster, args))
+        finally:
+            cluster.stop()
+    for number, visibility in enumerate(results['write_visibility']):
+        print(f'follower{number}: write visible after p50={visibility.get("p50_ms")} ms ' \
+            f'p99={visibility.get("p99_ms")} ms max={visibility.get("max_ms")} ms', file=sys.stderr)
+    print(f"forwarded: {results['forwarded_writes']}, restart: {results['primary_restart']}, " \
+        f"mismatched names: {results['mismatched_names']}", file=sys.stderr)
+    report = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'followers': args.followers,
+        'writes': args.writes,
+        'book_size': args.book_size,
+        'keep_alive': args.keep_alive,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
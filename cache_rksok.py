@@ -0,0 +1,55 @@
+"""Cache of the encoded ОТДОВАЙ responses of the RKSOK server: a hit is sent without touching the phonebook."""
+import collections
+
+
+class ResponseCache:
+    """Responses to ОТДОВАЙ by name, ready to be sent. At most 'max_bytes' bytes of responses are kept,
+    the least recently used one is evicted first.
+
+    A change of the name invalidates its response. A response looked up before an invalidation may be stale,
+    so it is cached only if nothing was invalidated since its lookup started: 'put' gets the 'epoch'
+    read before the lookup."""
+
+    def __init__(self, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._responses = collections.OrderedDict()
+        self.size = 0
+        self.epoch = 0
+        self.hits, self.misses = 0, 0
+
+    def get(self, name: str) -> bytes or None:
+        response = self._responses.get(name)
+        if response is None:
+            self.misses += 1
+            return None
+        self._responses.move_to_end(name)
+        self.hits += 1
+        return response
+
+    def put(self, name: str, response: bytes, epoch: int) -> None:
+        if epoch != self.epoch or len(response) > self._max_bytes:
+            return
+        previous = self._responses.pop(name, None)
+        if previous is not None:
+            self.size -= len(previous)
+        self._responses[name] = response
+        self.size += len(response)
+        while self.size > self._max_bytes:
+            _, evicted = self._responses.popitem(last=False)
+            self.size -= len(evicted)
+
+    def invalidate(self, name: str) -> None:
+        self.epoch += 1
+        response = self._responses.pop(name, None)
+        if response is not None:
+            self.size -= len(response)
+
+    def clear(self) -> None:
+        """Drops all responses, e.g. when the settings they were made with change."""
+        self.epoch += 1
+        self._responses.clear()
+        self.size = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
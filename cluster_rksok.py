@@ -0,0 +1,237 @@
+"""Several worker processes of the RKSOK server on one port: the supervisor owns the phonebook and
+serves it to the workers over a Unix socket, starts the workers, restarts them when they die or hang
+and replaces them one by one on a graceful restart."""
+import asyncio
+import itertools
+import json
+import os
+import signal
+import time
+from loguru import logger
+
+
+class StoreService:
+    """Serves the phonebook of this process to the workers over a Unix socket.
+
+    Requests and responses are JSON lines: '[id, operation, arguments...]' and '[id, result, error]'.
+    Every request is handled as a separate task, so writers of one worker share group commits.
+    Workers report their pid in the 'ping' heartbeats, the time of the last one is kept per pid."""
+
+    def __init__(self, store, path: str):
+        self._store = store
+        self._path = path
+        self._server = None
+        self.heartbeats = {}
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_unix_server(self._serve, self._path)
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        tasks = set()
+        try:
+            while line := await reader.readline():
+                task = asyncio.create_task(self._call(json.loads(line), writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (ConnectionError, ValueError) as e:
+            logger.warning(f'Worker connection to the phonebook is broken: {e!r}')
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def _call(self, request: list, writer: asyncio.StreamWriter) -> None:
+        request_id, operation, *args = request
+        try:
+            if operation == 'lookup':
+                result = await self._store.lookup(*args)
+            elif operation == 'save':
+                result = await self._store.save(args[0], tuple(args[1]))
+            elif operation == 'remove':
+                result = await self._store.remove(*args)
+            elif operation == 'lookup_many':
+                result = await self._store.lookup_many(*args)
+            elif operation == 'save_many':
+                result = await self._store.save_many([(name, tuple(phone)) for name, phone in args[0]])
+            elif operation == 'ping':
+                self.heartbeats[args[0]] = time.monotonic()
+                result = None
+            else:
+                raise ValueError(f'Unknown operation {operation!r}')
+            response = [request_id, result, None]
+        except Exception as e:
+            response = [request_id, None, repr(e)]
+        writer.write(json.dumps(response, ensure_ascii=False).encode() + b'\n')
+
+
+class RemoteStore:
+    """The phonebook of the supervisor as seen from a worker, with the operations of PhoneBookStore
+    the server uses. Requests share one connection and are answered as soon as they are done."""
+
+    def __init__(self, path: str):
+        self._path = path
+        self._writer = None
+        self._reader_task = None
+        self._ids = itertools.count()
+        self._results = {}
+
+    async def connect(self) -> None:
+        reader, self._writer = await asyncio.open_unix_connection(self._path, limit=16 * 1024 * 1024)
+        self._reader_task = asyncio.create_task(self._read_responses(reader))
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        if self._reader_task is not None:
+            await self._reader_task
+
+    async def wait_closed(self) -> None:
+        """Waits until the supervisor closes the connection."""
+        await asyncio.shield(self._reader_task)
+
+    async def lookup(self, name: str) -> tuple or None:
+        phone = await self._call('lookup', name)
+        return tuple(phone) if phone is not None else None
+
+    async def save(self, name: str, phone: tuple) -> None:
+        await self._call('save', name, phone)
+
+    async def remove(self, name: str) -> bool:
+        return await self._call('remove', name)
+
+    async def lookup_many(self, names: list) -> list:
+        return [tuple(phone) if phone is not None else None for phone in await self._call('lookup_many', names)]
+
+    async def save_many(self, items: list) -> None:
+        await self._call('save_many', items)
+
+    async def heartbeat(self, interval: float) -> None:
+        """Tells the supervisor every 'interval' seconds that the event loop of this worker runs."""
+        while True:
+            await self._call('ping', os.getpid())
+            await asyncio.sleep(interval)
+
+    async def _call(self, operation: str, *args):
+        if self._reader_task.done():
+            raise ConnectionError('The connection to the phonebook is closed.')
+        request_id = next(self._ids)
+        result = asyncio.get_running_loop().create_future()
+        self._results[request_id] = result
+        self._writer.write(json.dumps([request_id, operation, *args], ensure_ascii=False).encode() + b'\n')
+        return await result
+
+    async def _read_responses(self, reader: asyncio.StreamReader) -> None:
+        error = ConnectionError('The connection to the phonebook is closed.')
+        try:
+            while line := await reader.readline():
+                request_id, value, failure = json.loads(line)
+                result = self._results.pop(request_id)
+                if result.done():
+                    continue
+                if failure is None:
+                    result.set_result(value)
+                else:
+                    result.set_exception(RuntimeError(f'Phonebook error: {failure}'))
+        except (OSError, ValueError) as e:
+            error = ConnectionError(f'The connection to the phonebook is broken: {e!r}')
+        for result in self._results.values():
+            if not result.done():
+                result.set_exception(error)
+        self._results.clear()
+
+
+class Supervisor:
+    """Keeps 'workers' worker processes started by 'command' followed by the worker number.
+
+    A worker is ready once its first heartbeat has come. A worker that exits, or whose heartbeats
+    stop for 'health_timeout' seconds, is replaced. On a graceful restart every worker is replaced
+    by a new one that is ready first; the old worker gets SIGTERM and 'grace_period' seconds
+    to finish its connections before it is killed."""
+
+    def __init__(self, service: StoreService, command: list, workers: int, health_timeout: float, \
+            grace_period: float):
+        self._service = service
+        self._command = command
+        self._workers = [None] * workers
+        self._started = [0.0] * workers
+        self._health_timeout = health_timeout
+        self._grace_period = grace_period
+        self._restart_lock = asyncio.Lock()
+
+    async def start(self) -> None:
+        for number in range(len(self._workers)):
+            await self._spawn(number)
+
+    async def watch(self, interval: float) -> None:
+        """Checks the workers every 'interval' seconds and replaces the failed ones."""
+        while True:
+            await asyncio.sleep(interval)
+            if self._restart_lock.locked():
+                continue
+            for number, process in enumerate(self._workers):
+                if process.returncode is not None:
+                    logger.warning(f'Worker {number} (pid {process.pid}) exited with code {process.returncode}')
+                    await self._spawn(number)
+                elif not self._is_alive(number):
+                    logger.warning(f'Worker {number} (pid {process.pid}) stopped answering, killing it')
+                    process.kill()
+                    await process.wait()
+                    await self._spawn(number)
+
+    async def restart(self) -> None:
+        """Replaces the workers one by one, the port is served all the time."""
+        async with self._restart_lock:
+            logger.info('Graceful restart of the workers')
+            for number, old in enumerate(self._workers):
+                old_started = self._started[number]
+                await self._spawn(number)
+                if not await self._wait_ready(number):
+                    # The old worker keeps serving, the new one is dropped.
+                    logger.error(f'Worker {number} is not ready, restart stopped, pid {old.pid} kept')
+                    await self._stop(self._workers[number])
+                    self._workers[number], self._started[number] = old, old_started
+                    return
+                await self._stop(old)
+
+    async def stop(self) -> None:
+        await asyncio.gather(*(self._stop(process) for process in self._workers if process is not None))
+
+    async def _spawn(self, number: int) -> None:
+        process = await asyncio.create_subprocess_exec(*self._command, str(number))
+        self._workers[number] = process
+        self._started[number] = time.monotonic()
+        logger.info(f'Worker {number} started, pid {process.pid}')
+
+    def _is_alive(self, number: int) -> bool:
+        process = self._workers[number]
+        last = self._service.heartbeats.get(process.pid, self._started[number])
+        return time.monotonic() - last < self._health_timeout
+
+    async def _wait_ready(self, number: int) -> bool:
+        process = self._workers[number]
+        deadline = time.monotonic() + self._health_timeout
+        while process.pid not in self._service.heartbeats:
+            if process.returncode is not None or time.monotonic() > deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    async def _stop(self, process: asyncio.subprocess.Process) -> None:
+        if process.returncode is None:
+            process.send_signal(signal.SIGTERM)
+            try:
+                await asyncio.wait_for(process.wait(), self._grace_period + 1)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+        self._service.heartbeats.pop(process.pid, None)
@@ -0,0 +1,402 @@
+"""Phonebook kept on disk for the RKSOK server: an append-only data log and a hash index over it,
+both read through mmap, so neither the start nor the memory of the server grows with the phonebook.
+
+Import and export of the JSON phonebook:
+python index_rksok.py import name_phone.json
+python index_rksok.py export name_phone.json
+python index_rksok.py compact
+The index and data files are those of [STORAGE] in config.ini unless --index and --data are given.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import mmap
+import os
+import struct
+from configparser import ConfigParser
+from loguru import logger
+from store_rksok import WAL_DELETE, WAL_WRITE, WAL_WRITE_MANY
+
+
+# Data log: header, then records of a kind, the lengths of the name and the phones, the number of phones,
+# the uppercased name and the phones joined by line ends, all UTF-8.
+DATA_MAGIC = b'RKSOKDAT'
+DATA_HEADER = struct.Struct('<8s8s')
+RECORD_HEADER = struct.Struct('<BHII')
+RECORD_WRITE = 1
+RECORD_DELETE = 2
+
+# Index: header, then buckets of the name hash and the offset of the latest record of the name.
+INDEX_MAGIC = b'RKSOKIDX'
+INDEX_HEADER = struct.Struct('<8s8sQQQQQ')
+INDEX_HEADER_SIZE = 64
+BUCKET = struct.Struct('<QQ')
+EMPTY = 0
+TOMBSTONE = 2 ** 64 - 1
+MIN_BUCKETS = 1024
+MAX_LOAD = 0.7
+
+PHONE_SEPARATOR = '\r\n'
+
+
+def hash_name(name: bytes) -> int:
+    # Python's hash() differs between processes, the index outlives them.
+    return int.from_bytes(hashlib.blake2b(name, digest_size=8).digest(), 'little')
+
+
+class IndexedPhoneBook:
+    """Phonebook on disk with the operations of PhoneBookStore the server uses.
+
+    ЗОПИШИ and УДОЛИ append a record to the data log and point the bucket of the name at it,
+    ОТДОВАЙ probes the open addressing index and reads one record: only their pages are touched.
+    The index grows by doubling when it is more than 70% full. The index remembers up to where
+    the log is indexed and which log it belongs to: records appended after that are indexed at start,
+    an index of another log is rebuilt from the log. Overwritten and deleted records are dropped
+    by compaction, at close when they take more than half of the log.
+
+    With 'fsync' on, ЗОПИШИ and УДОЛИ are answered after their record is fsynced.
+    'on_change' is called with every change as it is made, like the one of PhoneBookStore."""
+
+    def __init__(self, index: str, data: str, encoding: str = 'UTF-8', fsync: bool = False):
+        self.on_change = None
+        self._index_path = index
+        self._data_path = data
+        self._encoding = encoding
+        self._fsync = fsync
+        self._data_fd = None
+        self._data_map = None
+        self._index_file = None
+        self._index = None
+
+    async def load(self) -> None:
+        self._open()
+        logger.info(f'Indexed phonebook opened: {self._used} names, {self._data_end} bytes of records')
+
+    def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        if self._index is None:
+            return
+        if self._data_end > 2 * self._live_bytes + DATA_HEADER.size + mmap.PAGESIZE:
+            self.compact()
+        self._close()
+
+    def __len__(self) -> int:
+        return self._used
+
+    async def lookup(self, name: str) -> tuple or None:
+        """Returns the phones of the name or None if there is no such name."""
+        name_b = name.encode(self._encoding)
+        _, offset = self._find(name_b, hash_name(name_b))
+        if offset is None:
+            return None
+        return self._read_record(offset)[2]
+
+    async def save(self, name: str, phone: tuple) -> None:
+        """Writes a new name with phones or replaces the phones of an existing name."""
+        name_b = name.encode(self._encoding)
+        self._set(name_b, self._append(RECORD_WRITE, name_b, phone))
+        if self.on_change is not None:
+            self.on_change((WAL_WRITE, name, phone))
+        await self._commit()
+
+    async def lookup_many(self, names: list) -> list:
+        """Returns the phones of every name, None for the names that are not in the phonebook."""
+        return [await self.lookup(name) for name in names]
+
+    async def save_many(self, items: list) -> None:
+        """Writes the phones of all the names and commits them with one fsync."""
+        for name, phone in items:
+            name_b = name.encode(self._encoding)
+            self._set(name_b, self._append(RECORD_WRITE, name_b, phone))
+        if self.on_change is not None:
+            self.on_change((WAL_WRITE_MANY, items))
+        await self._commit()
+
+    async def remove(self, name: str) -> bool:
+        """Removes the name with phones. Returns False if there is no such name."""
+        name_b = name.encode(self._encoding)
+        slot, offset = self._find(name_b, hash_name(name_b))
+        if offset is None:
+            return False
+        self._append(RECORD_DELETE, name_b, ())
+        self._live_bytes -= self._record_size(offset)
+        self._used -= 1
+        self._tombstones += 1
+        BUCKET.pack_into(self._index, INDEX_HEADER_SIZE + slot * BUCKET.size, 0, TOMBSTONE)
+        self._write_header()
+        if self.on_change is not None:
+            self.on_change((WAL_DELETE, name))
+        await self._commit()
+        return True
+
+    def items(self):
+        """Yields the names and phones in the order of the index."""
+        for slot in range(self._buckets):
+            _, offset = BUCKET.unpack_from(self._index, INDEX_HEADER_SIZE + slot * BUCKET.size)
+            if offset not in (EMPTY, TOMBSTONE):
+                _, name_b, phone = self._read_record(offset)
+                yield name_b.decode(self._encoding), phone
+
+    def compact(self) -> None:
+        """Writes the live records into a new log with a new index, then replaces the old ones."""
+        data_tmp, index_tmp = f'{self._data_path}.tmp', f'{self._index_path}.tmp'
+        for path in (data_tmp, index_tmp):
+            if os.path.exists(path):
+                os.remove(path)
+        compacted = IndexedPhoneBook(index_tmp, data_tmp, self._encoding)
+        compacted._open(self._buckets)
+        for name, phone in self.items():
+            name_b = name.encode(self._encoding)
+            compacted._set(name_b, compacted._append(RECORD_WRITE, name_b, phone))
+        compacted._close()
+        self._close()
+        # A crash between the two replaces leaves an index of another log, which is rebuilt at start.
+        os.replace(data_tmp, self._data_path)
+        os.replace(index_tmp, self._index_path)
+        self._open()
+        logger.info(f'Indexed phonebook compacted: {self._used} names, {self._data_end} bytes of records')
+
+    def _open(self, buckets: int = MIN_BUCKETS) -> None:
+        if not os.path.exists(self._data_path) or os.path.getsize(self._data_path) < DATA_HEADER.size:
+            with open(self._data_path, 'wb') as f:
+                f.write(DATA_HEADER.pack(DATA_MAGIC, os.urandom(8)))
+                f.flush()
+                os.fsync(f.fileno())
+        self._data_fd = os.open(self._data_path, os.O_RDWR | os.O_APPEND)
+        self._data_size = os.fstat(self._data_fd).st_size
+        self._data_map = mmap.mmap(self._data_fd, 0, access=mmap.ACCESS_READ)
+        magic, self._data_id = DATA_HEADER.unpack_from(self._data_map)
+        if magic != DATA_MAGIC:
+            raise ValueError(f'{self._data_path} is not a phonebook data file.')
+        if os.path.exists(self._index_path) and os.path.getsize(self._index_path) < INDEX_HEADER_SIZE:
+            os.remove(self._index_path)
+        if os.path.exists(self._index_path):
+            self._map_index()
+            magic, data_id, self._buckets, self._used, self._tombstones, self._data_end, self._live_bytes = \
+                INDEX_HEADER.unpack_from(self._index)
+            if magic != INDEX_MAGIC or data_id != self._data_id or self._data_end > self._data_size:
+                logger.warning(f'{self._index_path} does not match {self._data_path}, rebuilding it')
+                self._unmap_index()
+                os.remove(self._index_path)
+        if self._index is None:
+            self._create_index(self._index_path, buckets)
+            self._map_index()
+            self._buckets, self._used, self._tombstones, self._live_bytes = buckets, 0, 0, 0
+            self._data_end = DATA_HEADER.size
+        self._index_tail()
+
+    def _close(self) -> None:
+        self._write_header()
+        self._index.flush()
+        self._unmap_index()
+        self._data_map.close()
+        os.fsync(self._data_fd)
+        os.close(self._data_fd)
+        self._data_map = self._data_fd = None
+
+    def _create_index(self, path: str, buckets: int) -> None:
+        with open(path, 'wb') as f:
+            f.truncate(INDEX_HEADER_SIZE + buckets * BUCKET.size)
+
+    def _map_index(self) -> None:
+        self._index_file = open(self._index_path, 'r+b')
+        self._index = mmap.mmap(self._index_file.fileno(), 0)
+
+    def _unmap_index(self) -> None:
+        self._index.close()
+        self._index_file.close()
+        self._index = self._index_file = None
+
+    def _write_header(self) -> None:
+        INDEX_HEADER.pack_into(self._index, 0, INDEX_MAGIC, self._data_id, self._buckets, self._used, \
+            self._tombstones, self._data_end, self._live_bytes)
+
+    def _index_tail(self) -> None:
+        """Indexes the records appended to the log after the index was last written."""
+        offset = self._data_end
+        while offset < self._data_size:
+            if offset + RECORD_HEADER.size > self._data_size:
+                break
+            kind, name_len, phone_len, _ = RECORD_HEADER.unpack_from(self._data_map, offset)
+            end = offset + RECORD_HEADER.size + name_len + phone_len
+            if kind not in (RECORD_WRITE, RECORD_DELETE) or end > self._data_size:
+                break
+            name_b = self._data_map[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + name_len]
+            self._data_end = end
+            if kind == RECORD_WRITE:
+                self._set(name_b, offset)
+            else:
+                slot, found = self._find(name_b, hash_name(name_b))
+                if found is not None:
+                    self._live_bytes -= self._record_size(found)
+                    self._used -= 1
+                    self._tombstones += 1
+                    BUCKET.pack_into(self._index, INDEX_HEADER_SIZE + slot * BUCKET.size, 0, TOMBSTONE)
+            offset = end
+        if offset < self._data_size:
+            # The last record was cut off by a crash in the middle of the write.
+            logger.warning(f'Dropped a broken record at the end of {self._data_path}')
+            os.truncate(self._data_path, offset)
+            self._data_size = offset
+        self._write_header()
+
+    def _find(self, name_b: bytes, name_hash: int) -> tuple:
+        """Returns the slot of the name and the offset of its record, or the slot to put it in and None."""
+        mask = self._buckets - 1
+        slot = name_hash & mask
+        free = None
+        while True:
+            bucket_hash, offset = BUCKET.unpack_from(self._index, INDEX_HEADER_SIZE + slot * BUCKET.size)
+            if offset == EMPTY:
+                return (slot if free is None else free), None
+            if offset == TOMBSTONE:
+                if free is None:
+                    free = slot
+            elif bucket_hash == name_hash and self._read_name(offset) == name_b:
+                return slot, offset
+            slot = (slot + 1) & mask
+
+    def _set(self, name_b: bytes, offset: int) -> None:
+        """Points the bucket of the name at the record at 'offset'."""
+        if (self._used + self._tombstones + 1) > self._buckets * MAX_LOAD:
+            self._grow()
+        name_hash = hash_name(name_b)
+        slot, found = self._find(name_b, name_hash)
+        if found is None:
+            self._used += 1
+            _, previous = BUCKET.unpack_from(self._index, INDEX_HEADER_SIZE + slot * BUCKET.size)
+            if previous == TOMBSTONE:
+                self._tombstones -= 1
+        else:
+            self._live_bytes -= self._record_size(found)
+        self._live_bytes += self._record_size(offset)
+        BUCKET.pack_into(self._index, INDEX_HEADER_SIZE + slot * BUCKET.size, name_hash, offset)
+        self._write_header()
+
+    def _grow(self) -> None:
+        """Moves the live buckets into a new index, twice as large unless mostly tombstones were filling it."""
+        buckets = self._buckets * 2 if self._used + 1 > self._buckets * MAX_LOAD / 2 else self._buckets
+        index_tmp = f'{self._index_path}.tmp'
+        self._create_index(index_tmp, buckets)
+        with open(index_tmp, 'r+b') as f, mmap.mmap(f.fileno(), 0) as index:
+            mask = buckets - 1
+            for old_slot in range(self._buckets):
+                name_hash, offset = BUCKET.unpack_from(self._index, INDEX_HEADER_SIZE + old_slot * BUCKET.size)
+                if offset in (EMPTY, TOMBSTONE):
+                    continue
+                slot = name_hash & mask
+                while BUCKET.unpack_from(index, INDEX_HEADER_SIZE + slot * BUCKET.size)[1] != EMPTY:
+                    slot = (slot + 1) & mask
+                BUCKET.pack_into(index, INDEX_HEADER_SIZE + slot * BUCKET.size, name_hash, offset)
+            INDEX_HEADER.pack_into(index, 0, INDEX_MAGIC, self._data_id, buckets, self._used, 0, \
+                self._data_end, self._live_bytes)
+        self._unmap_index()
+        os.replace(index_tmp, self._index_path)
+        self._map_index()
+        self._buckets, self._tombstones = buckets, 0
+
+    def _append(self, kind: int, name_b: bytes, phone: tuple) -> int:
+        """Appends a record to the log, returns its offset."""
+        phone_b = PHONE_SEPARATOR.join(phone).encode(self._encoding)
+        record = RECORD_HEADER.pack(kind, len(name_b), len(phone_b), len(phone)) + name_b + phone_b
+        offset = self._data_size
+        os.write(self._data_fd, record)
+        self._data_size += len(record)
+        self._data_end = self._data_size
+        return offset
+
+    def _data_view(self, end: int) -> mmap.mmap:
+        # The map covers the log as it was when it was made, records appended later need a new one.
+        if end > len(self._data_map):
+            self._data_map.close()
+            self._data_map = mmap.mmap(self._data_fd, 0, access=mmap.ACCESS_READ)
+        return self._data_map
+
+    def _read_name(self, offset: int) -> bytes:
+        data = self._data_view(offset + RECORD_HEADER.size)
+        name_len = RECORD_HEADER.unpack_from(data, offset)[1]
+        start = offset + RECORD_HEADER.size
+        return self._data_view(start + name_len)[start:start + name_len]
+
+    def _read_record(self, offset: int) -> tuple:
+        """Returns the kind, the name and the phones of the record at 'offset'."""
+        kind, name_len, phone_len, phones = RECORD_HEADER.unpack_from(self._data_view(offset + RECORD_HEADER.size), \
+            offset)
+        start = offset + RECORD_HEADER.size
+        data = self._data_view(start + name_len + phone_len)
+        name_b = data[start:start + name_len]
+        phone = tuple(data[start + name_len:start + name_len + phone_len].decode(self._encoding) \
+            .split(PHONE_SEPARATOR)) if phones else ()
+        return kind, name_b, phone
+
+    def _record_size(self, offset: int) -> int:
+        _, name_len, phone_len, _ = RECORD_HEADER.unpack_from(self._data_view(offset + RECORD_HEADER.size), offset)
+        return RECORD_HEADER.size + name_len + phone_len
+
+    async def _commit(self) -> None:
+        if self._fsync:
+            await asyncio.to_thread(os.fsync, self._data_fd)
+
+
+def import_json(book: IndexedPhoneBook, path: str, encoding: str) -> int:
+    """Writes the names and phones of the JSON phonebook into the indexed one, returns the number of names."""
+    with open(path, encoding=encoding) as f:
+        data = f.read()
+    name_phone = json.loads(data) if data else {}
+    for name, phone in name_phone.items():
+        name_b = name.upper().encode(encoding)
+        book._set(name_b, book._append(RECORD_WRITE, name_b, tuple(phone)))
+    return len(name_phone)
+
+
+def export_json(book: IndexedPhoneBook, path: str, encoding: str) -> int:
+    """Writes the indexed phonebook as JSON one name at a time, returns the number of names."""
+    count = 0
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding=encoding) as f:
+        f.write('{')
+        for name, phone in book.items():
+            f.write(f'{", " if count else ""}{json.dumps(name, ensure_ascii=False)}: ' \
+                f'{json.dumps(list(phone), ensure_ascii=False)}')
+            count += 1
+        f.write('}')
+    os.replace(tmp_path, path)
+    return count
+
+
+def get_args() -> argparse.Namespace:
+    config = ConfigParser()
+    config.read('config.ini')
+    storage = config['STORAGE'] if config.has_section('STORAGE') else {}
+    parser = argparse.ArgumentParser(description='Import, export and compaction of the indexed phonebook')
+    parser.add_argument('command', choices=('import', 'export', 'compact'))
+    parser.add_argument('json', nargs='?', help='JSON phonebook to import from or export to')
+    parser.add_argument('--index', default=storage.get('INDEX', 'name_phone.idx'))
+    parser.add_argument('--data', default=storage.get('DATA', 'name_phone.dat'))
+    parser.add_argument('--encoding', default=config.get('SETTINGS', 'ENCODING', fallback='UTF-8'))
+    args = parser.parse_args()
+    if args.command != 'compact' and not args.json:
+        parser.error(f'{args.command} needs the JSON phonebook')
+    return args
+
+
+def main():
+    args = get_args()
+    book = IndexedPhoneBook(args.index, args.data, args.encoding)
+    book._open()
+    try:
+        if args.command == 'export':
+            print(f'Exported {export_json(book, args.json, args.encoding)} names')
+            return
+        if args.command == 'import':
+            print(f'Imported {import_json(book, args.json, args.encoding)} names, {len(book)} in the phonebook')
+        book.compact()
+    finally:
+        book._close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""Pool of persistent connections from the RKSOK server to the 'vragi-vezde' inspector and the cache of its verdicts."""
+import asyncio
+import collections
+import time
+from typing import Awaitable, Callable
+from loguru import logger
+
+
+# An inspector response ends with an empty line, like all RKSOK messages.
+END_OF_MESSAGE = b'\r\n\r\n'
+
+
+class InspectorError(Exception):
+    """Error that occurs when the inspector is not asked: it is down or too many requests wait for it."""
+    pass
+
+
+class InspectorBusyError(InspectorError):
+    """Too many requests wait for a connection to the inspector."""
+    pass
+
+
+class InspectorUnavailableError(InspectorError):
+    """The circuit breaker is open: the inspector failed too many times in a row."""
+    pass
+
+
+class CircuitBreaker:
+    """Fails the calls at once while the inspector is down.
+
+    After 'failures' failed calls in a row the breaker opens: no calls are made for 'reset_timeout' seconds.
+    Then calls are let through again, the first of them to end decides: a success closes the breaker,
+    a failure opens it for another 'reset_timeout' seconds."""
+
+    def __init__(self, failures: int, reset_timeout: float):
+        self._failures = failures
+        self._reset_timeout = reset_timeout
+        self._failed = 0
+        self._opened_at = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None and time.monotonic() - self._opened_at < self._reset_timeout
+
+    def succeeded(self) -> None:
+        if self._opened_at is not None:
+            logger.info('The inspector answers again, circuit breaker closed.')
+        self._failed = 0
+        self._opened_at = None
+
+    def failed(self) -> None:
+        self._failed += 1
+        if self._failed >= self._failures and not self.is_open:
+            if self._opened_at is None:
+                logger.warning(f'{self._failed} inspector calls failed in a row, circuit breaker opened.')
+            self._opened_at = time.monotonic()
+
+
+class InspectorConnection:
+    """One connection to the inspector. Requests may be pipelined: responses come back
+    in the order of the requests and are handed out to the waiting futures one by one."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader, self._writer = reader, writer
+        self._waiting = collections.deque()
+        self.last_used = time.monotonic()
+        self._reading = asyncio.create_task(self._read_responses())
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._waiting)
+
+    def is_healthy(self) -> bool:
+        """The connection is healthy while it reads responses and is not closed by either side."""
+        return not self._reading.done() and not self._writer.is_closing()
+
+    def send(self, request: bytes) -> asyncio.Future:
+        """Sends the request, returns the future of its response."""
+        if self._reading.done():
+            raise ConnectionError('Connection to the inspector is closed.')
+        response = asyncio.get_running_loop().create_future()
+        self._waiting.append(response)
+        self._writer.write(request)
+        self.last_used = time.monotonic()
+        return response
+
+    def close(self) -> None:
+        self._reading.cancel()
+        self._writer.close()
+
+    async def _read_responses(self) -> None:
+        try:
+            while True:
+                response = await self._reader.readuntil(END_OF_MESSAGE)
+                self.last_used = time.monotonic()
+                if self._waiting:
+                    waiting = self._waiting.popleft()
+                    # A request given up by its caller still takes its place in the order of responses.
+                    if not waiting.done():
+                        waiting.set_result(response)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, OSError) as e:
+            error = ConnectionError(f'Connection to the inspector is broken: {e!r}')
+        except asyncio.CancelledError:
+            error = ConnectionError('Connection to the inspector is closed.')
+        finally:
+            self._writer.close()
+        # Requests left without a response fail, the pool retries them on another connection.
+        while self._waiting:
+            response = self._waiting.popleft()
+            if not response.done():
+                response.set_exception(error)
+
+
+class InspectorPool:
+    """Bounded pool of at most 'size' warm connections to the inspector.
+
+    Up to 'pipeline_depth' requests are sent over one connection without waiting for the responses
+    (1 - no pipelining, for inspectors that serve one request at a time). Broken connections are dropped
+    and replaced, connections unused for 'idle_timeout' seconds are closed.
+
+    A request is given up after 'timeout' seconds. When all connections are busy, at most 'max_waiting'
+    requests wait for one, the others fail with InspectorBusyError at once. Failed requests are counted
+    by the 'breaker': while it is open, requests fail with InspectorUnavailableError at once."""
+
+    def __init__(self, host: str, port: int, size: int, idle_timeout: float, connect_timeout: float, \
+            pipeline_depth: int = 1, timeout: float = None, max_waiting: int = None, \
+            breaker: CircuitBreaker = None):
+        self._host, self._port = host, port
+        self._size = size
+        self._idle_timeout = idle_timeout
+        self._connect_timeout = connect_timeout
+        self._pipeline_depth = pipeline_depth
+        self._timeout = timeout
+        self._max_waiting = max_waiting
+        self._breaker = breaker
+        self._connections = []
+        self._connecting = 0
+        self._waiting = 0
+        self._released = asyncio.Condition()
+        self._janitor = None
+
+    def start(self) -> None:
+        """Starts closing idle connections in the background."""
+        if self._janitor is None:
+            self._janitor = asyncio.create_task(self._close_idle())
+
+    async def close(self) -> None:
+        if self._janitor is not None:
+            self._janitor.cancel()
+            try:
+                await self._janitor
+            except asyncio.CancelledError:
+                pass
+            self._janitor = None
+        for connection in self._connections:
+            connection.close()
+        self._connections = []
+
+    async def ask(self, request: bytes, timeout: float = None) -> bytes:
+        """Sends the request to the inspector and returns its response within 'timeout' seconds
+        or the timeout of the pool, whichever is shorter."""
+        if self._breaker is not None and self._breaker.is_open:
+            raise InspectorUnavailableError('The inspector is down, circuit breaker is open.')
+        if timeout is None or self._timeout is not None and self._timeout < timeout:
+            timeout = self._timeout
+        try:
+            response = await asyncio.wait_for(self._ask(request), timeout)
+        except InspectorBusyError:
+            raise
+        except (OSError, asyncio.TimeoutError):
+            if self._breaker is not None:
+                self._breaker.failed()
+            raise
+        if self._breaker is not None:
+            self._breaker.succeeded()
+        return response
+
+    async def _ask(self, request: bytes) -> bytes:
+        """A request that failed on a reused connection is repeated once: the inspector may have closed it."""
+        for attempt in range(2):
+            connection, reused = await self._acquire()
+            try:
+                return await connection.send(request)
+            except ConnectionError:
+                if not reused or attempt:
+                    raise
+                logger.debug('Connection to the inspector was broken, reconnecting.')
+            finally:
+                await self._release()
+
+    async def _acquire(self) -> tuple[InspectorConnection, bool]:
+        """Returns the least loaded healthy connection with a free pipeline slot or opens a new one.
+        Waits while all connections are busy and the pool is full."""
+        async with self._released:
+            while True:
+                self._connections = [c for c in self._connections if c.is_healthy()]
+                free = [c for c in self._connections if c.in_flight < self._pipeline_depth]
+                if free:
+                    return min(free, key=lambda c: c.in_flight), True
+                if len(self._connections) + self._connecting < self._size:
+                    self._connecting += 1
+                    break
+                if self._max_waiting is not None and self._waiting >= self._max_waiting:
+                    raise InspectorBusyError(f'{self._waiting} requests are waiting for the inspector already.')
+                self._waiting += 1
+                try:
+                    await self._released.wait()
+                finally:
+                    self._waiting -= 1
+        try:
+            connection = await self._open()
+        except BaseException:
+            self._connecting -= 1
+            await self._release()
+            raise
+        self._connecting -= 1
+        return connection, False
+
+    async def _open(self) -> InspectorConnection:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self._host, self._port), self._connect_timeout)
+        connection = InspectorConnection(reader, writer)
+        self._connections.append(connection)
+        return connection
+
+    async def _release(self) -> None:
+        async with self._released:
+            self._released.notify()
+
+    async def _close_idle(self) -> None:
+        while True:
+            await asyncio.sleep(self._idle_timeout)
+            now = time.monotonic()
+            for connection in self._connections:
+                if not connection.in_flight and now - connection.last_used >= self._idle_timeout:
+                    connection.close()
+            self._connections = [c for c in self._connections if c.is_healthy()]
+
+
+class VerdictCache:
+    """Inspector verdicts for one request method, reused for 'ttl' seconds.
+    At most 'max_entries' verdicts are kept, the least recently used one is evicted first.
+    Lookups of a key that is being asked already wait for that inspector call instead of making another one."""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._verdicts = collections.OrderedDict()
+        self._in_flight = {}
+        self.hits, self.misses, self.coalesced = 0, 0, 0
+
+    async def get(self, key: tuple, ask: Callable[[], Awaitable[bytes]]) -> bytes:
+        """Returns the cached verdict for the key or asks the inspector with 'ask'.
+        Errors of 'ask' reach all the callers waiting for it and are not cached."""
+        entry = self._verdicts.get(key)
+        if entry is not None:
+            expires, verdict = entry
+            if expires > time.monotonic():
+                self._verdicts.move_to_end(key)
+                self.hits += 1
+                return verdict
+            del self._verdicts[key]
+        asking = self._in_flight.get(key)
+        if asking is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            asking = asyncio.ensure_future(ask())
+            self._in_flight[key] = asking
+            asking.add_done_callback(lambda done: self._store(key, done))
+        # A caller that gives up does not cancel the call the other callers are waiting for.
+        return await asyncio.shield(asking)
+
+    def _store(self, key: tuple, asking: asyncio.Future) -> None:
+        del self._in_flight[key]
+        if asking.cancelled() or asking.exception() is not None:
+            return
+        self._verdicts[key] = (time.monotonic() + self._ttl, asking.result())
+        self._verdicts.move_to_end(key)
+        while len(self._verdicts) > self._max_entries:
+            self._verdicts.popitem(last=False)
@@ -0,0 +1,156 @@
+"""Metrics of the RKSOK server: latency histograms per stage and verb, counters and gauges,
+served in the Prometheus text format over HTTP."""
+import asyncio
+import bisect
+from typing import Callable
+from loguru import logger
+
+
+# Upper bounds of the latency buckets, seconds.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """Observations counted per bucket, with their sum."""
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(BUCKETS, value)
+        if index < len(BUCKETS):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Metrics of one server process. Labels are given as tuples of (name, value) pairs.
+
+    Every metric is made on its first use; 'collectors' and 'gauge_collectors' are called on every scrape
+    and return (name, labels, value) of the counters and of the gauges kept elsewhere."""
+
+    def __init__(self, prefix: str = 'rksok'):
+        self._prefix = prefix
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self.collectors = []
+        self.gauge_collectors = []
+
+    def observe(self, name: str, labels: tuple, seconds: float) -> None:
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+    def inc(self, name: str, labels: tuple = (), value: float = 1) -> None:
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def add(self, name: str, value: float) -> None:
+        """Changes the gauge by 'value'."""
+        self._gauges[name] = self._gauges.get(name, 0) + value
+
+    def render(self) -> str:
+        lines = []
+        typed = set()
+
+        def add_type(name: str, kind: str) -> None:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), histogram in sorted(self._histograms.items()):
+            name = f'{self._prefix}_{name}'
+            add_type(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", repr(bound)),))} {cumulative}')
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {histogram.count}')
+            lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum}')
+            lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+        counters = dict(self._counters)
+        for collector in self.collectors:
+            for name, labels, value in collector():
+                counters[(name, labels)] = value
+        for (name, labels), value in sorted(counters.items()):
+            name = f'{self._prefix}_{name}'
+            add_type(name, 'counter')
+            lines.append(f'{name}{format_labels(labels)} {value}')
+        gauges = {(name, ()): value for name, value in self._gauges.items()}
+        for collector in self.gauge_collectors:
+            for name, labels, value in collector():
+                gauges[(name, labels)] = value
+        for (name, labels), value in sorted(gauges.items()):
+            name = f'{self._prefix}_{name}'
+            add_type(name, 'gauge')
+            lines.append(f'{name}{format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    async def serve(self, host: str, port: int) -> asyncio.base_events.Server:
+        """Starts the HTTP server answering 'GET /metrics'."""
+        server = await asyncio.start_server(self._serve_http, host, port)
+        logger.info(f'Metrics on http://{host}:{port}/metrics')
+        return server
+
+    async def _serve_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10)
+            if head.startswith((b'GET /metrics ', b'GET /metrics?')):
+                status, body = '200 OK', self.render().encode()
+            else:
+                status, body = '404 Not Found', b'Not Found\n'
+            writer.write(f'HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\nContent-Length: {len(body)}\r\n' \
+                f'Connection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def collect_verdict_caches(verdict_caches: dict) -> Callable[[], list]:
+    """Collector of the hits, misses and coalesced calls of the verdict caches by verb."""
+    def collect() -> list:
+        return [(f'verdict_cache_{counter}_total', (('verb', verb),), getattr(cache, counter)) \
+            for verb, cache in verdict_caches.items() for counter in ('hits', 'misses', 'coalesced')]
+    return collect
+
+
+def collect_response_cache(response_cache) -> Callable[[], list]:
+    """Collector of the hits and misses of the response cache."""
+    def collect() -> list:
+        return [('response_cache_hits_total', (), response_cache.hits), \
+            ('response_cache_misses_total', (), response_cache.misses)]
+    return collect
+
+
+def collect_replication(source=None, replica=None) -> Callable[[], list]:
+    """Collector of the replication gauges: the followers and the last change of the primary,
+    the last change applied, the connection and the lag of a follower."""
+    def collect() -> list:
+        gauges = []
+        if source is not None:
+            gauges += [('replication_followers', (), source.followers), ('replication_seq', (), source.seq)]
+        if replica is not None:
+            gauges += [('replication_seq', (), replica.seq), ('replication_connected', (), int(replica.connected))]
+            if replica.lag is not None:
+                gauges.append(('replication_lag_seconds', (), replica.lag))
+        return gauges
+    return collect
@@ -0,0 +1,159 @@
+"""Incremental parser of RKSOK requests: bytes are fed as they arrive, the request is parsed in one pass."""
+
+
+# Separates the name of a batch item from its phones and the phones from each other.
+ITEM_SEPARATOR = '\t'
+
+
+class IncorrectRequestError(Exception):
+    """Error that occurs when the received bytes are not a correct RKSOK request
+    or the request is over the size limits. 'batch' - the request is a batch, it is answered in the batch protocol."""
+
+    def __init__(self, message: str, batch: bool = False):
+        super().__init__(message)
+        self.batch = batch
+
+
+class RKSOKRequest:
+    """Parsed RKSOK request: method, uppercased name, phones and the request bytes as received.
+    A batch request has the number of items in place of the name and the (name, phones) items,
+    'items' of other requests is None."""
+
+    __slots__ = ('method', 'name', 'phones', 'raw', 'items')
+
+    def __init__(self, method: str, name: str, phones: tuple, raw: bytes, items: tuple = None):
+        self.method, self.name, self.phones, self.raw, self.items = method, name, phones, raw, items
+
+    def __repr__(self) -> str:
+        if self.items is not None:
+            return f'RKSOKRequest({self.method!r}, items={self.items!r})'
+        return f'RKSOKRequest({self.method!r}, {self.name!r}, {self.phones!r})'
+
+
+class RequestParser:
+    """State machine fed with chunks of bytes as they arrive. The received bytes are kept in one buffer
+    and each of them is searched once for the end of the request; the complete request is decoded
+    and split into lines once. One parser serves all the requests of a connection.
+
+    The request is rejected as soon as it can be: when it does not start with a method,
+    when it grows over 'max_size' bytes or 'max_lines' lines, when its first line is not
+    'METHOD NAME PROTOCOL' with a name of 1 to 'max_name_len' characters after uppercasing.
+    A name must be printable, without tabs, and must not contain the protocols.
+
+    With 'batch_protocol', batch requests are parsed as well: 'METHOD COUNT BATCH_PROTOCOL' followed by
+    COUNT item lines, up to 'max_batch_items', of a name and its phones separated with tabs.
+    Phones of the other requests must not contain tabs then, which separate the phones in the batch responses."""
+
+    def __init__(self, methods: set, protocol: str, encoding: str, max_name_len: int, \
+            max_size: int, max_lines: int, batch_protocol: str = None, max_batch_items: int = 0):
+        self._encoding = encoding
+        self._methods = methods
+        self._methods_b = tuple(method.encode(encoding) + b' ' for method in methods)
+        self._method_check_len = max(len(method_b) for method_b in self._methods_b)
+        self._protocol_suffix = f' {protocol}'
+        self._max_name_len = max_name_len
+        self._max_size = max_size
+        self._max_lines = max_lines
+        self._batch_suffix = f' {batch_protocol}' if batch_protocol else None
+        self._batch_suffix_b = self._batch_suffix.encode(encoding) if batch_protocol else None
+        self._max_batch_items = max_batch_items
+        self._protocol, self._batch_protocol = protocol, batch_protocol or protocol
+        # Whether a request is a batch is known at its end, the lines are counted against the larger limit.
+        self._max_feed_lines = max(max_lines, max_batch_items + 1) if batch_protocol else max_lines
+        self._buffer = bytearray()
+        self._reset()
+
+    def feed(self, data: bytes) -> RKSOKRequest or None:
+        """Adds the received bytes. Returns the request if it is complete, otherwise None.
+        Bytes received after the end of a request are kept for the next one, 'feed(b"")' parses them."""
+        self._buffer += data
+        if not self._method_checked:
+            self._check_method()
+        # The end of the request and line ends may be split between chunks.
+        end = self._buffer.find(b'\r\n\r\n', max(self._scanned - 3, 0))
+        if end >= 0:
+            return self._complete(end)
+        if len(self._buffer) > self._max_size:
+            raise IncorrectRequestError(f'The request is longer than {self._max_size} bytes.', self.is_batch())
+        self._lines += self._buffer.count(b'\r\n', max(self._scanned - 1, 0))
+        self._scanned = len(self._buffer)
+        if self._lines > self._max_feed_lines:
+            raise IncorrectRequestError(f'More than {self._max_feed_lines} lines in the request.', self.is_batch())
+        return None
+
+    def has_data(self) -> bool:
+        """Whether bytes of the next request have been received."""
+        return bool(self._buffer)
+
+    def is_batch(self) -> bool:
+        """Whether the received first line of the next request ends with the batch protocol."""
+        return self._is_batch_line(self._buffer)
+
+    def _is_batch_line(self, data: bytes) -> bool:
+        if self._batch_suffix_b is None:
+            return False
+        end = data.find(b'\r\n')
+        return end >= 0 and data.endswith(self._batch_suffix_b, 0, end)
+
+    def _reset(self) -> None:
+        self._method_checked = False
+        self._lines = 0
+        self._scanned = 0
+
+    def _check_method(self) -> None:
+        if len(self._buffer) < self._method_check_len and b'\r\n' not in self._buffer:
+            return
+        if not self._buffer.startswith(self._methods_b):
+            raise IncorrectRequestError('The request does not start with a method.')
+        self._method_checked = True
+
+    def _complete(self, end: int) -> RKSOKRequest:
+        """Parses the request ending with the empty line at 'end'."""
+        if end + 4 > self._max_size:
+            raise IncorrectRequestError(f'The request is longer than {self._max_size} bytes.', self.is_batch())
+        raw = bytes(self._buffer[:end + 4])
+        del self._buffer[:end + 4]
+        try:
+            text = str(memoryview(raw)[:end], self._encoding)
+        except UnicodeDecodeError:
+            raise IncorrectRequestError(f'The request is not in {self._encoding}.', self._is_batch_line(raw))
+        self._reset()
+        lines = text.split('\r\n')
+        if self._batch_suffix is not None and lines[0].endswith(self._batch_suffix):
+            return self._complete_batch(lines, raw)
+        if len(lines) > self._max_lines:
+            raise IncorrectRequestError(f'More than {self._max_lines} lines in the request.')
+        if not lines[0].endswith(self._protocol_suffix):
+            raise IncorrectRequestError('The first line of the request does not end with the protocol.')
+        method, _, name = lines[0][:-len(self._protocol_suffix)].partition(' ')
+        name = name.strip().upper()
+        if method not in self._methods or not self._is_name(name):
+            raise IncorrectRequestError(f'Incorrect method or name in the request: {method!r} {name!r}.')
+        if self._batch_suffix is not None and text.find(ITEM_SEPARATOR, len(lines[0])) >= 0:
+            raise IncorrectRequestError(f'A phone of {name!r} contains a tab.')
+        return RKSOKRequest(method, name, tuple(lines[1:]), raw)
+
+    def _complete_batch(self, lines: list, raw: bytes) -> RKSOKRequest:
+        method, _, count = lines[0][:-len(self._batch_suffix)].partition(' ')
+        if method not in self._methods or count.strip() != str(len(lines) - 1):
+            raise IncorrectRequestError(f'Incorrect method or number of items in the batch: {method!r} {count!r}.', \
+                True)
+        if not 0 < len(lines) - 1 <= self._max_batch_items:
+            raise IncorrectRequestError(f'A batch must have 1 to {self._max_batch_items} items.', True)
+        items = []
+        for line in lines[1:]:
+            name, *phones = line.split(ITEM_SEPARATOR)
+            name = name.strip().upper()
+            if not self._is_name(name):
+                raise IncorrectRequestError(f'Incorrect name in the batch: {name!r}.', True)
+            # An empty phone would end the response to a plain ОТДОВАЙ of the name: the empty line ends a response.
+            if '' in phones:
+                raise IncorrectRequestError(f'Empty phone of {name!r} in the batch.', True)
+            items.append((name, tuple(phones)))
+        return RKSOKRequest(method, count.strip(), (), raw, tuple(items))
+
+    def _is_name(self, name: str) -> bool:
+        """Whether the uppercased name is correct: its length is checked after uppercasing,
+        which may make it longer ('ß' -> 'SS'), and it is echoed in the responses and the logs."""
+        return 0 < len(name) <= self._max_name_len and name.isprintable() \
+            and self._protocol not in name and self._batch_protocol not in name
@@ -0,0 +1,262 @@
+"""Replication of the phonebook: the primary streams its changes over TCP to read-only followers,
+which keep a copy in memory and serve ОТДОВАЙ from it."""
+import asyncio
+import json
+import time
+from loguru import logger
+from store_rksok import WAL_DELETE, WAL_WRITE, WAL_WRITE_MANY, pack_phones, unpack_phones
+
+
+# Messages of the stream, JSON lines '[type, seq, time, ...]': 'seq' is the number of the last change
+# of the primary the message reflects, 'time' is the time of the primary when the message was sent.
+SNAPSHOT = 'S'
+SNAPSHOT_END = 'E'
+CHANGE = 'C'
+HEARTBEAT = 'H'
+
+# Names with phones in one snapshot message.
+SNAPSHOT_CHUNK = 1000
+
+
+class ReplicationError(Exception):
+    """Error that occurs when the stream of the primary is broken or the phonebook of a follower is written."""
+    pass
+
+
+class ReplicationSource:
+    """Serves the changes of the phonebook of the primary to the followers.
+
+    A follower gets the snapshot of the phonebook taken when it connects, then every change made
+    after the snapshot, in order, and a heartbeat when there have been no changes for 'heartbeat_interval'
+    seconds. Changes wait for a slow follower in its queue; a follower more than 'max_queue' changes behind
+    is disconnected and bootstraps again when it reconnects.
+
+    'publish' is set as 'on_change' of the store."""
+
+    def __init__(self, store, host: str, port: int, heartbeat_interval: float, max_queue: int):
+        self._store = store
+        self._host, self._port = host, port
+        self._heartbeat_interval = heartbeat_interval
+        self._max_queue = max_queue
+        self._server = None
+        self._followers = set()
+        self.seq = 0
+
+    @property
+    def followers(self) -> int:
+        return len(self._followers)
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._serve, self._host, self._port)
+        logger.info(f'Replication of the phonebook on {self._host}:{self._port}')
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for follower in list(self._followers):
+            try:
+                follower.put_nowait(None)
+            except asyncio.QueueFull:
+                # The sender is behind on the changes, it finds its queue gone and closes the connection.
+                self._followers.discard(follower)
+
+    def publish(self, record: tuple) -> None:
+        """Queues the change for every follower."""
+        self.seq += 1
+        message = encode_message(CHANGE, self.seq, *record)
+        for follower in list(self._followers):
+            try:
+                follower.put_nowait(message)
+            except asyncio.QueueFull:
+                logger.warning(f'A follower is over {self._max_queue} changes behind and is disconnected.')
+                # The sender finds its queue gone and closes the connection.
+                self._followers.discard(follower)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        addr = writer.get_extra_info('peername')
+        queue = asyncio.Queue(self._max_queue)
+        # The snapshot and the queue start at the same change: nothing is made between the two lines.
+        self._followers.add(queue)
+        items, seq = list(self._store.items()), self.seq
+        logger.info(f'Follower {addr!r} connected, sending {len(items)} names at change {seq}')
+        try:
+            for start in range(0, len(items), SNAPSHOT_CHUNK):
+                writer.write(encode_message(SNAPSHOT, seq, items[start:start + SNAPSHOT_CHUNK]))
+                await writer.drain()
+            writer.write(encode_message(SNAPSHOT_END, seq))
+            del items
+            while queue in self._followers:
+                try:
+                    message = await asyncio.wait_for(queue.get(), self._heartbeat_interval)
+                except asyncio.TimeoutError:
+                    message = encode_message(HEARTBEAT, self.seq)
+                if message is None:
+                    break
+                # The changes queued meanwhile go in one write.
+                messages = [message]
+                while not queue.empty() and messages[-1] is not None:
+                    messages.append(queue.get_nowait())
+                writer.writelines(message for message in messages if message is not None)
+                await writer.drain()
+                if messages[-1] is None:
+                    break
+        except ConnectionError as e:
+            logger.warning(f'Follower {addr!r} disconnected: {e!r}')
+        finally:
+            self._followers.discard(queue)
+            writer.close()
+
+
+class ReplicaStore:
+    """Read-only copy of the phonebook of the primary at 'host':'port' kept in memory like PhoneBookStore keeps it,
+    with its lookups.
+
+    'load' waits for the snapshot of the primary, 'start' applies the changes that follow as they come.
+    When the stream breaks, the follower reconnects every 'reconnect_interval' seconds and bootstraps again,
+    serving the copy it has meanwhile. 'on_change' is called with the name of every change applied
+    and with None when the whole copy is replaced.
+
+    'lag' is the age of the copy: the seconds since the primary sent the last message applied to it."""
+
+    def __init__(self, host: str, port: int, reconnect_interval: float):
+        self._host, self._port = host, port
+        self._reconnect_interval = reconnect_interval
+        self._data = {}
+        self._reader = None
+        self._writer = None
+        self._tail = None
+        self.on_change = None
+        self.seq = 0
+        self.primary_time = None
+        self.bootstraps = 0
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    @property
+    def lag(self) -> float or None:
+        return time.time() - self.primary_time if self.primary_time is not None else None
+
+    async def load(self) -> None:
+        """Connects to the primary and takes its snapshot, retrying until the primary is there."""
+        while True:
+            try:
+                await self._bootstrap()
+                return
+            except (OSError, ReplicationError) as e:
+                logger.warning(f'No snapshot from the primary {self._host}:{self._port}: {e!r}')
+                self._disconnect()
+                await asyncio.sleep(self._reconnect_interval)
+
+    def start(self) -> None:
+        if self._tail is None:
+            self._tail = asyncio.create_task(self._follow())
+
+    async def close(self) -> None:
+        if self._tail is not None:
+            self._tail.cancel()
+            try:
+                await self._tail
+            except asyncio.CancelledError:
+                pass
+            self._tail = None
+        self._disconnect()
+
+    def items(self):
+        for name, phones in self._data.items():
+            yield name, unpack_phones(phones)
+
+    async def lookup(self, name: str) -> tuple or None:
+        phones = self._data.get(name)
+        return unpack_phones(phones) if phones is not None else None
+
+    async def lookup_many(self, names: list) -> list:
+        return [await self.lookup(name) for name in names]
+
+    async def save(self, name: str, phone: tuple) -> None:
+        raise ReplicationError('The phonebook of a follower is read-only.')
+
+    async def save_many(self, items: list) -> None:
+        raise ReplicationError('The phonebook of a follower is read-only.')
+
+    async def remove(self, name: str) -> bool:
+        raise ReplicationError('The phonebook of a follower is read-only.')
+
+    async def _bootstrap(self) -> None:
+        self._reader, self._writer = await asyncio.open_connection(self._host, self._port, \
+            limit=16 * 1024 * 1024)
+        data = {}
+        while True:
+            kind, seq, primary_time, *args = await self._read_message()
+            if kind == SNAPSHOT:
+                data.update((name, pack_phones(phone)) for name, phone in args[0])
+            elif kind == SNAPSHOT_END:
+                break
+            else:
+                raise ReplicationError(f'Unexpected message in the snapshot: {kind!r}')
+        # The copy is replaced at once, lookups never see a half of a snapshot.
+        self._data = data
+        self.seq, self.primary_time = seq, primary_time
+        self.bootstraps += 1
+        if self.on_change is not None:
+            self.on_change(None)
+        logger.info(f'Phonebook copied from the primary: {len(data)} names at change {seq}')
+
+    async def _follow(self) -> None:
+        while True:
+            try:
+                if not self.connected:
+                    await self._bootstrap()
+                while True:
+                    self._apply(await self._read_message())
+            except (OSError, ReplicationError) as e:
+                logger.warning(f'Replication stream of the primary is broken: {e!r}, the copy is at change {self.seq}')
+                self._disconnect()
+                await asyncio.sleep(self._reconnect_interval)
+
+    def _apply(self, message: list) -> None:
+        kind, seq, primary_time, *args = message
+        if kind == CHANGE:
+            if seq != self.seq + 1:
+                raise ReplicationError(f'Change {seq} follows change {self.seq}.')
+            record = args
+            if record[0] == WAL_WRITE:
+                self._data[record[1]] = pack_phones(record[2])
+                changed = (record[1],)
+            elif record[0] == WAL_DELETE:
+                self._data.pop(record[1], None)
+                changed = (record[1],)
+            elif record[0] == WAL_WRITE_MANY:
+                for name, phone in record[1]:
+                    self._data[name] = pack_phones(phone)
+                changed = (name for name, _ in record[1])
+            else:
+                raise ReplicationError(f'Unknown change {record[0]!r}')
+            if self.on_change is not None:
+                for name in changed:
+                    self.on_change(name)
+            self.seq = seq
+        elif kind != HEARTBEAT:
+            raise ReplicationError(f'Unexpected message: {kind!r}')
+        self.primary_time = primary_time
+
+    async def _read_message(self) -> list:
+        line = await self._reader.readline()
+        if not line:
+            raise ReplicationError('The primary closed the connection.')
+        try:
+            return json.loads(line)
+        except ValueError:
+            raise ReplicationError(f'Broken message: {line[:100]!r}')
+
+    def _disconnect(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._reader, self._writer = None, None
+
+
+def encode_message(kind: str, seq: int, *args) -> bytes:
+    return json.dumps([kind, seq, time.time(), *args], ensure_ascii=False, separators=(',', ':')).encode() + b'\n'
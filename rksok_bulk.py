@@ -0,0 +1,222 @@
+"""Bulk RKSOK client: runs many operations against RKSOK server with bounded
+concurrency over the connection pool of AsyncRKSOKClient.
+
+Two modes:
+    run  — reads operations (verb, name, phone) from a CSV or JSONL file
+           and writes results as JSON lines, e.g. for data migration;
+    load — generates random operations for a while and reports throughput
+           and p50/p95/p99 latency per verb, e.g. for capacity testing.
+
+python rksok_bulk.py SERVER PORT run operations.csv --concurrency 50
+python rksok_bulk.py SERVER PORT load --duration 30 --mix get=90,write=5,delete=5
+"""
+import argparse
+import asyncio
+import csv
+import json
+import math
+import random
+import sys
+import time
+from typing import Iterator, Optional
+
+from rksok_client import (AsyncRKSOKClient, CanNotParseResponseError,
+                          RequestVerb, ENCODING, compose_request,
+                          get_response_status)
+
+VERB_ALIASES = {
+    **{verb.name: verb for verb in RequestVerb},
+    **{verb.value: verb for verb in RequestVerb}
+}
+
+
+class Operation:
+    """One request to RKSOK server"""
+
+    __slots__ = ("verb", "name", "phone")
+
+    def __init__(self, verb: RequestVerb, name: str,
+                 phone: Optional[str] = None):
+        self.verb, self.name, self.phone = verb, name, phone
+
+
+def read_operations(path: str) -> Iterator[Operation]:
+    """Reads operations from CSV (verb,name,phone) or JSONL
+    ({"verb": ..., "name": ..., "phone": ...}) file. Verb is GET, WRITE,
+    DELETE or the RKSOK verb itself; phone may be a list in JSONL."""
+    with open(path, encoding=ENCODING, newline="") as f:
+        if path.endswith(".jsonl"):
+            rows = (json.loads(line) for line in f if line.strip())
+            rows = ((row["verb"], row["name"], row.get("phone"))
+                    for row in rows)
+        else:
+            rows = (row + [None] * (3 - len(row)) for row in csv.reader(f)
+                    if row)
+        for verb, name, phone in rows:
+            if isinstance(phone, list):
+                phone = "\r\n".join(phone)
+            yield Operation(VERB_ALIASES[verb.strip().upper()], name,
+                            phone or None)
+
+
+async def execute(client: AsyncRKSOKClient, operation: Operation) -> dict:
+    """Sends one operation, returns its result"""
+    started = time.perf_counter()
+    try:
+        response = await client.send(compose_request(
+            operation.verb, operation.name, operation.phone))
+        status = get_response_status(response).name
+        payload = response.split("\r\n")[1:-2]
+    except CanNotParseResponseError:
+        status, payload = "UNPARSABLE", [response]
+    except asyncio.TimeoutError:
+        status, payload = "TIMEOUT", []
+    except OSError as e:
+        status, payload = "CONNECTION_ERROR", [repr(e)]
+    return {
+        "verb": operation.verb.name,
+        "name": operation.name,
+        "status": status,
+        "payload": payload,
+        "latency_ms": round((time.perf_counter() - started) * 1000, 3)
+    }
+
+
+async def run_operations(client: AsyncRKSOKClient,
+                         operations: Iterator[Operation],
+                         concurrency: int, output) -> dict:
+    """Runs operations with at most `concurrency` of them at once, writes
+    each result as JSON line as soon as it is ready. Returns the number
+    of results per status."""
+    statuses = {}
+
+    async def worker():
+        for operation in operations:
+            result = await execute(client, operation)
+            statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return statuses
+
+
+def parse_mix(mix: str) -> dict:
+    """Parses "get=90,write=5,delete=5" into weights per verb"""
+    weights = {}
+    for part in mix.split(","):
+        verb, weight = part.split("=")
+        weights[VERB_ALIASES[verb.strip().upper()]] = float(weight)
+    return weights
+
+
+def percentile(sorted_values: list, percent: float) -> float:
+    index = max(math.ceil(len(sorted_values) * percent / 100) - 1, 0)
+    return sorted_values[index]
+
+
+async def generate_load(client: AsyncRKSOKClient, concurrency: int,
+                        duration: float, mix: dict, names: int,
+                        phones: int = 1) -> dict:
+    """Sends random operations for `duration` seconds, returns latencies
+    in ms per verb and the number of results per status. Names are
+    load0 ... load{names-1}, every WRITE carries `phones` phones."""
+    verbs, weights = list(mix), list(mix.values())
+    latencies = {verb: [] for verb in verbs}
+    statuses = {}
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            verb = random.choices(verbs, weights)[0]
+            name = f"load{random.randrange(names)}"
+            phone = "\r\n".join(f"+7{random.randrange(10 ** 10):010}"
+                                 for _ in range(phones)) \
+                if verb == RequestVerb.WRITE else None
+            result = await execute(client, Operation(verb, name, phone))
+            latencies[verb].append(result["latency_ms"])
+            statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return {"latencies": latencies, "statuses": statuses}
+
+
+def make_load_report(load: dict, duration: float) -> dict:
+    report = {"duration_s": duration, "statuses": load["statuses"],
+              "verbs": {}}
+    for verb, latencies in load["latencies"].items():
+        if not latencies:
+            continue
+        latencies.sort()
+        report["verbs"][verb.name] = {
+            "requests": len(latencies),
+            "rps": round(len(latencies) / duration, 1),
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99)
+        }
+    return report
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("server")
+    parser.add_argument("port", type=int)
+    parser.add_argument("--concurrency", type=int, default=10,
+                        help="operations at once")
+    parser.add_argument("--connections", type=int,
+                        help="connections in the pool, --concurrency "
+                             "by default")
+    parser.add_argument("--keep-alive", action="store_true",
+                        help="reuse connections, the server must have "
+                             "KEEP_ALIVE on")
+    parser.add_argument("--pipeline-depth", type=int, default=1,
+                        help="requests sent over a kept connection "
+                             "without waiting for the responses")
+    parser.add_argument("--timeout", type=float, default=10,
+                        help="seconds to wait for a response")
+    modes = parser.add_subparsers(dest="mode", required=True)
+    run = modes.add_parser("run", help="run operations from a file")
+    run.add_argument("operations", help="CSV or JSONL file")
+    run.add_argument("--output", help="file for results, stdout by default")
+    load = modes.add_parser("load", help="generate load")
+    load.add_argument("--duration", type=float, default=10,
+                      help="seconds")
+    load.add_argument("--mix", default="get=90,write=5,delete=5",
+                      help="weights of verbs")
+    load.add_argument("--names", type=int, default=10000,
+                      help="number of different names")
+    load.add_argument("--phones", type=int, default=1,
+                      help="phones in every WRITE")
+    return parser.parse_args()
+
+
+async def main() -> None:
+    args = get_args()
+    client = AsyncRKSOKClient(args.server, args.port,
+                              args.connections or args.concurrency,
+                              args.keep_alive, args.timeout,
+                              args.pipeline_depth)
+    try:
+        if args.mode == "run":
+            output = open(args.output, "w", encoding=ENCODING) \
+                if args.output else sys.stdout
+            try:
+                statuses = await run_operations(
+                    client, read_operations(args.operations),
+                    args.concurrency, output)
+            finally:
+                if output is not sys.stdout:
+                    output.close()
+            print(json.dumps(statuses, ensure_ascii=False), file=sys.stderr)
+        else:
+            load = await generate_load(client, args.concurrency, args.duration,
+                                       parse_mix(args.mix), args.names,
+                                       args.phones)
+            print(json.dumps(make_load_report(load, args.duration),
+                             ensure_ascii=False, indent=2))
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
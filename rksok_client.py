@@ -1,7 +1,9 @@
+import asyncio
+import collections
 from enum import Enum
 import socket
 import sys
-from typing import Optional
+from typing import NamedTuple, Optional
 
 
 class NotSpecifiedIPOrPortError(Exception):
@@ -33,6 +35,16 @@ class ResponseStatus(Enum):
 
 PROTOCOL = "РКСОК/1.0"
 ENCODING = "UTF-8"
+END_OF_MESSAGE = b"\r\n\r\n"
+
+# Longest response to read, a response of many phones is longer than
+# the default limit of asyncio streams.
+RESPONSE_LIMIT = 16 * 1024 * 1024
+
+# Extension of the protocol: many names in one request, see [BATCH] of the
+# server config. Items are lines of a name and its phones separated by tabs.
+BATCH_PROTOCOL = "РКСОК-ПАЧКА/1.0"
+ITEM_SEPARATOR = "\t"
 
 HUMAN_READABLE_ANSWERS = {
     RequestVerb.GET: {
@@ -70,11 +82,250 @@ MODE_TO_VERB = {
 }
 
 
+def compose_request(verb: RequestVerb, name: str,
+                    phone: Optional[str] = None) -> bytes:
+    """Composes RKSOK request, returns it as bytes"""
+    request = f"{verb.value} {name.strip()} {PROTOCOL}\r\n"
+    if phone: request += f"{phone.strip()}\r\n"
+    request += "\r\n"
+    return request.encode(ENCODING)
+
+
+def compose_batch_request(verb: RequestVerb,
+                          items: list[tuple[str, Optional[str]]]) -> bytes:
+    """Composes batch request of (name, phone) items, returns it as bytes.
+    Phones of a name are given as lines of `phone`."""
+    request = f"{verb.value} {len(items)} {BATCH_PROTOCOL}\r\n"
+    for name, phone in items:
+        fields = [name.strip()]
+        if phone: fields += phone.strip().split("\r\n")
+        request += ITEM_SEPARATOR.join(fields) + "\r\n"
+    request += "\r\n"
+    return request.encode(ENCODING)
+
+
+def get_response_status(raw_response: str) -> ResponseStatus:
+    """Returns status of the response from RKSOK server"""
+    for response_status in ResponseStatus:
+        if raw_response.startswith(f"{response_status.value} "):
+            return response_status
+    raise CanNotParseResponseError()
+
+
+class RKSOKResponse(NamedTuple):
+    """Response of RKSOK server: status, payload lines and raw string"""
+    status: ResponseStatus
+    payload: list[str]
+    raw: str
+
+
+def parse_response(raw_response: str) -> RKSOKResponse:
+    """Parses raw response of RKSOK server"""
+    return RKSOKResponse(get_response_status(raw_response),
+                         raw_response.split("\r\n")[1:-2], raw_response)
+
+
+def make_human_readable(verb: RequestVerb, name: str,
+                        response_status: ResponseStatus,
+                        response_payload: str) -> str:
+    """Returns human readable answer to the request"""
+    if response_status == ResponseStatus.NOT_APPROVED:
+        response_payload = f"\nКомментарий органов: {response_payload}"
+    return HUMAN_READABLE_ANSWERS.get(verb).get(response_status) \
+        .format(name=name, payload=response_payload)
+
+
+class _Connection:
+    """Connection to RKSOK server. Requests may be pipelined: responses
+    come in the order of the requests and are handed out to the waiting
+    futures one by one."""
+
+    def __init__(self, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter):
+        self._writer = writer
+        self._waiting = collections.deque()
+        self.broken = False
+        self._reading = asyncio.create_task(self._read_responses(reader))
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._waiting)
+
+    def send(self, request: bytes) -> asyncio.Future:
+        """Sends request, returns future of its raw response"""
+        response = asyncio.get_running_loop().create_future()
+        self._waiting.append(response)
+        self._writer.write(request)
+        return response
+
+    async def drain(self) -> None:
+        await self._writer.drain()
+
+    def close(self, error: Optional[Exception] = None) -> None:
+        """Closes connection, the requests waiting for their responses
+        get `error`"""
+        self.broken = True
+        self._writer.close()
+        if not self._reading.done() and \
+                self._reading is not asyncio.current_task():
+            self._reading.cancel()
+        error = error or ConnectionResetError("The connection is closed")
+        while self._waiting:
+            response = self._waiting.popleft()
+            if not response.done():
+                response.set_exception(error)
+
+    async def _read_responses(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                response = await reader.readuntil(END_OF_MESSAGE)
+                if not self._waiting:
+                    raise ConnectionError("Response without request")
+                # A request that has timed out still gets its response,
+                # so that the next ones get theirs.
+                waiting = self._waiting.popleft()
+                if not waiting.done():
+                    waiting.set_result(response)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ConnectionError) as e:
+            self.close(ConnectionResetError(
+                f"The connection is broken: {e!r}"))
+
+
+class AsyncRKSOKClient:
+    """Asyncio client of RKSOK server with a pool of at most `size`
+    connections, for use in async code.
+
+    With keep_alive, connections are reused and up to `pipeline_depth`
+    requests are sent over one connection without waiting for the
+    responses; the server must have KEEP_ALIVE on. Otherwise every request
+    gets a new connection. A response is read up to its empty line.
+    A request is given up after `timeout` seconds, a request that fails
+    on a broken connection is sent again over a new one up to `retries`
+    times."""
+
+    def __init__(self, server: str, port: int, size: int = 10,
+                 keep_alive: bool = False, timeout: Optional[float] = 10,
+                 pipeline_depth: int = 1, retries: int = 1):
+        self._server, self._port = server, port
+        self._size = size
+        self._keep_alive = keep_alive
+        self._timeout = timeout
+        self._pipeline_depth = pipeline_depth if keep_alive else 1
+        self._retries = retries
+        self._connections = []
+        self._connecting = 0
+        self._changed = asyncio.Condition()
+
+    async def __aenter__(self) -> "AsyncRKSOKClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def get(self, name: str,
+                  timeout: Optional[float] = None) -> RKSOKResponse:
+        return await self.request(RequestVerb.GET, name, timeout=timeout)
+
+    async def write(self, name: str, phone: str,
+                    timeout: Optional[float] = None) -> RKSOKResponse:
+        return await self.request(RequestVerb.WRITE, name, phone, timeout)
+
+    async def delete(self, name: str,
+                     timeout: Optional[float] = None) -> RKSOKResponse:
+        return await self.request(RequestVerb.DELETE, name, timeout=timeout)
+
+    async def request(self, verb: RequestVerb, name: str,
+                      phone: Optional[str] = None,
+                      timeout: Optional[float] = None) -> RKSOKResponse:
+        """Sends request, returns parsed response. Raises
+        CanNotParseResponseError, OSError and asyncio.TimeoutError"""
+        return parse_response(await self.send(
+            compose_request(verb, name, phone), timeout))
+
+    async def send(self, request: bytes,
+                   timeout: Optional[float] = None) -> str:
+        """Sends raw request, returns raw response as string. `timeout`
+        replaces the timeout of the client for this request"""
+        return await asyncio.wait_for(
+            self._send(request),
+            self._timeout if timeout is None else timeout)
+
+    async def close(self) -> None:
+        """Closes all connections"""
+        for connection in self._connections:
+            connection.close()
+        self._connections = []
+
+    async def _send(self, request: bytes) -> str:
+        for attempt in range(self._retries + 1):
+            connection, response = await self._submit(request)
+            try:
+                await connection.drain()
+                return (await response).decode(ENCODING)
+            except ConnectionError:
+                connection.close()
+                if attempt == self._retries:
+                    raise
+            finally:
+                await self._release(connection)
+
+    async def _submit(self, request: bytes) -> tuple:
+        """Sends request over the least loaded kept connection with a free
+        pipeline slot or over a new one. Waits while the pool is full."""
+        async with self._changed:
+            while True:
+                self._connections = [c for c in self._connections
+                                     if not c.broken]
+                free = [c for c in self._connections
+                        if c.in_flight < self._pipeline_depth] \
+                    if self._keep_alive else []
+                if free:
+                    connection = min(free, key=lambda c: c.in_flight)
+                    return connection, connection.send(request)
+                if len(self._connections) + self._connecting < self._size:
+                    self._connecting += 1
+                    break
+                await self._changed.wait()
+        try:
+            reader, writer = await asyncio.open_connection(
+                self._server, self._port, limit=RESPONSE_LIMIT)
+        except BaseException:
+            self._connecting -= 1
+            await self._release(None)
+            raise
+        self._connecting -= 1
+        connection = _Connection(reader, writer)
+        self._connections.append(connection)
+        return connection, connection.send(request)
+
+    async def _release(self, connection: Optional[_Connection]) -> None:
+        if connection is not None and not self._keep_alive:
+            connection.close()
+        async with self._changed:
+            self._changed.notify()
+
+
 class RKSOKPhoneBook:
-    """Phonebook working with RKSOK server."""
+    """Phonebook working with RKSOK server.
+
+    With keep_alive, one connection is used for all requests and a response
+    is read up to its empty line; the server must have KEEP_ALIVE on.
+    Otherwise a response is read until the server closes the connection.
+
+    get_phones and write_phones send up to `batch_size` names per request
+    when the server takes batches, and one request per name otherwise:
+    the first batch answered with the bare НИПОНЯЛ РКСОК/1.0 switches
+    batches off. A batch the server rejects is answered in РКСОК-ПАЧКА/1.0,
+    and the busy response has a line after the status."""
 
-    def __init__(self, server: str, port: int):
+    def __init__(self, server: str, port: int, keep_alive: bool = False,
+                 batch_size: int = 100):
         self._server, self._port = server, port
+        self._keep_alive = keep_alive
+        self._batch_size = batch_size
+        # None until the server has answered a batch.
+        self._batches = None
         self._conn = None
         self._name, self._phone, self._verb = None, None, None
         self._raw_request, self._raw_response = None, None
@@ -95,6 +346,21 @@ class RKSOKPhoneBook:
         human_response = self._parse_response(raw_response)
         return human_response
 
+    def get_phones(self, names: list[str]) -> dict:
+        """Gets phones of many names, returns (ResponseStatus, phones) by name"""
+        return self._process_many(RequestVerb.GET,
+                                  [(name, None) for name in names])
+
+    def write_phones(self, phones: dict[str, str]) -> dict:
+        """Writes phones by name, returns (ResponseStatus, []) by name"""
+        return self._process_many(RequestVerb.WRITE, list(phones.items()))
+
+    def close(self) -> None:
+        """Closes connection with RKSOK server"""
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
     def get_raw_request(self) -> Optional[str]:
         """Returns last request in raw string format"""
         return self._raw_request
@@ -103,44 +369,98 @@ class RKSOKPhoneBook:
         """Returns last response in raw string format"""
         return self._raw_response
 
-    def _send_request(self) -> str:
-        """Sends request to RKSOK server and return response as string."""
-        request_body = self._get_request_body()
+    def _process_many(self, verb: RequestVerb,
+                      items: list[tuple[str, Optional[str]]]) -> dict:
+        """Sends items in batches or one by one, returns results by name"""
+        results = {}
+        for start in range(0, len(items), self._batch_size):
+            chunk = items[start:start + self._batch_size]
+            batch_results = self._send_batch(verb, chunk) \
+                if self._batches is not False else None
+            if batch_results is not None:
+                results.update(batch_results)
+                continue
+            for name, phone in chunk:
+                response = self._send_request(
+                    compose_request(verb, name, phone))
+                status = get_response_status(response)
+                results[name] = (status, response.split("\r\n")[1:-2]
+                                 if status == ResponseStatus.OK else [])
+        return results
+
+    def _send_batch(self, verb: RequestVerb,
+                    items: list[tuple[str, Optional[str]]]) -> Optional[dict]:
+        """Sends items in one batch request, returns results by name or
+        None if the server does not take batches"""
+        response = self._send_request(compose_batch_request(verb, items))
+        lines = response.split("\r\n")
+        status = get_response_status(response)
+        if lines[0] == f"{status.value} {BATCH_PROTOCOL}":
+            self._batches = True
+            if status == ResponseStatus.INCORRECT_REQUEST:
+                return {name: (status, []) for name, _ in items}
+            results = {}
+            for (name, _), line in zip(items, lines[1:-2]):
+                item_status, _, *phones = line.split(ITEM_SEPARATOR)
+                try:
+                    results[name] = (ResponseStatus(item_status), phones)
+                except ValueError:
+                    raise CanNotParseResponseError()
+            return results
+        # A server without batches answers a bare НИПОНЯЛ in РКСОК/1.0.
+        unclear = f"{ResponseStatus.INCORRECT_REQUEST.value} {PROTOCOL}"
+        if response == f"{unclear}\r\n\r\n" and self._batches is None:
+            self._batches = False
+            return None
+        # The whole batch is refused, e.g. by the inspector.
+        return {name: (status, lines[1:-2]) for name, _ in items}
+
+    def _send_request(self, request_body: Optional[bytes] = None) -> str:
+        """Sends request to RKSOK server and return response as string.
+        Without `request_body`, the request is composed of verb, name and
+        phone set before."""
+        if request_body is None:
+            request_body = self._get_request_body()
         self._raw_request = request_body.decode(ENCODING)
+        reused = self._conn is not None
         if not self._conn:
             self._conn = socket.create_connection((self._server, self._port))
-        self._conn.sendall(request_body)
-        self._raw_response = self._receive_response_body()
+        try:
+            self._conn.sendall(request_body)
+            self._raw_response = self._receive_response_body()
+        except ConnectionError:
+            self._raw_response = ""
+        if not self._raw_response and reused:
+            # The server has closed the kept connection, e.g. after
+            # its idle timeout, so the request goes over a new one.
+            self.close()
+            return self._send_request(request_body)
+        if not self._keep_alive:
+            self.close()
         return self._raw_response
 
     def _get_request_body(self) -> bytes:
         """Composes RKSOK request, returns it as bytes"""
-        request = f"{self._verb.value} {self._name.strip()} {PROTOCOL}\r\n"
-        if self._phone: request += f"{self._phone.strip()}\r\n"
-        request += "\r\n"
-        return request.encode(ENCODING)
+        return compose_request(self._verb, self._name, self._phone)
 
     def _parse_response(self, raw_response: str) -> str:
         """Parses response from RKSOK server and returns parsed data"""
-        for response_status in ResponseStatus:
-            if raw_response.startswith(f"{response_status.value} "):
-                break
-        else:
-            raise CanNotParseResponseError()
-        response_payload = "".join(raw_response.split("\r\n")[1:])
-        if response_status == ResponseStatus.NOT_APPROVED:
-            response_payload = f"\nКомментарий органов: {response_payload}"
-        return HUMAN_READABLE_ANSWERS.get(self._verb).get(response_status) \
-            .format(name=self._name, payload=response_payload)
+        return make_human_readable(
+            self._verb, self._name, get_response_status(raw_response),
+            "".join(raw_response.split("\r\n")[1:]))
 
     def _receive_response_body(self) -> str:
         """Receives data from socket connection and returns it as string,
-        decoded using ENCODING"""
-        response = b""
+        decoded using ENCODING. With keep_alive the response ends with
+        an empty line, otherwise with the closed connection."""
+        response = bytearray()
         while True:
             data = self._conn.recv(1024)
             if not data: break
+            scan_from = max(len(response) - 3, 0)
             response += data
+            if self._keep_alive and response.find(b"\r\n\r\n", scan_from) >= 0:
+                break
         return response.decode(ENCODING)
 
 
@@ -188,6 +508,13 @@ def process_critical_exception(message: str):
     exit(1)
 
 
+async def ask_server(server: str, port: int, verb: RequestVerb, name: str,
+                     phone: Optional[str]) -> RKSOKResponse:
+    """Sends one request with AsyncRKSOKClient, returns its response"""
+    async with AsyncRKSOKClient(server, port, size=1) as client:
+        return await client.request(verb, name, phone)
+
+
 def run_client() -> None:
     """Asks all needed data from client and process his query."""
     try:
@@ -200,27 +527,26 @@ def run_client() -> None:
             "к которому мы будем подключаться. Например:\n\n"
             "python3.9 rksok_client.py my-rksok-server.ru 5555\n")
 
-    try:
-        client = RKSOKPhoneBook(server, port)
-    except ConnectionRefusedError:
-        process_critical_exception("Не могу подключиться к указанному "
-                "серверу и порту")
-
     verb = MODE_TO_VERB.get(get_mode())
-    client.set_verb(verb)
-    client.set_name(input("Введи имя: "))
-    if verb == RequestVerb.WRITE:
-        client.set_phone(input("Введи телефон: "))
+    name = input("Введи имя: ")
+    phone = input("Введи телефон: ") if verb == RequestVerb.WRITE else None
 
     try:
-        human_readable_response = client.process()
+        response = asyncio.run(ask_server(server, port, verb, name, phone))
     except CanNotParseResponseError:
         process_critical_exception(
             "Не смог разобрать ответ от сервера РКСОК:("
         )
-    print(f"\nЗапрос: {client.get_raw_request()!r}\n"
-          f"Ответ:{client.get_raw_response()!r}\n")
-    print(human_readable_response)
+    except asyncio.TimeoutError:
+        process_critical_exception("Сервер РКСОК не ответил вовремя")
+    except OSError:
+        process_critical_exception("Не могу подключиться к указанному "
+                "серверу и порту")
+    raw_request = compose_request(verb, name, phone).decode(ENCODING)
+    print(f"\nЗапрос: {raw_request!r}\n"
+          f"Ответ:{response.raw!r}\n")
+    print(make_human_readable(verb, name, response.status,
+                              "".join(response.raw.split("\r\n")[1:])))
 
 
 if __name__ == "__main__":
@@ -1,273 +1,648 @@
 """Server for receiving requests and sending responses to the client according to the RKSOK standard 'РКСОК/1.0'."""
+import argparse
 import asyncio
-import re
-import json
-from configparser import ConfigParser
+import contextvars
+import hashlib
+import os
+import random
+import signal
+import sys
+import time
 from loguru import logger
-import aiofiles
-
-
-# Read from "config.ini"
-config = ConfigParser()
-config.read("config.ini")
-
-# Logging
-logger.add("debug.log", format="{time} {level} {message}", level="DEBUG", rotation="12:00")
-
-# Line endings
-END_S = '\r\n'
-EMPTY_S = '\r\n\r\n'
-# Conversion to bytes
-EMPTY_S_B = EMPTY_S.encode(config['SETTINGS']['ENCODING'])
-GET_B = config['REQUEST_METHODS']['GET'].encode(config['SETTINGS']['ENCODING'])
-DELETE_B = config['REQUEST_METHODS']['DELETE'].encode(config['SETTINGS']['ENCODING'])
-WRITE_B = config['REQUEST_METHODS']['WRITE'].encode(config['SETTINGS']['ENCODING'])
-
-
-async def write_to_file (phone_book: str, data : dict) -> json:
-    """Writes the new name and phone number (or just the phone number if the name exists) to the phonebook file."""
-    name_phone = json.dumps(data, ensure_ascii=False)
-    logger.info(f'name_phone:{name_phone!r}')
-    async with aiofiles.open(phone_book, mode='w') as f:
-        await f.write(name_phone)
-
-
-async def read_from_file(name_file: str) -> json or None:
-    """"Reads the phone by name from the phonebook file."""
-    async with aiofiles.open(name_file, mode='r') as f:
-        data_from_phone_book = await f.read()
-        if data_from_phone_book:
-            string_from_file = str(data_from_phone_book)
-        else:
-            string_from_file = None
-    logger.info(f'string_from_file:{string_from_file!r}')
-    return string_from_file
-
-
-async def get_phone_by_name(name: str) -> str:
-    """Gets a phone from the phonebook."""
-    data_conf = config['RESPONSE']
-    data_from_name_phone = await read_from_file('name_phone.json')
-    data = json.loads(data_from_name_phone)
-    if data:
-        if name in data:    
-            phone = list(data[name])
-            phone_to_msg = ''
-            for data_phone in phone:
-                phone_to_msg += data_phone + END_S
-            message_for_get_phone = f"{data_conf['normally']}{END_S}{phone_to_msg}{END_S}"
-        else:
-            message_for_get_phone = f"{data_conf['not_found']}{EMPTY_S}"
+from store_rksok import PhoneBookStore
+from index_rksok import IndexedPhoneBook
+from cluster_rksok import RemoteStore, StoreService, Supervisor
+from cache_rksok import ResponseCache
+from inspector_rksok import CircuitBreaker, InspectorError, InspectorPool, VerdictCache
+from metrics_rksok import Metrics, collect_replication, collect_response_cache, collect_verdict_caches
+from parser_rksok import ITEM_SEPARATOR, IncorrectRequestError, RequestParser, RKSOKRequest
+from replication_rksok import ReplicaStore, ReplicationSource
+from rksok_client import AsyncRKSOKClient
+from settings_rksok import EMPTY_S, END_S, read_settings
+
+
+# Read from "config.ini". The settings of the request handling are replaced as a whole on SIGHUP.
+config, settings = read_settings("config.ini")
+
+# Whether the steps of the request being handled are logged, see 'SAMPLE' of [LOGGING].
+request_sampled = contextvars.ContextVar('request_sampled', default=True)
+
+# 'time.perf_counter' by which the request being handled must be answered, see 'REQUEST_TIMEOUT'.
+request_deadline = contextvars.ContextVar('request_deadline')
+
+
+def setup_logging(level: str, log_file: str, rotation: str or None, enqueue: bool, console: bool) -> None:
+    """Replaces the default sink of the logger with the file and, optionally, the console.
+    With 'enqueue' the records are written by a background thread, the requests do not wait for the disk."""
+    logger.remove()
+    if console:
+        logger.add(sys.stderr, level=level, enqueue=enqueue)
+    logger.add(log_file, format="{time} {level} {message}", level=level, rotation=rotation, enqueue=enqueue)
+
+
+def log_request(level: str, message: str, *args) -> None:
+    """Logs a step of the request handling if the request is sampled.
+    The message is formatted with 'args' by the logger and only when 'level' is enabled."""
+    if request_sampled.get():
+        logger.opt(depth=1).log(level, message, *args)
+
+# Phonebook, opened at server start. Cluster workers replace it with the phonebook of the supervisor,
+# a follower keeps a copy of the phonebook of the primary.
+replication = config['REPLICATION']
+# none, primary or follower: read once, the role is not changed on SIGHUP.
+role = replication['ROLE']
+if role == 'follower':
+    store = ReplicaStore(replication['PRIMARY_IP'], int(replication['PRIMARY_PORT']), \
+        float(replication['RECONNECT_INTERVAL']))
+elif config['STORAGE']['BACKEND'] == 'indexed':
+    store = IndexedPhoneBook(config['STORAGE']['INDEX'], config['STORAGE']['DATA'], config['SETTINGS']['ENCODING'], \
+        config['STORAGE'].getboolean('FSYNC'))
+else:
+    store = PhoneBookStore(config['STORAGE']['PHONE_BOOK'], config['STORAGE']['WAL'], \
+        float(config['STORAGE']['FLUSH_INTERVAL']), int(config['STORAGE']['FLUSH_DIRTY']), \
+        config['STORAGE'].getboolean('FSYNC'), int(config['STORAGE']['COMPACT_RECORDS']), \
+        int(config['STORAGE']['LOCK_STRIPES']))
+
+# The primary serves every change of the phonebook to the followers; None - not a primary.
+replication_source = None
+if role == 'primary':
+    replication_source = ReplicationSource(store, replication['IP'], int(replication['PORT']), \
+        float(replication['HEARTBEAT_INTERVAL']), int(replication['MAX_QUEUE']))
+    store.on_change = replication_source.publish
+
+# A follower sends ЗОПИШИ and УДОЛИ to the primary with this client or, if it is None, rejects them.
+primary = None
+if role == 'follower' and replication['WRITES'] == 'forward':
+    primary = AsyncRKSOKClient(replication['PRIMARY_IP'], int(replication['PRIMARY_RKSOK_PORT']), \
+        int(replication['FORWARD_POOL_SIZE']), replication.getboolean('FORWARD_KEEP_ALIVE'))
+
+# Warm connections to the 'vragi-vezde' server, not asked for a while after it failed many times in a row.
+inspector = InspectorPool(config['INSPECTOR']['DOMAIN'], int(config['INSPECTOR']['PORT']), \
+    int(config['INSPECTOR']['POOL_SIZE']), float(config['INSPECTOR']['IDLE_TIMEOUT']), \
+    float(config['INSPECTOR']['CONNECT_TIMEOUT']), int(config['INSPECTOR']['PIPELINE_DEPTH']), \
+    float(config['INSPECTOR']['TIMEOUT']), int(config['INSPECTOR']['MAX_WAITING']), \
+    CircuitBreaker(int(config['INSPECTOR']['BREAKER_FAILURES']), float(config['INSPECTOR']['BREAKER_RESET'])))
+
+# Tasks serving the client connections, a stopping worker waits for them.
+connections = set()
+# Tasks answering the connections over 'MAX_CONNECTIONS' with the busy response, at most 'MAX_CONNECTIONS' too.
+rejected_connections = set()
+
+# Caches of the inspector verdicts by verb, verbs with TTL 0 always go to the inspector.
+verdict_caches = {}
+for verb in ('GET', 'DELETE', 'WRITE'):
+    if float(config['VERDICT_CACHE'][f'{verb}_TTL']) > 0:
+        verdict_caches[verb] = VerdictCache( \
+            float(config['VERDICT_CACHE'][f'{verb}_TTL']), int(config['VERDICT_CACHE'][f'{verb}_MAX_ENTRIES']))
+
+# Encoded ОТДОВАЙ responses by name, dropped on ЗОПИШИ and УДОЛИ of the name; None - no cache.
+# Cluster workers go without it: the changes made by the other workers would not drop their responses.
+response_cache = ResponseCache(int(config['RESPONSE_CACHE']['MAX_BYTES'])) \
+    if int(config['RESPONSE_CACHE']['MAX_BYTES']) > 0 else None
+
+# Latency of the request stages, response statuses and inspector errors; None - nothing is measured.
+metrics = Metrics() if config['METRICS'].getboolean('ENABLED') else None
+if metrics is not None:
+    metrics.collectors.append(collect_verdict_caches(verdict_caches))
+
+
+def drop_replicated_response(name: str or None) -> None:
+    """Drops the cached response to the name changed on the primary, all of them when the copy is replaced."""
+    if response_cache is None:
+        return
+    if name is None:
+        response_cache.clear()
     else:
-        message_for_get_phone = f"{data_conf['not_found']}{EMPTY_S}"
-    logger.info(f'message_for_get_phone:{message_for_get_phone!r}')
+        response_cache.invalidate(name)
+
+if role == 'follower':
+    store.on_change = drop_replicated_response
+
+
+async def get_phone_by_name(name: str) -> bytes:
+    """Gets a phone from the phonebook, the response to a name found is kept in the response cache."""
+    if response_cache is not None:
+        message_for_get_phone = response_cache.get(name)
+        if message_for_get_phone is not None:
+            return message_for_get_phone
+        epoch = response_cache.epoch
+    phone = await store.lookup(name)
+    if phone is not None:
+        message_for_get_phone = settings.normally + f'{END_S.join(phone)}{END_S}{END_S}'.encode(settings.encoding) \
+            if phone else settings.ok
+        if response_cache is not None:
+            response_cache.put(name, message_for_get_phone, epoch)
+    else:
+        message_for_get_phone = settings.not_found
+    log_request('DEBUG', 'message_for_get_phone:{!r}', message_for_get_phone)
     return message_for_get_phone
 
 
-async def delete_name(name: str) -> str:
+async def delete_name(name: str) -> bytes:
     """Removes the name with phone from the phonebook."""
-    data_conf = config['RESPONSE']
-    data_from_name_phone = await read_from_file('name_phone.json')
-    data = json.loads(data_from_name_phone)
-    if data:
-        if name in data:
-            data_to_file = dict(data)
-            del data_to_file[name]
-            await write_to_file('name_phone.json', data_to_file)
-            message_for_delete_name = f"{data_conf['normally']}{EMPTY_S}"
-        else:
-            message_for_delete_name = f"{data_conf['not_found']}{EMPTY_S}"
+    try:
+        removed = await store.remove(name)
+    finally:
+        # A change that failed to be logged may have been made in memory.
+        if response_cache is not None:
+            response_cache.invalidate(name)
+    if removed:
+        message_for_delete_name = settings.ok
     else:
-        message_for_delete_name = f"{data_conf['not_found']}{EMPTY_S}"
-    logger.info(f'message_for_delete_name:{message_for_delete_name!r}')
+        message_for_delete_name = settings.not_found
+    log_request('DEBUG', 'message_for_delete_name:{!r}', message_for_delete_name)
     return message_for_delete_name
 
 
-async def write_name_phone(name: str, data_phone: str):
+async def write_name_phone(name: str, phone: tuple):
     """Writes a new name with a phone number or a new phone number with an existing name in the phone book"""
-    #Gathering all request phones into a tuple.
-    data_from_name_phone = await read_from_file('name_phone.json')
-    data_from_file = json.loads(data_from_name_phone)
-    length_data_phone = len(data_phone)
-    phone = ()
-    for number in data_phone[1:(length_data_phone-2)]:
-        if number:
-            phone += (number,)
-    if data_from_file:
-        #If the name is in the phone book, then we change the existing phone to a new phone.
-        if name in data_from_file:
-            data_from_file[name] = phone
-            data_to_file = data_from_file
-            logger.info(f'data_to_file:{data_to_file!r}')
-            await write_to_file('name_phone.json', data_to_file)
-        else:
-            data_from_file[name] = phone
-            data_to_file = data_from_file
-            logger.info(f'data_to_file:{data_to_file!r}')
-            await write_to_file('name_phone.json', data_to_file)
-    else:
-        #For the first request 'write_name_phone'.
-        new_dict = {}
-        new_dict[name] = phone
-        data_to_file = new_dict
-        logger.info(f'data_to_file:{data_to_file!r}')
-        await write_to_file('name_phone.json', data_to_file)
-
-
-async def parse_message_received(message_received: str) -> tuple[str, str]:
-    """Get from the query string: method, name, phone."""
-    name_for_phone = re.split(r' ', message_received.split(config['REQUEST_METHODS']['PROTOCOL'])[0], \
-         maxsplit = 1)[-1].strip().upper()
-    method = message_received.split()[0]
-    if method == config['REQUEST_METHODS']['WRITE']:
-        data_phone = re.split(rf'{END_S}', message_received.split(config['REQUEST_METHODS']['PROTOCOL'])[1])
-        parse_tuple = (method, name_for_phone, data_phone)
-    else:
-        parse_tuple = (method, name_for_phone)
-    return parse_tuple
-    
+    #If the name is in the phone book, then the existing phones are replaced with the new ones.
+    try:
+        await store.save(name, phone)
+    finally:
+        # The response is dropped after the change: a lookup made before it cannot put the old one back.
+        if response_cache is not None:
+            response_cache.invalidate(name)
+    log_request('DEBUG', 'name_phone:{!r}: {!r}', name, phone)
 
-async def make_msg_to_client_if_get(name: str) -> str:
+
+async def make_msg_to_client_if_get(request: RKSOKRequest) -> bytes:
     """Make message if method in the request is 'ОТДОВАЙ'."""
-    message = await get_phone_by_name(name)
-    logger.info(f'message_to_client:{message!r}')
-    return message
+    return await get_phone_by_name(request.name)
 
 
-async def make_msg_to_client_if_delete(name: str) -> str:
+async def make_msg_to_client_if_delete(request: RKSOKRequest) -> bytes:
     """Make message to the client if method in the request is 'УДОЛИ'."""
-    message = await delete_name(name)
-    logger.info(f'message_to_client:{message!r}')
-    return message
+    return await delete_name(request.name)
 
 
-async def make_msg_to_client_if_write(name: str, data_phone: str) -> str:
+async def make_msg_to_client_if_write(request: RKSOKRequest) -> bytes:
     """Make message to the client if method in the request is 'ЗОПИШИ'."""
-    await write_name_phone(name, data_phone)
-    message = f"{config['RESPONSE']['normally']}{EMPTY_S}"
-    logger.info(f'message_to_client:{message!r}')
-    return message
-
-
-async def make_msg_to_client(parse_tuple: tuple[str, str]) -> str:
-    """Prepares message to the client."""
-    data_conf = config['REQUEST_METHODS']
-    method = parse_tuple[0]
-    if method == data_conf['GET']:
-        message_to_client = await make_msg_to_client_if_get(parse_tuple[1])
-    elif method == data_conf['DELETE']:
-        message_to_client = await make_msg_to_client_if_delete(parse_tuple[1])
-    elif method == data_conf['WRITE']:
-        message_to_client = await make_msg_to_client_if_write(parse_tuple[1], parse_tuple[2])
+    await write_name_phone(request.name, request.phones)
+    return settings.ok
+
+
+async def get_phones_by_names(names: list) -> bytes:
+    """Gets the phones of many names from the phonebook at once, with the status of every name."""
+    items = []
+    for name, phone in zip(names, await store.lookup_many(names)):
+        if phone is not None:
+            items.append(ITEM_SEPARATOR.join((settings.item_ok, name, *phone)))
+        else:
+            items.append(f'{settings.item_not_found}{ITEM_SEPARATOR}{name}')
+    return settings.batch_normally + f'{END_S.join(items)}{EMPTY_S}'.encode(settings.encoding)
+
+
+async def write_names_phones(items: tuple) -> bytes:
+    """Writes many names with phones to the phonebook as one change."""
+    try:
+        await store.save_many(list(items))
+    finally:
+        if response_cache is not None:
+            for name, _ in items:
+                response_cache.invalidate(name)
+    log_request('DEBUG', 'names_phones:{!r}', items)
+    return settings.batch_normally + \
+        f'{END_S.join(f"{settings.item_ok}{ITEM_SEPARATOR}{name}" for name, _ in items)}{EMPTY_S}' \
+        .encode(settings.encoding)
+
+
+async def make_msg_to_client_if_batch_get(request: RKSOKRequest) -> bytes:
+    """Make message to the client if the request is a batch 'ОТДОВАЙ', the phones of the items are ignored."""
+    return await get_phones_by_names([name for name, _ in request.items])
+
+
+async def make_msg_to_client_if_batch_write(request: RKSOKRequest) -> bytes:
+    """Make message to the client if the request is a batch 'ЗОПИШИ'."""
+    return await write_names_phones(request.items)
+
+
+# The handler of every verb, see 'verbs' of the settings, and of the verbs taken in batches.
+HANDLERS = {
+    'GET': make_msg_to_client_if_get,
+    'DELETE': make_msg_to_client_if_delete,
+    'WRITE': make_msg_to_client_if_write,
+}
+BATCH_HANDLERS = {
+    'GET': make_msg_to_client_if_batch_get,
+    'WRITE': make_msg_to_client_if_batch_write,
+}
+
+
+async def make_msg_to_client(request: RKSOKRequest) -> bytes:
+    """Prepares message to the client. When the phonebook fails (its log is not written, the phonebook
+    of the cluster supervisor is gone or fails), the busy response is returned."""
+    verb = settings.verbs[request.method]
+    handler = HANDLERS[verb] if request.items is None else BATCH_HANDLERS[verb]
+    started = time.perf_counter() if metrics is not None else 0
+    try:
+        message_to_client = await handler(request)
+    except (OSError, RuntimeError) as e:
+        logger.error(f'Phonebook error on {request!r}: {e!r}')
+        if metrics is not None:
+            metrics.inc('phonebook_errors_total', (('error', type(e).__name__),))
+        return settings.busy
+    if metrics is None:
+        return message_to_client
+    metrics.observe('stage_seconds', (('stage', 'phonebook'), ('verb', verb)), time.perf_counter() - started)
     return message_to_client
 
 
-async def make_response_to_client(msg_from_vragi_vezde: str, msg_received: str) -> str:
+async def make_response_to_client(msg_from_vragi_vezde: bytes, request: RKSOKRequest) -> bytes:
     "If the 'vragi-vezde.to.digital' server allowed the response, then we produce a full response. If the server received a refusal, then instead of a response, we send only a refusal."
-    if msg_from_vragi_vezde == f"{config['INSPECTOR']['response_yes']}{EMPTY_S}":
-        parse_tuple = await parse_message_received(msg_received)
-        response_to_client = await make_msg_to_client(parse_tuple)
+    if msg_from_vragi_vezde == settings.inspector_approved:
+        response_to_client = await make_msg_to_client(request)
     else:
-        response_to_client = f'{msg_from_vragi_vezde}'
-    logger.info(f'response_to_client:{response_to_client!r}')
+        response_to_client = msg_from_vragi_vezde
+    log_request('DEBUG', 'response_to_client:{!r}', response_to_client)
     return response_to_client
 
 
-async def send_reciev_vragi_vezde(message: str) ->str:
-    """Sends a request, receives a response from the server 'vragi-vezde'."""
+def time_left() -> float:
+    """Seconds left to answer the request being handled."""
+    return request_deadline.get() - time.perf_counter()
+
+
+async def send_reciev_vragi_vezde(message: bytes) -> bytes:
+    """Sends a request, receives a response from the server 'vragi-vezde' within the time left to the request."""
     try:
-        reader, writer = await asyncio.open_connection \
-            (config['INSPECTOR']['DOMAIN'], config['INSPECTOR']['PORT'])
-        writer.write(message.encode(config['SETTINGS']['ENCODING']))
-        data = await reader.read(1024)
-        msg_from_vragi_vezde = data.decode(config['SETTINGS']['ENCODING'])
-        writer.close()
-        logger.info(f'From "vragi vezde:{msg_from_vragi_vezde!r}')
+        msg_from_vragi_vezde = await inspector.ask(message, time_left())
+        log_request('DEBUG', 'From "vragi vezde":{!r}', msg_from_vragi_vezde)
         return msg_from_vragi_vezde
-    except ConnectionRefusedError:
-        logger.debug('Unable to connect to server "vragi-vezde.to.digital".')
-
-
-async def check_request_client(raw_request: str) -> bool:
-    """Checks the correctness of the received request. Checks for the presence in the query string: Protocol Name, Protocol Method, the number of Name characters is not more than 30."""
-    data_conf = config['REQUEST_METHODS']
-    methods = {data_conf['GET'], data_conf['DELETE'], data_conf['WRITE']}
-    if data_conf['PROTOCOL'] in raw_request and raw_request.split()[0] in methods:
-        len_of_name = len(re.split(r' ', raw_request.split(data_conf['PROTOCOL'])[0], maxsplit = 1)[-1].strip())
-        if 0 < len_of_name <= int(data_conf['len_name']):
-            correctness_request = True
+    except (InspectorError, OSError, asyncio.TimeoutError) as e:
+        # Under overload or while the breaker is open every request may be turned away,
+        # such requests are logged as sampled.
+        if isinstance(e, InspectorError):
+            log_request('INFO', 'The request is turned away: {}', e)
         else:
-            correctness_request = False
-    else:
-        correctness_request = False
-    logger.info(f"correctness_request: {correctness_request!r}")
-    return correctness_request
-
-
-async def response_preparation(msg_received: str) ->str:
-    """Preparing a response to a request."""
-    # If the request is correct, we produce a response 'msg_response'.
-    if await check_request_client(msg_received):
-        msg_to_vragi_vezde = f"{config['INSPECTOR'] ['request']}{END_S}{msg_received}"
-        msg_from_vragi_vezde =  await send_reciev_vragi_vezde(msg_to_vragi_vezde)
-        msg_response = await make_response_to_client(msg_from_vragi_vezde, msg_received)
+            logger.warning(f'Unable to get the verdict of "vragi-vezde.to.digital": {e!r}')
+        if metrics is not None:
+            metrics.inc('inspector_errors_total', (('error', type(e).__name__),))
+        raise
+
+
+async def forward_to_primary(request: RKSOKRequest) -> bytes:
+    """Sends ЗОПИШИ or УДОЛИ received by a follower to the primary, which asks the inspector itself,
+    and returns its response. The change reaches the copy of the follower with the replication stream."""
+    if primary is None:
+        return settings.read_only
+    try:
+        return (await primary.send(request.raw, time_left())).encode(settings.encoding)
+    except (OSError, asyncio.TimeoutError) as e:
+        logger.warning(f'Unable to forward the request to the primary: {e!r}')
+        if metrics is not None:
+            metrics.inc('forward_errors_total', (('error', type(e).__name__),))
+        return settings.busy
+
+
+def make_verdict_key(request: RKSOKRequest) -> tuple[str, str, bytes]:
+    """Makes the verdict cache key of the request: method, name and hash of the phones."""
+    payload = request.raw[request.raw.find(b'\r\n') + 2:]
+    return request.method, request.name, hashlib.blake2b(payload, digest_size=16).digest()
+
+
+async def response_preparation(request: RKSOKRequest) -> bytes:
+    """Preparing a response to a request. When the inspector is overloaded, down or gives no verdict in time,
+    the request is not processed and the busy response is returned. A follower serves only ОТДОВАЙ."""
+    verb = settings.verbs[request.method]
+    if request.items is not None and verb not in BATCH_HANDLERS:
+        return settings.batch_unclear
+    if role == 'follower' and verb != 'GET':
+        return await forward_to_primary(request)
+    # The inspector checks a batch as a whole.
+    msg_to_vragi_vezde = settings.inspector_request + request.raw
+    verdict_cache = verdict_caches.get(verb)
+    started = time.perf_counter() if metrics is not None else 0
+    try:
+        if verdict_cache:
+            msg_from_vragi_vezde = await verdict_cache.get(make_verdict_key(request), \
+                lambda: send_reciev_vragi_vezde(msg_to_vragi_vezde))
+        else:
+            msg_from_vragi_vezde =  await send_reciev_vragi_vezde(msg_to_vragi_vezde)
+    except (InspectorError, OSError, asyncio.TimeoutError):
+        return settings.busy
+    if metrics is not None:
+        metrics.observe('stage_seconds', (('stage', 'verdict'), ('verb', verb)), time.perf_counter() - started)
+    msg_response = await make_response_to_client(msg_from_vragi_vezde, request)
+    return msg_response
+
+
+def make_request_parser() -> RequestParser:
+    """Makes the parser of the client requests of one connection."""
+    return RequestParser(set(settings.verbs), settings.protocol, settings.encoding, settings.max_name_len, \
+        settings.max_request_size, settings.max_request_lines, settings.batch_protocol, settings.max_batch_items)
+
+
+async def read_request(reader: asyncio.streams.StreamReader, parser: RequestParser, timeout: float) \
+        -> RKSOKRequest or None:
+    """Reads the next request of the connection. Returns None if the client has closed the connection
+    or has been silent for 'timeout' seconds. A request must be read whole within 'READ_TIMEOUT' seconds
+    from its first bytes and answered within 'REQUEST_TIMEOUT' seconds from them."""
+    # Bytes are parsed as they arrive, an incorrect request is rejected without reading it to the end.
+    # A request pipelined behind the previous one may have been received already.
+    request = parser.feed(b'') if parser.has_data() else None
+    # The read stage and the read timeout start with the first bytes of the request, not with the wait for them.
+    started = time.perf_counter() if request is None and parser.has_data() else None
+    while request is None:
+        if started is not None:
+            timeout = started + settings.read_timeout - time.perf_counter()
+        try:
+            data = await asyncio.wait_for(reader.read(1024), timeout)
+        except asyncio.TimeoutError:
+            if started is not None:
+                raise IncorrectRequestError(f'The request is not read in {settings.read_timeout} seconds.', \
+                    parser.is_batch())
+            return None
+        if not data:
+            if parser.has_data():
+                raise IncorrectRequestError('Connection closed before the end of the request.')
+            return None
+        if started is None:
+            started = time.perf_counter()
+        request = parser.feed(data)
+    request_deadline.set((time.perf_counter() if started is None else started) + settings.request_timeout)
+    if metrics is not None and started is not None:
+        metrics.observe('stage_seconds', (('stage', 'read'), ('verb', settings.verbs[request.method])), \
+            time.perf_counter() - started)
+    return request
+
+
+async def send_response(writer: asyncio.streams.StreamWriter, msg_response: bytes, timeout: float):
+    """Submitting a response 'msg_response' within 'timeout' seconds."""
+    writer.write(msg_response)
+    # A response taken whole by the socket is sent even with no time left.
+    if writer.transport.get_write_buffer_size():
+        await asyncio.wait_for(writer.drain(), timeout)
     else:
-        msg_response = f"{config['RESPONSE']['unclear']}{EMPTY_S}"
+        await writer.drain()
+    log_request('DEBUG', 'Send to client: {!r}', msg_response)
+
+
+async def serve_request(request: RKSOKRequest, addr) -> bytes:
+    """Prepares the response to the request of the client 'addr', decides whether the request is logged.
+    INFO logs one line per request, DEBUG every step of it."""
+    request_sampled.set(settings.log_sample >= 1 or random.random() < settings.log_sample)
+    log_request('DEBUG', 'Received from {!r}: {!r}', addr, request)
+    msg_response = await response_preparation(request)
+    if request_sampled.get():
+        logger.info('{!r} {} {} -> {}', addr, request.method, request.name, \
+            msg_response[:msg_response.find(b'\r\n')].decode(settings.encoding))
     return msg_response
 
 
-async def check_first_100_bytes(data: bytes) -> bool:
-    "Checks for protocol methods."
-    if data.startswith(GET_B) or data.startswith(DELETE_B) or data.startswith(WRITE_B):
-        return True
+async def serve_measured(writer: asyncio.streams.StreamWriter, request: RKSOKRequest, addr) -> None:
+    """'serve_request' and 'send_response' with their time and the response status in the metrics."""
+    verb = settings.verbs[request.method]
+    metrics.add('requests_in_flight', 1)
+    started = time.perf_counter()
+    try:
+        msg_response = await serve_request(request, addr)
+        sending = time.perf_counter()
+        await send_response(writer, msg_response, time_left())
+    finally:
+        metrics.add('requests_in_flight', -1)
+    finished = time.perf_counter()
+    metrics.observe('stage_seconds', (('stage', 'send'), ('verb', verb)), finished - sending)
+    metrics.observe('stage_seconds', (('stage', 'request'), ('verb', verb)), finished - started)
+    metrics.inc('responses_total', (('verb', verb), \
+        ('status', msg_response[:msg_response.find(b' ')].decode(settings.encoding))))
 
 
 async def reciev_send_client(reader: asyncio.streams.StreamReader, writer: asyncio.streams.StreamWriter):
-    """Receives a request, if the request is correct, then sends it for preparing a response to a request."""
-    data = await reader.read(100)
-    # Get the first part of the request.                             
+    """Receives a request, if the request is correct, then sends it for preparing a response to a request.
+    With 'KEEP_ALIVE' on, requests of the connection are answered one by one, in the order they came.
+    Above 'MAX_CONNECTIONS' connections the new ones get the busy response and are closed."""
     addr = writer.get_extra_info('peername')
-    logger.info(f"First 100 bytes received from {addr!r}{data}")    
-    # Spam Protection
-    if not await check_first_100_bytes(data):
-        logger.info(f"Received unknown protocol from {addr!r}: {data}")
-        # msg_response = str (config['RESPONSE']['unclear'] + EMPTY_S)
-        msg_response = f"{config['RESPONSE']['unclear']}{EMPTY_S}"
-    else:    
-        # If there is no end value '\r\n\r\n' in the first part of the received request, continue reading the request.
-        if not data.endswith(EMPTY_S_B):
-            while True:
-                data += await reader.read(1024)
-                # We continue to read the request, wait for the value of the end '\r\n\r\n' and insure against a broken connection.
-                if not data or data.endswith(EMPTY_S_B):
-                    break
-            msg_received = data.decode(config['SETTINGS']['ENCODING'])
-            logger.info(f"Received more than 100 bytes from {addr!r}: {msg_received!r}")
-            msg_response = await response_preparation(msg_received)
-        else:
-            msg_received = data.decode(config['SETTINGS']['ENCODING'])
-            logger.info(f"Received from {addr!r}: {msg_received!r}")
-            msg_response = await response_preparation(msg_received)    
-    # Submitting a response 'msg_response'.
-    writer.write(msg_response.encode(config['SETTINGS']['ENCODING']))
-    await writer.drain()
-    logger.info(f"Send to client: {msg_response!r}")
-    logger.info("Close the connection")
-    writer.close()
+    if len(connections) >= settings.max_connections:
+        log_request('INFO', 'Too many connections, {!r} is turned away', addr)
+        if metrics is not None:
+            metrics.inc('rejected_connections_total')
+        rejected_connections.add(asyncio.current_task())
+        try:
+            writer.write(settings.busy)
+            writer.write_eof()
+            # The request is read to the end before closing, otherwise the unread bytes reset the connection
+            # and the client may lose the response. It is read for 'READ_TIMEOUT' seconds in all,
+            # and not at all when 'MAX_CONNECTIONS' connections are being turned away already.
+            if len(rejected_connections) <= settings.max_connections:
+                deadline = time.perf_counter() + settings.read_timeout
+                while await asyncio.wait_for(reader.read(1024), deadline - time.perf_counter()):
+                    pass
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            rejected_connections.discard(asyncio.current_task())
+        writer.close()
+        return
+    parser = make_request_parser()
+    connections.add(asyncio.current_task())
+    if metrics is not None:
+        metrics.add('connections_in_flight', 1)
+    if settings.keep_alive:
+        timeout, max_requests = settings.keep_alive_timeout, settings.max_requests_per_connection
+    else:
+        timeout, max_requests = settings.read_timeout, 1
+    try:
+        for _ in range(max_requests):
+            try:
+                request = await read_request(reader, parser, timeout)
+            except IncorrectRequestError as e:
+                log_request('INFO', 'Incorrect request from {!r}: {}', addr, e)
+                if metrics is not None:
+                    metrics.inc('responses_total', (('verb', 'unknown'), ('status', 'НИПОНЯЛ')))
+                await send_response(writer, settings.batch_unclear if e.batch else settings.unclear, \
+                    settings.request_timeout)
+                break
+            if request is None:
+                break
+            if metrics is None:
+                await send_response(writer, await serve_request(request, addr), time_left())
+            else:
+                await serve_measured(writer, request, addr)
+    except ConnectionError as e:
+        log_request('INFO', 'Connection with {!r} is broken: {!r}', addr, e)
+    except asyncio.TimeoutError:
+        log_request('INFO', 'The response to {!r} is not sent in {} seconds', addr, settings.request_timeout)
+    finally:
+        connections.discard(asyncio.current_task())
+        if metrics is not None:
+            metrics.add('connections_in_flight', -1)
+        log_request('DEBUG', 'Close the connection with {!r}', addr)
+        writer.close()
+
+
+async def start_metrics(port: int) -> asyncio.base_events.Server or None:
+    """Starts serving the metrics if they are on."""
+    if metrics is None:
+        return None
+    return await metrics.serve(config['METRICS']['IP'], port)
+
+
+def reload_settings() -> None:
+    """Reads "config.ini" again and replaces the settings of the request handling at once, on SIGHUP.
+    The phonebook, the inspector connections, the ports and the logging keep the settings they started with."""
+    global settings
+    try:
+        _, settings = read_settings("config.ini")
+    except (KeyError, ValueError) as e:
+        logger.error(f'Settings are not reloaded, config.ini is incorrect: {e!r}')
+        return
+    # The cached responses are made with the old status lines.
+    if response_cache is not None:
+        response_cache.clear()
+    logger.info('Settings reloaded')
+
+
+def log_caches() -> None:
+    for method, verdict_cache in verdict_caches.items():
+        logger.info(f'Verdict cache {method}: hits={verdict_cache.hits}, misses={verdict_cache.misses}, ' \
+            f'coalesced={verdict_cache.coalesced}')
+    if response_cache is not None:
+        logger.info(f'Response cache: hits={response_cache.hits}, misses={response_cache.misses}, ' \
+            f'hit ratio={response_cache.hit_ratio:.1%}, {response_cache.size} bytes')
 
 
 async def main():
-    "Server start."
+    "Server start. Stops on SIGTERM and Ctrl+C."
     data_conf = config['PROXY']
+    await store.load()
+    store.start()
+    if replication_source is not None:
+        await replication_source.start()
+    inspector.start()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_settings)
+    if metrics is not None and response_cache is not None:
+        metrics.collectors.append(collect_response_cache(response_cache))
+    if metrics is not None and role in ('primary', 'follower'):
+        metrics.gauge_collectors.append(collect_replication(replication_source, \
+            store if role == 'follower' else None))
+    metrics_server = await start_metrics(int(config['METRICS']['PORT']))
     server = await asyncio.start_server(reciev_send_client, \
         data_conf['IP'], data_conf['PORT'])
     addrs = ', '.join(str(sock.getsockname()) for sock in server.sockets)
     logger.info(f'Serving on {addrs}')
-    async with server:
-        await server.serve_forever()
+    serving = asyncio.create_task(server.serve_forever())
+    # SIGTERM stops the server like Ctrl+C: the changes not yet in the log are written before the exit.
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, serving.cancel)
+    try:
+        async with server:
+            await serving
+    except asyncio.CancelledError:
+        logger.info('The server has been stopped.')
+    finally:
+        if metrics_server is not None:
+            metrics_server.close()
+        if replication_source is not None:
+            await replication_source.close()
+        # Changes that have not been flushed yet are written on shutdown.
+        await store.close()
+        await inspector.close()
+        if primary is not None:
+            await primary.close()
+        log_caches()
+
+
+async def main_supervisor(workers: int):
+    """Supervisor of the cluster: owns the phonebook, keeps 'workers' worker processes serving the clients.
+    SIGHUP restarts the workers one by one, SIGTERM and Ctrl+C stop the cluster."""
+    data_conf = config['CLUSTER']
+    await store.load()
+    store.start()
+    if replication_source is not None:
+        await replication_source.start()
+    service = StoreService(store, data_conf['STORE_SOCKET'])
+    await service.start()
+    supervisor = Supervisor(service, [sys.executable, os.path.abspath(__file__), '--worker'], workers, \
+        float(data_conf['HEALTH_TIMEOUT']), float(data_conf['GRACE_PERIOD']))
+    loop = asyncio.get_running_loop()
+    watcher = None
+    # Restarts in progress: the loop keeps only a weak reference to a task, it is kept here until it is done.
+    restarts = set()
+
+    def restart() -> None:
+        task = asyncio.create_task(supervisor.restart())
+        restarts.add(task)
+        task.add_done_callback(restarts.discard)
+
+    try:
+        await supervisor.start()
+        watcher = asyncio.create_task(supervisor.watch(float(data_conf['HEARTBEAT_INTERVAL'])))
+        loop.add_signal_handler(signal.SIGHUP, restart)
+        loop.add_signal_handler(signal.SIGTERM, watcher.cancel)
+        logger.info(f'Supervisor serving the phonebook to {workers} workers')
+        await watcher
+    except asyncio.CancelledError:
+        pass
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        await supervisor.stop()
+        await service.close()
+        if replication_source is not None:
+            await replication_source.close()
+        await store.close()
+
+
+async def main_worker(number: int):
+    """Worker of the cluster: serves the clients on the port shared with the other workers (SO_REUSEPORT),
+    uses the phonebook of the supervisor. Stops on SIGTERM, after the connections being served end.
+    The metrics of worker 'number' are on [METRICS] PORT + 'number'."""
+    global store, response_cache
+    data_conf = config['CLUSTER']
+    response_cache = None
+    # Ctrl+C reaches the whole process group, the supervisor stops the workers itself.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    store = RemoteStore(data_conf['STORE_SOCKET'])
+    await store.connect()
+    inspector.start()
+    metrics_server = await start_metrics(int(config['METRICS']['PORT']) + number)
+    server = await asyncio.start_server(reciev_send_client, \
+        config['PROXY']['IP'], config['PROXY']['PORT'], reuse_port=True)
+    heartbeat = asyncio.create_task(store.heartbeat(float(data_conf['HEARTBEAT_INTERVAL'])))
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_settings)
+    try:
+        # The worker also stops when the supervisor is gone.
+        await asyncio.wait([asyncio.create_task(stop.wait()), asyncio.create_task(store.wait_closed())], \
+            return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        server.close()
+        if metrics_server is not None:
+            metrics_server.close()
+        if connections:
+            await asyncio.wait(connections, timeout=float(data_conf['GRACE_PERIOD']))
+        for connection in connections | rejected_connections:
+            connection.cancel()
+        heartbeat.cancel()
+        await inspector.close()
+        if primary is not None:
+            await primary.close()
+        await store.close()
+        log_caches()
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='RKSOK server')
+    parser.add_argument('--worker', type=int, metavar='NUMBER', help='run as a cluster worker, used by the supervisor')
+    return parser.parse_args()
+
 
 if __name__ == "__main__":
+    args = get_args()
+    workers = int(config['CLUSTER']['WORKERS']) or os.cpu_count()
+    log_file = config['LOGGING']['FILE']
+    if args.worker is not None:
+        # Every worker writes its own log: debug.log -> debug-1.log.
+        log_file = f'{os.path.splitext(log_file)[0]}-{args.worker}{os.path.splitext(log_file)[1]}'
+    setup_logging(config['LOGGING']['LEVEL'], log_file, config['LOGGING']['ROTATION'] or None, \
+        config['LOGGING'].getboolean('ENQUEUE'), config['LOGGING'].getboolean('CONSOLE'))
     try:
-        asyncio.run(main())
+        if args.worker is not None:
+            asyncio.run(main_worker(args.worker))
+        elif workers > 1:
+            asyncio.run(main_supervisor(workers))
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         logger.info('The server has been stopped by someone.')
@@ -0,0 +1,99 @@
+"""Settings of the request handling read from "config.ini" once: typed, frozen, with the responses encoded."""
+from configparser import ConfigParser
+from dataclasses import dataclass
+
+
+END_S = '\r\n'
+EMPTY_S = '\r\n\r\n'
+
+
+@dataclass(frozen=True, slots=True)
+class Settings:
+    """What the server needs to handle a request. Status lines are kept encoded,
+    the responses without a payload are kept whole: 'ok', 'not_found', 'unclear', 'batch_unclear', 'busy',
+    'read_only'."""
+
+    encoding: str
+    protocol: str
+    max_name_len: int
+    max_request_size: int
+    max_request_lines: int
+    keep_alive: bool
+    keep_alive_timeout: float
+    max_requests_per_connection: int
+    read_timeout: float
+    request_timeout: float
+    max_connections: int
+    log_sample: float
+    # None - batch requests are not taken.
+    batch_protocol: str or None
+    max_batch_items: int
+    # Request method of every verb and the verb of every request method.
+    get: str
+    delete: str
+    write: str
+    verbs: dict
+    # 'АМОЖНА? РКСОК/1.0\r\n', the client request follows it; 'МОЖНА РКСОК/1.0\r\n\r\n'.
+    inspector_request: bytes
+    inspector_approved: bytes
+    # 'НОРМАЛДЫКС РКСОК/1.0\r\n', the phones follow it; 'НОРМАЛДЫКС РКСОК-ПАЧКА/1.0\r\n', the items follow it.
+    normally: bytes
+    batch_normally: bytes
+    # 'НОРМАЛДЫКС', 'НИНАШОЛ': statuses of the batch items.
+    item_ok: str
+    item_not_found: str
+    ok: bytes
+    not_found: bytes
+    unclear: bytes
+    # 'НИПОНЯЛ РКСОК-ПАЧКА/1.0\r\n\r\n': a rejected batch, the client knows then that batches are taken.
+    batch_unclear: bytes
+    busy: bytes
+    read_only: bytes
+
+
+def load_settings(config: ConfigParser) -> Settings:
+    methods = config['REQUEST_METHODS']
+    encoding = config['SETTINGS']['ENCODING']
+
+    def encode(text: str) -> bytes:
+        return text.encode(encoding)
+
+    return Settings(
+        encoding=encoding,
+        protocol=methods['PROTOCOL'],
+        max_name_len=int(methods['len_name']),
+        max_request_size=int(config['SETTINGS']['MAX_REQUEST_SIZE']),
+        max_request_lines=int(config['SETTINGS']['MAX_REQUEST_LINES']),
+        keep_alive=config['SETTINGS'].getboolean('KEEP_ALIVE'),
+        keep_alive_timeout=float(config['SETTINGS']['KEEP_ALIVE_TIMEOUT']),
+        max_requests_per_connection=int(config['SETTINGS']['MAX_REQUESTS_PER_CONNECTION']),
+        read_timeout=float(config['SETTINGS']['READ_TIMEOUT']),
+        request_timeout=float(config['SETTINGS']['REQUEST_TIMEOUT']),
+        max_connections=int(config['SETTINGS']['MAX_CONNECTIONS']),
+        log_sample=float(config['LOGGING']['SAMPLE']),
+        batch_protocol=config['BATCH']['PROTOCOL'] if config['BATCH'].getboolean('ENABLED') else None,
+        max_batch_items=int(config['BATCH']['MAX_ITEMS']),
+        get=methods['GET'],
+        delete=methods['DELETE'],
+        write=methods['WRITE'],
+        verbs={methods[verb]: verb for verb in ('GET', 'DELETE', 'WRITE')},
+        inspector_request=encode(f"{config['INSPECTOR']['request']}{END_S}"),
+        inspector_approved=encode(f"{config['INSPECTOR']['response_yes']}{EMPTY_S}"),
+        normally=encode(f"{config['RESPONSE']['normally']}{END_S}"),
+        batch_normally=encode(f"{config['RESPONSE']['normally'].split(' ')[0]} {config['BATCH']['PROTOCOL']}{END_S}"),
+        item_ok=config['RESPONSE']['normally'].split(' ')[0],
+        item_not_found=config['RESPONSE']['not_found'].split(' ')[0],
+        ok=encode(f"{config['RESPONSE']['normally']}{EMPTY_S}"),
+        not_found=encode(f"{config['RESPONSE']['not_found']}{EMPTY_S}"),
+        unclear=encode(f"{config['RESPONSE']['unclear']}{EMPTY_S}"),
+        batch_unclear=encode(f"{config['RESPONSE']['unclear'].split(' ')[0]} {config['BATCH']['PROTOCOL']}{EMPTY_S}"),
+        busy=encode(f"{config['RESPONSE']['unclear']}{END_S}{config['RESPONSE']['busy']}{EMPTY_S}"),
+        read_only=encode(f"{config['RESPONSE']['unclear']}{END_S}{config['RESPONSE']['read_only']}{EMPTY_S}"),
+    )
+
+
+def read_settings(path: str) -> tuple[ConfigParser, Settings]:
+    """Reads the config file, returns it with the settings made of it."""
+    config = ConfigParser()
+    config.read(path)
+    return config, load_settings(config)
@@ -0,0 +1,356 @@
+"""Phonebook store for the RKSOK server: the phonebook is kept in memory, changes go to a write-ahead log."""
+import asyncio
+import contextlib
+import json
+import os
+from loguru import logger
+import aiofiles
+
+
+# Write-ahead log record types.
+WAL_WRITE = 'W'
+WAL_DELETE = 'D'
+# Names with phones written together: replayed all or none.
+WAL_WRITE_MANY = 'M'
+
+# The phones of a name are kept in memory as one string: a phone is a line of the request, it has no line ends.
+PHONE_SEPARATOR = '\r\n'
+
+# Names written to the snapshot with one json.dumps call: the event loop waits for the GIL at most one call.
+SNAPSHOT_CHUNK = 1000
+
+
+class PhoneBookStore:
+    """Phonebook kept in a dict in memory, the phones of a name packed into one string.
+
+    Every change is appended as one record to the write-ahead log. Records are written in batches:
+    every 'flush_interval' seconds or as soon as 'flush_dirty' changes have accumulated.
+    When the log grows to 'compact_records' records, it is folded into the phonebook snapshot file,
+    which is replaced atomically: the log is moved aside to '<wal>.old' and a copy of the phonebook is written
+    by a thread, while the changes go on to a new log. At start, the snapshot is read and both logs are replayed
+    over it.
+
+    Writers hold the lock of the name while changing it: names are spread over 'lock_stripes' locks,
+    so changes of different names go in parallel and changes of one name go one after another.
+
+    'on_change' is called with every change as it is made, in the order of the changes, with its log record:
+    (WAL_WRITE, name, phone), (WAL_DELETE, name) or (WAL_WRITE_MANY, items)."""
+
+    def __init__(self, phone_book: str, wal: str, flush_interval: float, flush_dirty: int, \
+            fsync: bool = False, compact_records: int = 10000, lock_stripes: int = 64):
+        self._phone_book = phone_book
+        self._wal = wal
+        self._folded_wal = f'{wal}.old'
+        self._flush_interval = flush_interval
+        self._flush_dirty = flush_dirty
+        self._fsync = fsync
+        self._compact_records = compact_records
+        self.on_change = None
+        self._data = {}
+        # Log records not yet written, the sequence numbers of the last logged and the last written
+        # records, and the writers waiting for their sequence number to reach the disk.
+        self._pending = []
+        self._logged_seq = 0
+        self._written_seq = 0
+        self._waiters = []
+        self._wal_records = 0
+        self._dirty_event = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._flusher = None
+        self._compaction = None
+        self._locks = [asyncio.Lock() for _ in range(lock_stripes)]
+
+    async def load(self) -> None:
+        """Reads the phonebook snapshot into memory and replays the write-ahead log over it.
+        A missing or empty snapshot gives an empty phonebook."""
+        try:
+            async with aiofiles.open(self._phone_book, mode='r') as f:
+                data_from_phone_book = await f.read()
+        except FileNotFoundError:
+            data_from_phone_book = ''
+        self._data = {}
+        if data_from_phone_book:
+            name_phone = json.loads(data_from_phone_book)
+            del data_from_phone_book
+            for name, phone in name_phone.items():
+                self._data[name] = pack_phones(phone)
+                # The phones are dropped as they are packed: the peak of the load stays near the loaded phonebook.
+                phone.clear()
+            del name_phone
+        replayed = await self._replay(self._folded_wal) + await self._replay(self._wal)
+        logger.info(f'Phonebook loaded: {len(self._data)} names, {replayed} log records replayed')
+        if replayed:
+            # Recovery starts the server with an empty log, without a possibly cut off last record.
+            await self.compact()
+
+    def start(self) -> None:
+        """Starts the background writing of the log."""
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        """Stops the background writing of the log and folds all changes into the snapshot."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+        if self._wal_records:
+            await self.compact()
+        elif self._compaction is not None:
+            await asyncio.wait([self._compaction])
+
+    def lock(self, name: str) -> asyncio.Lock:
+        """Returns the lock guarding the changes of the name."""
+        return self._locks[hash(name) % len(self._locks)]
+
+    def items(self):
+        """Yields the names and phones."""
+        for name, phones in self._data.items():
+            yield name, unpack_phones(phones)
+
+    def get(self, name: str) -> tuple or None:
+        """Returns the phones of the name or None if there is no such name."""
+        phones = self._data.get(name)
+        return unpack_phones(phones) if phones is not None else None
+
+    def put(self, name: str, phone: tuple) -> None:
+        """Writes a new name with phones or replaces the phones of an existing name."""
+        self._data[name] = pack_phones(phone)
+        self._log((WAL_WRITE, name, phone))
+
+    def delete(self, name: str) -> bool:
+        """Removes the name with phones. Returns False if there is no such name."""
+        if name not in self._data:
+            return False
+        del self._data[name]
+        self._log((WAL_DELETE, name))
+        return True
+
+    async def commit(self) -> None:
+        """With 'fsync' on, waits until the changes made so far are on disk.
+        Writers waiting at the same time share one write and one fsync of the log."""
+        if not self._fsync or self._written_seq >= self._logged_seq:
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((self._logged_seq, waiter))
+        self._dirty_event.set()
+        await waiter
+
+    # The operations of the server: the same for this store and for RemoteStore, the store of a cluster worker.
+
+    async def lookup(self, name: str) -> tuple or None:
+        """Returns the phones of the name or None if there is no such name."""
+        return self.get(name)
+
+    async def save(self, name: str, phone: tuple) -> None:
+        """Writes the phones of the name under its lock and commits the change."""
+        async with self.lock(name):
+            self.put(name, phone)
+            await self.commit()
+
+    async def remove(self, name: str) -> bool:
+        """Removes the name under its lock and commits the change. Returns False if there is no such name."""
+        async with self.lock(name):
+            if not self.delete(name):
+                return False
+            await self.commit()
+        return True
+
+    async def lookup_many(self, names: list) -> list:
+        """Returns the phones of every name, None for the names that are not in the phonebook."""
+        return [self.get(name) for name in names]
+
+    async def save_many(self, items: list) -> None:
+        """Writes the phones of all the names as one log record under their locks and commits them at once."""
+        # The locks are taken in one order, so that writers of overlapping batches wait for each other
+        # one after another and never in a cycle, which would deadlock them.
+        stripes = sorted({hash(name) % len(self._locks) for name, _ in items})
+        async with contextlib.AsyncExitStack() as stack:
+            for stripe in stripes:
+                await stack.enter_async_context(self._locks[stripe])
+            for name, phone in items:
+                self._data[name] = pack_phones(phone)
+            self._log((WAL_WRITE_MANY, items))
+            await self.commit()
+
+    async def flush(self) -> None:
+        """Appends the pending records to the log, then starts the compaction of the log if it has grown
+        too long and no compaction is running."""
+        async with self._flush_lock:
+            if self._pending:
+                await self._write_pending()
+            if self._wal_records >= self._compact_records and not self._compacting():
+                await self._start_compaction()
+
+    async def compact(self) -> None:
+        """Folds the log into the snapshot and waits until the snapshot is written."""
+        while True:
+            if self._compacting():
+                await asyncio.wait([self._compaction])
+            async with self._flush_lock:
+                if not self._compacting():
+                    if self._pending:
+                        await self._write_pending()
+                    await self._start_compaction()
+                    compaction = self._compaction
+                    break
+        await compaction
+
+    def _log(self, record: tuple) -> None:
+        if self.on_change is not None:
+            self.on_change(record)
+        self._pending.append(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+        self._logged_seq += 1
+        if len(self._pending) >= self._flush_dirty:
+            self._dirty_event.set()
+
+    async def _write_pending(self) -> None:
+        # Records added during the write go to the next batch.
+        records, self._pending = self._pending, []
+        batch_seq = self._written_seq + len(records)
+        self._dirty_event.clear()
+        try:
+            async with aiofiles.open(self._wal, mode='a') as f:
+                await f.write('\n'.join(records) + '\n')
+                if self._fsync:
+                    await f.flush()
+                    await asyncio.to_thread(os.fsync, f.fileno())
+        except OSError as e:
+            self._pending = records + self._pending
+            self._wake_waiters(batch_seq, e)
+            raise
+        self._written_seq = batch_seq
+        self._wal_records += len(records)
+        self._wake_waiters(batch_seq)
+        logger.debug('Phonebook log written: {} records', len(records))
+
+    def _wake_waiters(self, seq: int, error: Exception = None) -> None:
+        """Releases the writers whose records are up to 'seq', with the error if the write failed."""
+        waiting = []
+        for waiter_seq, waiter in self._waiters:
+            if waiter_seq > seq:
+                waiting.append((waiter_seq, waiter))
+            elif not waiter.done():
+                if error is None:
+                    waiter.set_result(None)
+                else:
+                    waiter.set_exception(error)
+        self._waiters = waiting
+
+    def _compacting(self) -> bool:
+        return self._compaction is not None and not self._compaction.done()
+
+    async def _start_compaction(self) -> None:
+        """Called under the flush lock with the log written: moves the log aside and starts writing the snapshot
+        of the phonebook as it is now. The changes made meanwhile go to the new log."""
+        # Everything in the log is already in memory, so the snapshot taken here makes the log redundant.
+        # Pending records are appended to the new log later, replaying them over the snapshot is harmless.
+        data = self._data.copy()
+        await asyncio.to_thread(self._rotate_log)
+        self._compaction = asyncio.create_task(self._write_snapshot(data, self._wal_records))
+        self._compaction.add_done_callback(log_compaction_error)
+        self._wal_records = 0
+
+    def _rotate_log(self) -> None:
+        """Moves the log aside to be folded. The log of a compaction that failed is still there:
+        the log is appended to it."""
+        if not os.path.exists(self._folded_wal):
+            with contextlib.suppress(FileNotFoundError):
+                os.replace(self._wal, self._folded_wal)
+            return
+        with contextlib.suppress(FileNotFoundError):
+            with open(self._wal) as f, open(self._folded_wal, 'a') as folded:
+                folded.write(f.read())
+            # A crash before the log is truncated replays its records twice, in the same order: harmless.
+            open(self._wal, 'w').close()
+
+    async def _write_snapshot(self, data: dict, records: int) -> None:
+        await asyncio.to_thread(self._write_snapshot_file, data)
+        logger.info(f'Phonebook log compacted: {records} records, {len(data)} names')
+
+    def _write_snapshot_file(self, data: dict) -> None:
+        """Run by a thread: writes the snapshot, replaces the old one, removes the log folded into it."""
+        tmp_phone_book = f'{self._phone_book}.tmp'
+        with open(tmp_phone_book, 'w') as f:
+            f.write(encode_snapshot(data))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_phone_book, self._phone_book)
+        # A crash before the log is removed only replays records already in the snapshot.
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._folded_wal)
+
+
+    async def _replay(self, wal: str) -> int:
+        """Applies the records of the log 'wal' to the phonebook in memory. Returns the number of log lines."""
+        try:
+            async with aiofiles.open(wal, mode='r') as f:
+                lines = (await f.read()).splitlines()
+        except FileNotFoundError:
+            return 0
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The last record may be cut off by a crash in the middle of the write.
+                logger.warning(f'Skipped a broken phonebook log record: {line!r}')
+                continue
+            if record[0] == WAL_WRITE:
+                self._data[record[1]] = pack_phones(record[2])
+            elif record[0] == WAL_DELETE:
+                self._data.pop(record[1], None)
+            elif record[0] == WAL_WRITE_MANY:
+                for name, phone in record[1]:
+                    self._data[name] = pack_phones(phone)
+        return len(lines)
+
+    async def _flush_loop(self) -> None:
+        """Writes the log on the interval or when the pending-records threshold is reached."""
+        while True:
+            try:
+                await asyncio.wait_for(self._dirty_event.wait(), self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except OSError as e:
+                logger.error(f'Unable to write the phonebook log: {e!r}')
+
+
+def encode_snapshot(data: dict) -> str:
+    """Returns the phonebook as JSON of names with lists of phones. The phones are unpacked
+    a chunk of names at a time, not all at once."""
+    chunks, chunk = [], {}
+    for name, phones in data.items():
+        chunk[name] = list(unpack_phones(phones))
+        if len(chunk) == SNAPSHOT_CHUNK:
+            chunks.append(json.dumps(chunk, ensure_ascii=False)[1:-1])
+            chunk = {}
+    if chunk:
+        chunks.append(json.dumps(chunk, ensure_ascii=False)[1:-1])
+    return '{' + ','.join(chunks) + '}'
+
+
+def log_compaction_error(compaction: asyncio.Task) -> None:
+    """The folded log is kept after an error, the next compaction folds it again."""
+    if not compaction.cancelled() and compaction.exception() is not None:
+        logger.error(f'Unable to compact the phonebook log: {compaction.exception()!r}')
+
+
+def pack_phones(phone: tuple or list) -> str:
+    """Packs the phones of a name into one string: a string takes far less memory than a tuple of strings.
+    Phones starting with an empty one get a leading separator, else no phones and one empty phone
+    would both be packed as ''."""
+    if phone and not phone[0]:
+        return PHONE_SEPARATOR + PHONE_SEPARATOR.join(phone)
+    return PHONE_SEPARATOR.join(phone)
+
+
+def unpack_phones(phones: str) -> tuple:
+    if phones.startswith(PHONE_SEPARATOR):
+        return tuple(phones[len(PHONE_SEPARATOR):].split(PHONE_SEPARATOR))
+    return tuple(phones.split(PHONE_SEPARATOR)) if phones else ()
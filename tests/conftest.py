@@ -0,0 +1,75 @@
+"""The modules of the server are imported from the repository root.
+The 'start_server' fixture runs server_rksok.py with vragi-vezde.py on loopback in a temporary directory."""
+import configparser
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{process.args} exited with code {process.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'{process.args} does not listen on {port}')
+
+
+def stop(process: subprocess.Popen) -> None:
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+@pytest.fixture
+def start_server(tmp_path):
+    """Returns a function starting the server with the settings given as {'SECTION.KEY': value}
+    over config.ini of the repository; it returns the port of the server. An inspector approving
+    every request is started with the first server. All the processes are stopped after the test."""
+    processes = []
+    inspector_port = get_free_port()
+
+    def start(settings: dict = None) -> int:
+        if not processes:
+            processes.append(subprocess.Popen([sys.executable, os.path.join(ROOT, 'vragi-vezde.py'), '127.0.0.1', \
+                str(inspector_port), '--approve-ratio', '1', '--quiet'], cwd=tmp_path, stdout=subprocess.DEVNULL))
+            wait_for_port(inspector_port, processes[0])
+        port = get_free_port()
+        directory = tmp_path / f'server{len(processes)}'
+        directory.mkdir()
+        config = configparser.ConfigParser()
+        config.read(os.path.join(ROOT, 'config.ini'), encoding='UTF-8')
+        for key, value in {'PROXY.PORT': port, 'INSPECTOR.DOMAIN': '127.0.0.1', 'INSPECTOR.PORT': inspector_port, \
+                'LOGGING.CONSOLE': 'no', **(settings or {})}.items():
+            section, option = key.split('.')
+            config[section][option] = str(value)
+        with open(directory / 'config.ini', 'w', encoding='UTF-8') as f:
+            config.write(f)
+        processes.append(subprocess.Popen([sys.executable, os.path.join(ROOT, 'server_rksok.py')], cwd=directory, \
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        wait_for_port(port, processes[-1])
+        return port
+
+    yield start
+    for process in reversed(processes):
+        stop(process)
@@ -0,0 +1,243 @@
+"""The plain reading of the RKSOK protocol the request parser is checked against, and the requests to check.
+
+'reference' reads one whole request at once. 'check' parses the bytes with RequestParser split into chunks
+every way (one byte at a time, inside a multi-byte character, between \\r and \\n) and compares the verdicts:
+the same method, name, phones and items, or IncorrectRequestError - and no other exception.
+The requests pipelined on one connection are parsed one after another up to the first incorrect one,
+bytes without the end of the request are never kept beyond the size limit.
+Used by test_parser.py and by benchmarks/parser_fuzz.py."""
+import random
+from parser_rksok import IncorrectRequestError, RequestParser
+
+
+ENCODING = 'UTF-8'
+PROTOCOL = 'РКСОК/1.0'
+BATCH_PROTOCOL = 'РКСОК-ПАЧКА/1.0'
+METHODS = {'ОТДОВАЙ', 'УДОЛИ', 'ЗОПИШИ'}
+# Small limits, so that the generated requests cross them often.
+MAX_NAME_LEN = 30
+MAX_SIZE = 4096
+MAX_LINES = 50
+MAX_BATCH_ITEMS = 20
+
+ERROR = 'error'
+
+# Adversarial requests with the verdict expected: ERROR or (method, name, phones, items).
+CORPUS = [
+    ('ОТДОВАЙ Иван РКСОК/1.0\r\n\r\n', ('ОТДОВАЙ', 'ИВАН', (), None)),
+    ('ЗОПИШИ  иван  РКСОК/1.0\r\n+7 900\r\n8 800\r\n\r\n', ('ЗОПИШИ', 'ИВАН', ('+7 900', '8 800'), None)),
+    # The length of the name is the length of the uppercased name: 'ß' is 'SS'.
+    ('ОТДОВАЙ ' + 'ß' * 15 + ' РКСОК/1.0\r\n\r\n', ('ОТДОВАЙ', 'SS' * 15, (), None)),
+    ('ОТДОВАЙ ' + 'ß' * 16 + ' РКСОК/1.0\r\n\r\n', ERROR),
+    ('ОТДОВАЙ ' + 'Я' * 30 + ' РКСОК/1.0\r\n\r\n', ('ОТДОВАЙ', 'Я' * 30, (), None)),
+    ('ОТДОВАЙ ' + 'Я' * 31 + ' РКСОК/1.0\r\n\r\n', ERROR),
+    # A name must not contain the protocols, tabs or other unprintable characters.
+    ('ОТДОВАЙ Иван РКСОК/1.0 РКСОК/1.0\r\n\r\n', ERROR),
+    ('ОТДОВАЙ РКСОК-ПАЧКА/1.0 РКСОК/1.0\r\n\r\n', ERROR),
+    ('ОТДОВАЙ Ив\tан РКСОК/1.0\r\n\r\n', ERROR),
+    ('ОТДОВАЙ Ив\nан РКСОК/1.0\r\n\r\n', ERROR),
+    ('ОТДОВАЙ Ив\u00a0ан РКСОК/1.0\r\n\r\n', ERROR),
+    ('ОТДОВАЙ РКСОК/1.0\r\n\r\n', ERROR),
+    ('ОТДОВАЙ   РКСОК/1.0\r\n\r\n', ERROR),
+    ('ОТДОВАЙ Иван РКСОК/1.0 \r\n\r\n', ERROR),
+    ('отдовай Иван РКСОК/1.0\r\n\r\n', ERROR),
+    ('ОТДОВАЙИван РКСОК/1.0\r\n\r\n', ERROR),
+    ('\r\n\r\n', ERROR),
+    ('ЗОПИШИ Иван РКСОК/1.0\r\n' + '1\r\n' * (MAX_LINES - 1) + '\r\n', ('ЗОПИШИ', 'ИВАН', ('1',) * (MAX_LINES - 1), None)),
+    ('ЗОПИШИ Иван РКСОК/1.0\r\n' + '1\r\n' * MAX_LINES + '\r\n', ERROR),
+    ('ЗОПИШИ Иван РКСОК/1.0\r\n' + 'x' * MAX_SIZE + '\r\n\r\n', ERROR),
+    # A tab in a phone would split it in the responses to batch lookups.
+    ('ЗОПИШИ Иван РКСОК/1.0\r\n+7 900\t8 800\r\n\r\n', ERROR),
+    ('ОТДОВАЙ Иван РКСОК/1.0\r\n\t\r\n\r\n', ERROR),
+    ('ОТДОВАЙ \tИван\t РКСОК/1.0\r\n\r\n', ('ОТДОВАЙ', 'ИВАН', (), None)),
+    ('ОТДОВАЙ 2 РКСОК-ПАЧКА/1.0\r\nиван\r\nпетя\t1\t2\r\n\r\n', \
+        ('ОТДОВАЙ', '2', (), (('ИВАН', ()), ('ПЕТЯ', ('1', '2'))))),
+    ('ОТДОВАЙ 3 РКСОК-ПАЧКА/1.0\r\nиван\r\nпетя\r\n\r\n', ERROR),
+    ('ОТДОВАЙ 0 РКСОК-ПАЧКА/1.0\r\n\r\n', ERROR),
+    # An empty phone would end the response to a plain ОТДОВАЙ of the name.
+    ('ЗОПИШИ 1 РКСОК-ПАЧКА/1.0\r\nиван\t\r\n\r\n', ERROR),
+    ('ЗОПИШИ 1 РКСОК-ПАЧКА/1.0\r\nиван\t1\t\t2\r\n\r\n', ERROR),
+    ('ЗОПИШИ 1 РКСОК-ПАЧКА/1.0\r\n\t1\r\n\r\n', ERROR),
+    (f'ЗОПИШИ {MAX_BATCH_ITEMS + 1} РКСОК-ПАЧКА/1.0\r\n' + 'а\t1\r\n' * (MAX_BATCH_ITEMS + 1) + '\r\n', ERROR),
+]
+# Bytes that are not UTF-8, and bytes that never end.
+CORPUS_BYTES = [
+    ('ОТДОВАЙ Ив'.encode(ENCODING) + b'\xff' + ' РКСОК/1.0\r\n\r\n'.encode(ENCODING), ERROR),
+    ('ОТДОВАЙ Ив'.encode(ENCODING) + 'а'.encode(ENCODING)[:1] + ' РКСОК/1.0\r\n\r\n'.encode(ENCODING), ERROR),
+    ('ЗОПИШИ Иван РКСОК/1.0\r\n'.encode(ENCODING) + b'1' * (MAX_SIZE * 4), ERROR),
+    ('ЗОПИШИ Иван РКСОК/1.0\r\n'.encode(ENCODING) + b'1\r\n' * (MAX_LINES * 4), ERROR),
+    (b'GET / HTTP/1.1\r\nHost: x\r\n\r\n', ERROR),
+]
+
+NAME_CHARS = 'абвгдеёжзиклмнопрстуфхцчшщъыьэюяABCxyzß ﬁ0123456789-\'.\t\n\r\u00a0\u200b😀'
+PHONE_CHARS = '0123456789+-() xабв\t 😀'
+
+
+def make_parser() -> RequestParser:
+    return RequestParser(METHODS, PROTOCOL, ENCODING, MAX_NAME_LEN, MAX_SIZE, MAX_LINES, BATCH_PROTOCOL, \
+        MAX_BATCH_ITEMS)
+
+
+def reference(request: bytes):
+    """The verdict of the protocol on one whole request ending with an empty line:
+    ERROR or (method, name, phones, items)."""
+    if len(request) > MAX_SIZE:
+        return ERROR
+    try:
+        text = request.decode(ENCODING)
+    except UnicodeDecodeError:
+        return ERROR
+    first, *rest = text[:-4].split('\r\n')
+    words = first.split(' ')
+    method = words[0]
+    if method not in METHODS or len(words) < 3:
+        return ERROR
+    if words[-1] == BATCH_PROTOCOL:
+        count = ' '.join(words[1:-1]).strip()
+        if count != str(len(rest)) or not 1 <= len(rest) <= MAX_BATCH_ITEMS:
+            return ERROR
+        items = []
+        for line in rest:
+            fields = line.split('\t')
+            name, phones = fields[0].strip().upper(), tuple(fields[1:])
+            if not is_name(name) or '' in phones:
+                return ERROR
+            items.append((name, phones))
+        return method, count, (), tuple(items)
+    if words[-1] != PROTOCOL or len(rest) + 1 > MAX_LINES:
+        return ERROR
+    name = ' '.join(words[1:-1]).strip().upper()
+    if not is_name(name) or any('\t' in phone for phone in rest):
+        return ERROR
+    return method, name, tuple(rest), None
+
+
+def is_name(name: str) -> bool:
+    return 1 <= len(name) <= MAX_NAME_LEN and all(char.isprintable() for char in name) \
+        and PROTOCOL not in name and BATCH_PROTOCOL not in name
+
+
+def incomplete(data: bytes):
+    """The verdict on the bytes of a request without its end: None, or ERROR if they are incorrect already -
+    they do not start with a method, or are over the size or the line limit."""
+    methods = tuple(f'{method} '.encode(ENCODING) for method in METHODS)
+    if (len(data) >= max(map(len, methods)) or b'\r\n' in data) and not data.startswith(methods):
+        return ERROR
+    if len(data) > MAX_SIZE or data.count(b'\r\n') > max(MAX_LINES, MAX_BATCH_ITEMS + 1):
+        return ERROR
+    return None
+
+
+def expected(stream: bytes) -> list:
+    """The verdicts of the requests of the stream up to the first incorrect one,
+    then the verdict on the bytes after the last request, if any."""
+    verdicts = []
+    while stream:
+        end = stream.find(b'\r\n\r\n')
+        if end < 0:
+            verdicts.append(incomplete(stream))
+            break
+        verdicts.append(reference(stream[:end + 4]))
+        if verdicts[-1] == ERROR:
+            break
+        stream = stream[end + 4:]
+    return verdicts
+
+
+def parse(chunks: list) -> list:
+    """The verdicts of RequestParser fed with the chunks: requests, ERROR or None for bytes left incomplete."""
+    parser = make_parser()
+    verdicts = []
+    try:
+        for chunk in chunks:
+            request = parser.feed(chunk)
+            while request is not None:
+                verdicts.append((request.method, request.name, request.phones, request.items))
+                request = parser.feed(b'') if parser.has_data() else None
+            # Bytes without the end of the request stay within the size limit.
+            assert len(parser._buffer) <= MAX_SIZE, f'{len(parser._buffer)} bytes kept'
+    except IncorrectRequestError:
+        verdicts.append(ERROR)
+        return verdicts
+    if parser.has_data():
+        verdicts.append(None)
+    return verdicts
+
+
+def chunkings(data: bytes, rng: random.Random) -> list:
+    """Ways to split the bytes: whole, one byte at a time, at random points, at every \\r\\n and inside characters."""
+    ways = [[data]]
+    if len(data) < 2000:
+        ways.append([data[i:i + 1] for i in range(len(data))])
+    cuts = sorted(rng.sample(range(1, len(data)), min(len(data) - 1, rng.randint(1, 8)))) if len(data) > 1 else []
+    ways.append(split_at(data, cuts))
+    ways.append(split_at(data, [i + 1 for i in range(len(data) - 1) if data[i:i + 2] == b'\r\n']))
+    ways.append(split_at(data, [i for i in range(1, len(data)) if 0x80 <= data[i] < 0xc0][:20]))
+    return ways
+
+
+def split_at(data: bytes, cuts: list) -> list:
+    bounds = [0] + cuts + [len(data)]
+    return [data[start:end] for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def random_text(rng: random.Random, chars: str, max_len: int) -> str:
+    return ''.join(rng.choice(chars) for _ in range(rng.randint(0, max_len)))
+
+
+def random_request(rng: random.Random) -> bytes:
+    method = rng.choice(sorted(METHODS) + ['ОТДАВАЙ', 'GET', 'отдовай', ''])
+    if rng.random() < 0.3:
+        items = [random_text(rng, NAME_CHARS, 12) + ''.join(f'\t{random_text(rng, PHONE_CHARS, 6)}' \
+            for _ in range(rng.randint(0, 3))) for _ in range(rng.randint(0, MAX_BATCH_ITEMS + 2))]
+        count = rng.choice([str(len(items)), str(len(items) + 1), f' {len(items)} ', '-1', 'x'])
+        text = f'{method} {count} {BATCH_PROTOCOL}\r\n' + ''.join(f'{item}\r\n' for item in items)
+    else:
+        name = random_text(rng, NAME_CHARS, MAX_NAME_LEN + 5)
+        if rng.random() < 0.1:
+            name += rng.choice([f' {PROTOCOL}', BATCH_PROTOCOL, 'ßß'])
+        protocol = rng.choice([PROTOCOL] * 8 + ['РКСОК/2.0', f'{PROTOCOL} ', ''])
+        phones = [random_text(rng, PHONE_CHARS, 20) or '1' for _ in range(rng.choice([0, 1, 2, 5, MAX_LINES]))]
+        text = f'{method} {name} {protocol}\r\n' + ''.join(f'{phone}\r\n' for phone in phones)
+    return (text + '\r\n').encode(ENCODING)
+
+
+def mutate(data: bytes, rng: random.Random) -> bytes:
+    data = bytearray(data)
+    for _ in range(rng.randint(1, 3)):
+        position = rng.randrange(len(data) + 1)
+        mutation = rng.randrange(6)
+        if mutation == 0 and data:
+            data[min(position, len(data) - 1)] = rng.randrange(256)
+        elif mutation == 1:
+            data[position:position] = b'\r\n'
+        elif mutation == 2:
+            data[position:position] = rng.choice([b'\xff', b'\xd0', b'\xc3\x9f', b'\t', b'\r', b'\n', b' '])
+        elif mutation == 3:
+            del data[position:position + rng.randint(1, 4)]
+        elif mutation == 4:
+            data = data[:position]
+        else:
+            data[position:position] = data[:rng.randint(0, len(data))]
+    return bytes(data)
+
+
+def random_stream(rng: random.Random) -> bytes:
+    """One to three random requests pipelined, mutated half of the time."""
+    stream = b''.join(random_request(rng) for _ in range(rng.choice([1, 1, 2, 3])))
+    return mutate(stream, rng) if rng.random() < 0.5 else stream
+
+
+def check(data: bytes, rng: random.Random, failures: list, verdict=None) -> None:
+    verdicts = expected(data)
+    if verdict is not None and verdicts[:1] != [verdict]:
+        failures.append((data, [data], verdicts[:1], [verdict]))
+        return
+    for chunks in chunkings(data, rng):
+        try:
+            parsed = parse(chunks)
+        except Exception as e:
+            parsed = [f'{e!r}']
+        if parsed != verdicts:
+            failures.append((data, chunks, parsed, verdicts))
+            return
@@ -0,0 +1,40 @@
+"""Graceful restart of the cluster workers."""
+import asyncio
+import sys
+import time
+from cluster_rksok import Supervisor
+
+
+class Service:
+    """The heartbeats of the workers, as StoreService keeps them."""
+
+    def __init__(self):
+        self.heartbeats = {}
+
+
+async def restart_with_broken_workers() -> None:
+    service = Service()
+    supervisor = Supervisor(service, [sys.executable, '-c', 'import time; time.sleep(60)'], 1, 0.5, 0.5)
+    await supervisor.start()
+    old = supervisor._workers[0]
+    service.heartbeats[old.pid] = time.monotonic()
+    spawned = []
+    spawn = supervisor._spawn
+
+    async def spawn_and_remember(number: int) -> None:
+        await spawn(number)
+        spawned.append(supervisor._workers[number])
+
+    supervisor._spawn = spawn_and_remember
+    try:
+        # The new worker sends no heartbeat: it is never ready.
+        await supervisor.restart()
+        assert supervisor._workers[0] is old
+        assert old.returncode is None
+        assert len(spawned) == 1 and spawned[0].returncode is not None
+    finally:
+        await supervisor.stop()
+
+
+def test_restart_keeps_old_worker_when_new_is_not_ready():
+    asyncio.run(restart_with_broken_workers())
@@ -0,0 +1,39 @@
+"""RequestParser against the plain reading of the protocol of parser_reference.py:
+the corpus of adversarial requests and a seeded fuzz run, the bytes split into chunks every way."""
+import random
+import pytest
+from parser_reference import CORPUS, CORPUS_BYTES, ENCODING, MAX_LINES, MAX_NAME_LEN, MAX_SIZE, METHODS, \
+    PROTOCOL, check, random_stream
+from parser_rksok import RequestParser
+
+
+STREAMS = 500
+
+
+def assert_no_failures(failures: list) -> None:
+    assert not failures, '\n'.join(f'{data!r}: parser {parsed}, expected {verdicts}' \
+        for data, _, parsed, verdicts in failures[:5])
+
+
+@pytest.mark.parametrize('data, verdict', [(text.encode(ENCODING), verdict) for text, verdict in CORPUS] + \
+    CORPUS_BYTES)
+def test_corpus(data, verdict):
+    failures = []
+    check(data, random.Random(1), failures, verdict)
+    assert_no_failures(failures)
+
+
+@pytest.mark.parametrize('seed', range(1, 5))
+def test_random_streams(seed):
+    rng = random.Random(seed)
+    failures = []
+    for _ in range(STREAMS):
+        check(random_stream(rng), rng, failures)
+    assert_no_failures(failures)
+
+
+def test_tabs_in_phones_without_batches():
+    """Without the batch protocol there are no batch responses, so the phones may contain tabs."""
+    parser = RequestParser(METHODS, PROTOCOL, ENCODING, MAX_NAME_LEN, MAX_SIZE, MAX_LINES)
+    request = parser.feed('ЗОПИШИ Иван РКСОК/1.0\r\n+7 900\t8 800\r\n\r\n'.encode(ENCODING))
+    assert (request.method, request.name, request.phones) == ('ЗОПИШИ', 'ИВАН', ('+7 900\t8 800',))
@@ -0,0 +1,98 @@
+"""Requests per second of RequestParser against the baseline, on correct requests and on adversarial ones.
+
+The rates are taken relative to the plain reading of parser_reference.py on one request, measured in the same run,
+so that the baseline does not depend on the machine. A scenario fails when it parses more than TOLERANCE
+fewer requests per second than in BASELINE; benchmarks/parser_bench.py gives the absolute figures."""
+import configparser
+import os
+import timeit
+import pytest
+from parser_reference import ENCODING, METHODS, PROTOCOL, reference
+from parser_rksok import IncorrectRequestError, RequestParser
+
+
+TOLERANCE = 0.5
+CHUNK = 1024
+
+
+def read_limits() -> tuple:
+    """The limits of RequestParser the server has by default."""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.ini'), \
+        encoding='UTF-8')
+    return int(config['REQUEST_METHODS']['len_name']), int(config['SETTINGS']['MAX_REQUEST_SIZE']), \
+        int(config['SETTINGS']['MAX_REQUEST_LINES']), config['BATCH']['PROTOCOL'], int(config['BATCH']['MAX_ITEMS'])
+
+
+LIMITS = read_limits()
+MAX_SIZE = LIMITS[1]
+
+NAME = 'Ёжик Туманович'
+GET = f'ОТДОВАЙ {NAME} РКСОК/1.0\r\n\r\n'.encode(ENCODING)
+WRITE = (f'ЗОПИШИ {NAME} РКСОК/1.0\r\n' + '+7 900 000-00-00\r\n' * 90 + '\r\n').encode(ENCODING)
+BATCH = (f'ОТДОВАЙ 100 РКСОК-ПАЧКА/1.0\r\n' + ''.join(f'{NAME} {i}\r\n' for i in range(100)) + '\r\n').encode(ENCODING)
+# Requests of the plain reading per second, the unit of the rates.
+YARDSTICK = (f'ЗОПИШИ {NAME} РКСОК/1.0\r\n' + '+7 900 000-00-00\r\n' * 10 + '\r\n').encode(ENCODING)
+
+
+def split(data: bytes, size: int = CHUNK) -> list:
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+# Chunks of the request and whether it is parsed or rejected.
+SCENARIOS = {
+    'ОТДОВАЙ': ([GET], True),
+    'ОТДОВАЙ 1-byte chunks': (split(GET, 1), True),
+    'ЗОПИШИ 90 phones': (split(WRITE), True),
+    'ЗОПИШИ 90 phones, 1-byte chunks': (split(WRITE, 1), True),
+    'batch ОТДОВАЙ 100': (split(BATCH), True),
+    'rejected: no method': ([b'GET / HTTP/1.1\r\nHost: rksok\r\n\r\n'], False),
+    'rejected: not UTF-8': ([GET[:12] + b'\xff' + GET[12:]], False),
+    'rejected: no end': ([GET[:-4]] + [b'7' * CHUNK] * (MAX_SIZE // CHUNK + 1), False),
+    'rejected: too many lines': ([GET[:-2]] + [b'1\r\n' * (CHUNK // 3)] * 40, False),
+}
+# Requests per second in units of the plain reading.
+BASELINE = {
+    'ОТДОВАЙ': 0.72,
+    'ОТДОВАЙ 1-byte chunks': 0.075,
+    'ЗОПИШИ 90 phones': 0.284,
+    'ЗОПИШИ 90 phones, 1-byte chunks': 0.003,
+    'batch ОТДОВАЙ 100': 0.046,
+    'rejected: no method': 1.06,
+    'rejected: not UTF-8': 1.08,
+    'rejected: no end': 0.017,
+    'rejected: too many lines': 0.265,
+}
+
+
+def parse_or_reject(chunks: list) -> bool:
+    """Feeds the chunks to a new parser, as a new connection would. Returns whether the request is parsed."""
+    parser = RequestParser(METHODS, PROTOCOL, ENCODING, *LIMITS)
+    try:
+        for chunk in chunks:
+            if parser.feed(chunk) is not None:
+                return True
+    except IncorrectRequestError:
+        return False
+    return False
+
+
+def rate(function) -> float:
+    """Returns the best number of calls per second."""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return number / min(timer.repeat(repeat=3, number=number))
+
+
+@pytest.fixture(scope='module')
+def unit() -> float:
+    return rate(lambda: reference(YARDSTICK))
+
+
+@pytest.mark.parametrize('scenario', SCENARIOS)
+def test_requests_per_second(scenario, unit):
+    chunks, parsed = SCENARIOS[scenario]
+    assert parse_or_reject(chunks) == parsed
+    relative = rate(lambda: parse_or_reject(chunks)) / unit
+    assert relative >= BASELINE[scenario] * (1 - TOLERANCE), \
+        f'{scenario}: {relative:.3g} of the plain reading, baseline {BASELINE[scenario]}'
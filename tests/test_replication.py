@@ -0,0 +1,20 @@
+"""ReplicationSource of the primary: the queues of the changes of the followers."""
+import asyncio
+from replication_rksok import ReplicationSource
+
+
+async def close_with_queues() -> tuple:
+    source = ReplicationSource({}, '127.0.0.1', 0, 1, 1)
+    behind, waiting = asyncio.Queue(1), asyncio.Queue(1)
+    behind.put_nowait('change')
+    source._followers.update((behind, waiting))
+    await source.close()
+    return source, behind, waiting
+
+
+def test_close_with_follower_behind():
+    source, behind, waiting = asyncio.run(close_with_queues())
+    # The follower behind is dropped, the waiting one is told to stop.
+    assert source.followers == 1
+    assert behind.get_nowait() == 'change'
+    assert waiting.get_nowait() is None
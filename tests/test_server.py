@@ -0,0 +1,53 @@
+"""server_rksok.py on loopback: the responses to the requests a connection carries one after another."""
+import asyncio
+from rksok_client import AsyncRKSOKClient, RKSOKPhoneBook, ResponseStatus
+
+
+async def pipeline_after_batch_write(port: int) -> list:
+    async with AsyncRKSOKClient('127.0.0.1', port, 1, True) as client:
+        batch = await client.send('ЗОПИШИ 2 РКСОК-ПАЧКА/1.0\r\nиван\t1\t\t2\r\nпетя\t\r\n\r\n'.encode())
+        await client.write('петя', '3')
+        responses = await asyncio.gather(client.get('иван'), client.get('петя'), client.get('нет'))
+        return [batch] + [response.status for response in responses]
+
+
+def test_plain_get_after_batch_write_with_empty_phone(start_server):
+    port = start_server({'SETTINGS.KEEP_ALIVE': 'yes'})
+    batch, *statuses = asyncio.run(pipeline_after_batch_write(port))
+    # The batch is rejected whole, the responses that follow on the connection stay in order.
+    assert batch == 'НИПОНЯЛ РКСОК-ПАЧКА/1.0\r\n\r\n'
+    assert statuses == [ResponseStatus.NOTFOUND, ResponseStatus.OK, ResponseStatus.NOTFOUND]
+
+
+async def write_and_get(port: int) -> list:
+    async with AsyncRKSOKClient('127.0.0.1', port, 1, True) as client:
+        return [await client.send('ЗОПИШИ иван РКСОК/1.0\r\n1\r\n\r\n'.encode()), (await client.get('петя')).status]
+
+
+def test_phonebook_error_answered_busy(start_server):
+    # The log cannot be written: its directory does not exist.
+    port = start_server({'SETTINGS.KEEP_ALIVE': 'yes', 'STORAGE.FSYNC': 'yes', 'STORAGE.WAL': 'missing/name_phone.wal'})
+    write, status = asyncio.run(write_and_get(port))
+    assert write == 'НИПОНЯЛ РКСОК/1.0\r\nСЕРВЕР ЗАНЯТ, ПОПРОБУЙ ПОПОЗЖЕ\r\n\r\n'
+    assert status == ResponseStatus.NOTFOUND
+
+
+def write_batches(port: int) -> tuple:
+    phonebook = RKSOKPhoneBook('127.0.0.1', port, batch_size=2)
+    # The name of the first batch is longer than len_name.
+    results = phonebook.write_phones({'я' * 31: '1', 'иван': '2', 'петя': '3'})
+    return results, phonebook._batches
+
+
+def test_rejected_batch_keeps_batches(start_server):
+    results, batches = write_batches(start_server())
+    assert [status for status, _ in results.values()] == \
+        [ResponseStatus.INCORRECT_REQUEST, ResponseStatus.INCORRECT_REQUEST, ResponseStatus.OK]
+    assert batches is True
+
+
+def test_batches_off_without_batches(start_server):
+    results, batches = write_batches(start_server({'BATCH.ENABLED': 'no'}))
+    assert [status for status, _ in results.values()] == \
+        [ResponseStatus.INCORRECT_REQUEST, ResponseStatus.OK, ResponseStatus.OK]
+    assert batches is False
@@ -0,0 +1,54 @@
+"""The phones of a name packed into one string, in memory and through the disk."""
+import asyncio
+import pytest
+from store_rksok import PhoneBookStore, pack_phones, unpack_phones
+
+
+PHONES = [(), ('',), ('', ''), ('', '1'), ('1', ''), ('1', '', '2'), ('1',), ('+7 900', '8 800')]
+
+
+@pytest.mark.parametrize('phone', PHONES)
+def test_pack_round_trip(phone):
+    assert unpack_phones(pack_phones(phone)) == phone
+
+
+async def write_and_reload(directory) -> tuple:
+    def make_store():
+        return PhoneBookStore(str(directory / 'name_phone.json'), str(directory / 'name_phone.wal'), 1, 100)
+
+    store = make_store()
+    await store.load()
+    await store.save_many([(f'NAME{number}', phone) for number, phone in enumerate(PHONES)])
+    # From the log, then from the snapshot.
+    await store.flush()
+    from_log = make_store()
+    await from_log.load()
+    await store.close()
+    from_snapshot = make_store()
+    await from_snapshot.load()
+    return dict(from_log.items()), dict(from_snapshot.items())
+
+
+def test_phones_reloaded_as_written(tmp_path):
+    written = {f'NAME{number}': phone for number, phone in enumerate(PHONES)}
+    assert asyncio.run(write_and_reload(tmp_path)) == (written, written)
+
+
+async def reload_after_interrupted_compaction(directory) -> tuple:
+    wal = directory / 'name_phone.wal'
+    # The snapshot was not written: the log moved aside is still there, with the new log after it.
+    (directory / 'name_phone.json').write_text('{"ИВАН": ["1"], "ПЕТЯ": ["2"]}')
+    (directory / 'name_phone.wal.old').write_text('["W","ИВАН",["3"]]\n["D","ПЕТЯ"]\n')
+    wal.write_text('["W","ИВАН",["4"]]\n["W","ВАСЯ",["5"]]\n')
+    store = PhoneBookStore(str(directory / 'name_phone.json'), str(wal), 1, 100)
+    await store.load()
+    reloaded = PhoneBookStore(str(directory / 'name_phone.json'), str(wal), 1, 100)
+    await reloaded.load()
+    return dict(store.items()), dict(reloaded.items()), sorted(path.name for path in directory.iterdir())
+
+
+def test_reload_after_interrupted_compaction(tmp_path):
+    loaded, reloaded, files = asyncio.run(reload_after_interrupted_compaction(tmp_path))
+    assert loaded == reloaded == {'ИВАН': ('4',), 'ВАСЯ': ('5',)}
+    # Both logs are folded into the snapshot at load.
+    assert files == ['name_phone.json', 'name_phone.wal']
@@ -0,0 +1,60 @@
+"""The locks of the names: a write of a name waits while the lock of the name is held,
+writes of names under other locks go on, overlapping batches never deadlock."""
+import asyncio
+import random
+from store_rksok import PhoneBookStore
+
+
+def make_store(directory, lock_stripes: int = 16) -> PhoneBookStore:
+    return PhoneBookStore(str(directory / 'name_phone.json'), str(directory / 'name_phone.wal'), 0.005, 50, \
+        fsync=True, lock_stripes=lock_stripes)
+
+
+def other_stripe_name(store: PhoneBookStore, name: str) -> str:
+    return next(f'NAME{number}' for number in range(1000) \
+        if store.lock(f'NAME{number}') is not store.lock(name))
+
+
+async def write_while_locked(directory) -> None:
+    store = make_store(directory)
+    await store.load()
+    store.start()
+    other = other_stripe_name(store, 'ИВАН')
+    try:
+        async with store.lock('ИВАН'):
+            save = asyncio.create_task(store.save('ИВАН', ('1',)))
+            save_many = asyncio.create_task(store.save_many([('ИВАН', ('2',)), ('ИВАН', ('3',))]))
+            remove = asyncio.create_task(store.remove('ИВАН'))
+            # The other name is written and committed meanwhile.
+            await asyncio.wait_for(store.save(other, ('4',)), 5)
+            await asyncio.sleep(0.05)
+            assert not save.done() and not save_many.done() and not remove.done()
+            assert store.get('ИВАН') is None and store.get(other) == ('4',)
+        await asyncio.wait_for(asyncio.gather(save, save_many, remove), 5)
+        # The writes waiting for the lock are made in the order they came.
+        assert store.get('ИВАН') is None and save.result() is None and remove.result() is True
+    finally:
+        await store.close()
+
+
+def test_write_waits_for_lock_of_name(tmp_path):
+    asyncio.run(write_while_locked(tmp_path))
+
+
+async def overlapping_batches(directory) -> None:
+    store = make_store(directory, lock_stripes=8)
+    await store.load()
+    store.start()
+    rng = random.Random(1)
+    names = [f'NAME{number}' for number in range(40)]
+    batches = [rng.sample(names, 8) for _ in range(500)]
+    try:
+        # Batches of the same names in every order: the locks are taken in one order whatever the order of the names.
+        await asyncio.wait_for(asyncio.gather(*(store.save_many([(name, (str(number),)) for name in batch]) \
+            for number, batch in enumerate(batches))), 30)
+    finally:
+        await store.close()
+
+
+def test_overlapping_batches_do_not_deadlock(tmp_path):
+    asyncio.run(overlapping_batches(tmp_path))
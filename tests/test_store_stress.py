@@ -0,0 +1,72 @@
+"""Stress test of the phonebook writes: thousands of concurrent ЗОПИШИ over a few hundred names,
+then the phonebook is reloaded from disk and compared with the one in memory. No write may be lost,
+and the phones of every name must be those of its last acknowledged write, while the log is written
+and compacted under the writes. The locks of the names are tested in test_store_locks.py."""
+import asyncio
+import random
+import pytest
+from store_rksok import PhoneBookStore
+
+
+WRITES = 5000
+NAMES = 300
+BATCH = 5
+
+
+def make_store(directory, fsync: bool) -> PhoneBookStore:
+    # Small thresholds: the log is written and compacted many times while the writes go on.
+    return PhoneBookStore(str(directory / 'name_phone.json'), str(directory / 'name_phone.wal'), 0.005, 50, \
+        fsync=fsync, compact_records=1000, lock_stripes=16)
+
+
+async def write_concurrently(store: PhoneBookStore, many: bool) -> dict:
+    """Fires all the writes at once, with 'save' or with 'save_many' batches of BATCH names.
+    Returns the phones of the last acknowledged write of every name."""
+    rng = random.Random(1)
+    acknowledged = {}
+
+    async def write(number: int) -> None:
+        names = [f'NAME{rng.randrange(NAMES)}' for _ in range(BATCH if many else 1)]
+        items = [(name, (f'+7{number:010}', f'{index}')) for index, name in enumerate(names)]
+        await asyncio.sleep(0)
+        if many:
+            await store.save_many(items)
+        else:
+            await store.save(*items[0])
+        # A write acknowledged later was made later: the commits are acknowledged in the order of the log.
+        for name, phone in items:
+            acknowledged[name] = phone
+
+    await asyncio.gather(*(write(number) for number in range(WRITES)))
+    return acknowledged
+
+
+async def run(directory, fsync: bool, many: bool) -> None:
+    store = make_store(directory, fsync)
+    await store.load()
+    store.start()
+    acknowledged = await write_concurrently(store, many)
+    in_memory = dict(store.items())
+    assert in_memory == acknowledged
+    # The log written so far is replayed over the last snapshot, as after a crash.
+    await store.flush()
+    # A compaction still running would replace the files while they are read.
+    if store._compaction is not None:
+        await asyncio.wait([store._compaction])
+    reloaded = make_store(directory, fsync)
+    await reloaded.load()
+    assert dict(reloaded.items()) == acknowledged
+    await store.close()
+    reloaded = make_store(directory, fsync)
+    await reloaded.load()
+    assert dict(reloaded.items()) == acknowledged
+
+
+@pytest.mark.parametrize('fsync', [False, True])
+def test_concurrent_save(tmp_path, fsync):
+    asyncio.run(run(tmp_path, fsync, many=False))
+
+
+@pytest.mark.parametrize('fsync', [False, True])
+def test_concurrent_save_many(tmp_path, fsync):
+    asyncio.run(run(tmp_path, fsync, many=True))
@@ -1,36 +1,85 @@
-'''Response generation server'''
+'''Response generation server
+
+python vragi-vezde.py [HOST] [PORT] [--approve-ratio R] [--latency MS] [--quiet]
+Without --approve-ratio every request is approved or refused at random.'''
+import argparse
 import asyncio
 import random
 
 
+class Verdicts:
+    '''Approves the given share of requests in a repeatable order: after n requests
+    exactly floor(n * ratio) of them are approved'''
+
+    def __init__(self, ratio):
+        self._ratio = ratio
+        self._requests = 0
+
+    def approve(self):
+        self._requests += 1
+        return int(self._requests * self._ratio) > int((self._requests - 1) * self._ratio)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Test server simulator of "vragi-vezde"')
+    parser.add_argument('host', nargs='?', default='vragi-vezde')
+    parser.add_argument('port', nargs='?', type=int, default=5000)
+    parser.add_argument('--approve-ratio', type=float, help='share of approved requests, 0..1')
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds before each response')
+    parser.add_argument('--quiet', action='store_true', help='do not print requests and responses')
+    return parser.parse_args()
+
+
+args = get_args()
+verdicts = Verdicts(args.approve_ratio) if args.approve_ratio is not None else None
+
+
+def log(message):
+    if not args.quiet:
+        print(message)
+
+
 async def handle_echo(reader, writer):
-    '''Read request, write and send response, close socket connection'''
+    '''Read requests, write and send a response to each one, close socket connection when the client does.
+    Requests end with an empty line, several requests may be sent without waiting for responses'''
 
-    data = await reader.read(1024)
-    message = data.decode('utf-8')
     addr = writer.get_extra_info('peername')
-    print(f"Received {message!r} from {addr!r}")
-    random_response = random.randint(0, 1)
-    if random_response == 0:
-        msg_response = 'МОЖНА РКСОК/1.0\r\n\r\n'
-    else:
-        msg_response = "НИЛЬЗЯ РКСОК/1.0\r\nКто ещё такой? Он тебе зачем?\r\n\r\n"
-    print(f"Send: {msg_response!r}")
-    writer.write(msg_response.encode("utf-8"))
-    await writer.drain()
-    print("Close the connection")
+    while True:
+        try:
+            data = await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            break
+        message = data.decode('utf-8')
+        log(f"Received {message!r} from {addr!r}")
+        if verdicts is not None:
+            approved = verdicts.approve()
+        else:
+            approved = random.randint(0, 1) == 0
+        if approved:
+            msg_response = 'МОЖНА РКСОК/1.0\r\n\r\n'
+        else:
+            msg_response = "НИЛЬЗЯ РКСОК/1.0\r\nКто ещё такой? Он тебе зачем?\r\n\r\n"
+        if args.latency:
+            await asyncio.sleep(args.latency / 1000)
+        log(f"Send: {msg_response!r}")
+        writer.write(msg_response.encode("utf-8"))
+        await writer.drain()
+    log("Close the connection")
     writer.close()
 
 
 async def main():
     '''Start socket'''
     server = await asyncio.start_server(
-        handle_echo, 'vragi-vezde', 5000)
+        handle_echo, args.host, args.port)
     addrs = ', '.join(str(sock.getsockname()) for sock in server.sockets)
-    print(f'Serving on {addrs}')
+    print(f'Serving on {addrs}', flush=True)
     async with server:
         await server.serve_forever()
 
 
 # Start server
-asyncio.run(main())
+try:
+    asyncio.run(main())
+except KeyboardInterrupt:
+    print('The server has been stopped.')